@@ -8,6 +8,7 @@ from invoices.models import CareCode, Patient, Prestation, InvoiceItem, Physicia
     ValidityDate, InvoiceItemBatch
 from invoices.timesheet import Timesheet, TimesheetTask
 from invoices.employee import JobPosition
+from invoices.validators.prestations import validate_prestations
 from invoices.events import EventType, Event
 
 
@@ -77,8 +78,22 @@ class PhysicianSerializer(CountryFieldMixin, serializers.ModelSerializer):
             'fax_number', 'email_address')
 
 
+class PrestationListSerializer(serializers.ListSerializer):
+    def validate(self, attrs):
+        instances = self.instance or []
+        rows = [(instances[index].id if index < len(instances) else None, data) for index, data in enumerate(attrs)]
+        errors = validate_prestations(rows)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return attrs
+
+
 class PrestationSerializer(serializers.ModelSerializer):
     def validate(self, data):
+        if isinstance(self.parent, PrestationListSerializer):
+            # the list serializer validates all the rows at once
+            return data
         instance_id = None
         if self.instance is not None:
             instance_id = self.instance.id
@@ -91,6 +106,7 @@ class PrestationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Prestation
         fields = ('id', 'invoice_item', 'carecode', 'date', 'employee', 'quantity', 'at_home')
+        list_serializer_class = PrestationListSerializer
 
 
 class MedicalPrescriptionSerializer(serializers.ModelSerializer):
@@ -124,13 +140,16 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         model = InvoiceItem
         fields = ('id', 'invoice_number', 'accident_id', 'accident_date', 'invoice_date', 'patient_invoice_date',
                   'invoice_send_date', 'invoice_sent', 'invoice_paid', 'medical_prescription', 'patient', 'prestations',
-                  'is_private')
+                  'is_private', 'total_gross', 'total_net', 'total_participation')
+        read_only_fields = ('total_gross', 'total_net', 'total_participation')
 
 
 class InvoiceItemBatchSerializer(serializers.ModelSerializer):
     class Meta:
         model = InvoiceItemBatch
-        fields = ('id', 'start_date', 'end_date', 'send_date', 'payment_date', 'file')
+        fields = ('id', 'start_date', 'end_date', 'send_date', 'payment_date', 'file', 'total_gross', 'total_net',
+                  'total_participation')
+        read_only_fields = ('total_gross', 'total_net', 'total_participation')
 
 
 class JobPositionSerializer(serializers.ModelSerializer):
@@ -67,6 +67,12 @@ class PrestationViewSet(viewsets.ModelViewSet):
     queryset = Prestation.objects.all()
     serializer_class = PrestationSerializer
 
+    def get_serializer(self, *args, **kwargs):
+        # a list of prestations is created in one request
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super(PrestationViewSet, self).get_serializer(*args, **kwargs)
+
 
 class InvoiceItemViewSet(viewsets.ModelViewSet):
     """
@@ -9,4 +9,14 @@ def timed_job():
     os.system('python manage.py check_events')
 
 
+@scheduler.scheduled_job('interval', minutes=5)
+def calendar_sync_job():
+    os.system('python manage.py drain_calendar_outbox')
+
+
+@scheduler.scheduled_job('cron', hour=2)
+def invoice_totals_job():
+    os.system('python manage.py rebuild_invoice_totals')
+
+
 scheduler.start()
@@ -1,9 +1,8 @@
-from datetime import timedelta
-
 from django.db.models import Q
 
 from invoices.employee import Employee
 from invoices.holidays import HolidayRequest
+from invoices.working_calendar import week_days_before_end, public_holiday_week_days
 
 
 def how_many_hours_taken_in_period(data, public_holidays):
@@ -15,23 +14,19 @@ def how_many_hours_taken_in_period(data, public_holidays):
         Q(start_date__lte=data['end_date'], end_date__gte=data['end_date'])
     ).filter(employee_id=data['user_id']).filter(request_accepted=True).filter(reason__range=(1, 2))
     if len(holiday_requests) > 0:
-        counter = 0
-        for holiday_request in holiday_requests:
-            delta = holiday_request.end_date - holiday_request.start_date
-            date = holiday_request.start_date
-            for i in range(delta.days):
-                if date.weekday() < 5:
-                    counter += 1
-                date = date + timedelta(days=1)
-            number_of_public_holidays = 0
-            for public_holiday in public_holidays:
-                if public_holiday.calendar_date.weekday() < 5:
-                    number_of_public_holidays = number_of_public_holidays + 1
-            counter = counter - number_of_public_holidays
         heures_jour = Employee.objects.get(user_id=data['user_id']).employeecontractdetail_set.filter(
             start_date__lte=data['start_date']).first().number_of_hours / 5
-        return [(counter - number_of_public_holidays) * heures_jour,
-                "explication: ( %d jours congés - %d jours fériés )  x %d nombre h. /j" % (counter,
-                                                                              number_of_public_holidays,
-                                                                              heures_jour)]
+        return hours_taken_in_requests([(r.start_date, r.end_date) for r in holiday_requests],
+                                       [p.calendar_date for p in public_holidays], heures_jour)
     return [0, ""]
+
+
+def hours_taken_in_requests(holiday_requests, public_holidays, heures_jour):
+    """Hours of the (start date, end date) holiday requests, public_holidays being the dates of the period."""
+    number_of_public_holidays = public_holiday_week_days(public_holidays) if holiday_requests else 0
+    counter = int(week_days_before_end([r[0] for r in holiday_requests], [r[1] for r in holiday_requests]).sum()) \
+        - len(holiday_requests) * number_of_public_holidays
+    return [(counter - number_of_public_holidays) * heures_jour,
+            "explication: ( %d jours congés - %d jours fériés )  x %d nombre h. /j" % (counter,
+                                                                          number_of_public_holidays,
+                                                                          heures_jour)]
@@ -1,54 +1,35 @@
 # -*- coding: utf-8 -*-
-from django.http import HttpResponse
-from invoices.invoiceitem_pdf import get_doc_elements
-from reportlab.lib.units import cm
-from reportlab.platypus.doctemplate import SimpleDocTemplate
+from invoices.invoiceitem_pdf import get_doc_chunks
+from invoices.pdf_stream import streaming_pdf_response, STREAM_BATCH_SIZE
 from django.utils.translation import gettext_lazy as _
 
 
-def export_to_pdf(modeladmin, request, queryset):
-    # Create the HttpResponse object with the appropriate PDF headers.
-    response = HttpResponse(content_type='application/pdf')
+def get_content_disposition(queryset):
     # Append invoice number and invoice date
     if len(queryset) != 1:
         _file_name = '-'.join([a.invoice_number for a in queryset.order_by("invoice_number")])
-        response['Content-Disposition'] = 'attachment; filename="invoice%s.pdf"' % (_file_name.replace(" ", "")[:150])
-    else:
-        response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s.pdf"' % (queryset[0].patient.name,
-                                                                                           queryset[0].invoice_number,
-                                                                                           queryset[
-                                                                                               0].invoice_date.strftime(
-                                                                                               '%d-%m-%Y'))
+        return 'attachment; filename="invoice%s.pdf"' % (_file_name.replace(" ", "")[:150])
+
+    return 'attachment; filename="invoice-%s-%s-%s.pdf"' % (queryset[0].patient.name,
+                                                             queryset[0].invoice_number,
+                                                             queryset[0].invoice_date.strftime('%d-%m-%Y'))
+
+
+def cns_pdf_response(queryset, med_p):
+    # rendered in the request, PDF_RENDER_PROCESSES only forks from the RQ worker generating the batches
+    chunks = get_doc_chunks(queryset, med_p, batch_size=STREAM_BATCH_SIZE)
+    return streaming_pdf_response(chunks, get_content_disposition(queryset))
 
-    doc = SimpleDocTemplate(response, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
-    elements = get_doc_elements(queryset, False)
-    doc.build(elements)
 
-    return response
+def export_to_pdf(modeladmin, request, queryset):
+    return cns_pdf_response(queryset, False)
 
 
 export_to_pdf.short_description = _("CNS Invoice")
 
 
 def export_to_pdf_with_medical_prescription_files(modeladmin, request, queryset):
-    # Create the HttpResponse object with the appropriate PDF headers.
-    response = HttpResponse(content_type='application/pdf')
-    # Append invoice number and invoice date
-    if len(queryset) != 1:
-        _file_name = '-'.join([a.invoice_number for a in queryset.order_by("invoice_number")])
-        response['Content-Disposition'] = 'attachment; filename="invoice%s.pdf"' % (_file_name.replace(" ", "")[:150])
-    else:
-        response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s.pdf"' % (queryset[0].patient.name,
-                                                                                           queryset[0].invoice_number,
-                                                                                           queryset[
-                                                                                               0].invoice_date.strftime(
-                                                                                               '%d-%m-%Y'))
-
-    doc = SimpleDocTemplate(response, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
-    elements = get_doc_elements(queryset, True)
-    doc.build(elements)
-
-    return response
+    return cns_pdf_response(queryset, True)
 
 
 export_to_pdf_with_medical_prescription_files.short_description = "Facture CNS (avec Prescriptions inclues)"
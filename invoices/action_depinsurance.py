@@ -1,32 +1,16 @@
 # -*- coding: utf-8 -*-
-from django.http import HttpResponse
-from invoices.invoiceitem_pdf_bis import get_doc_elements
-from reportlab.lib.units import cm
-from reportlab.platypus.doctemplate import SimpleDocTemplate
+from invoices.action import get_content_disposition
+from invoices.invoiceitem_pdf_bis import get_doc_chunks
+from invoices.pdf_stream import streaming_pdf_response, STREAM_BATCH_SIZE
 import hashlib
 
 
 def export_to_pdf2(modeladmin, request, queryset):
-    # Create the HttpResponse object with the appropriate PDF headers.
-    response = HttpResponse(content_type='application/pdf')
-    # Append invoice number and invoice date
-    if len(queryset) != 1:
-        _file_name = '-'.join([a.invoice_number for a in queryset.order_by("invoice_number")])
+    content_disposition = get_content_disposition(queryset)
+    payment_ref = hashlib.sha1(content_disposition.encode("UTF-8")).hexdigest()[:10]
+    chunks = get_doc_chunks(queryset, payment_ref, batch_size=STREAM_BATCH_SIZE)
 
-        response['Content-Disposition'] = 'attachment; filename="invoice%s.pdf"' % (_file_name.replace(" ", "")[:150])
-    else:
-        response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s.pdf"' % (queryset[0].patient.name,
-                                                                                           queryset[0].invoice_number,
-                                                                                           queryset[
-                                                                                               0].invoice_date.strftime(
-                                                                                               '%d-%m-%Y'))
-    payment_ref = hashlib.sha1(response['Content-Disposition'].encode("UTF-8")).hexdigest()[:10]
-
-    doc = SimpleDocTemplate(response, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
-    elements = get_doc_elements(queryset, payment_ref)
-    doc.build(elements)
-
-    return response
+    return streaming_pdf_response(chunks, content_disposition)
 
 
 export_to_pdf2.short_description = "Facture Forfaits soins infi."
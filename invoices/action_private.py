@@ -1,69 +1,71 @@
 # -*- coding: utf-8 -*-
-from django.http import HttpResponse
 from django.utils.timezone import now
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.platypus.doctemplate import SimpleDocTemplate
 from reportlab.platypus.flowables import Spacer, PageBreak
 from reportlab.platypus.para import Paragraph
-from reportlab.platypus.tables import Table, TableStyle
+from reportlab.platypus.tables import Table
 import pytz
 from django.utils.encoding import smart_text
 import decimal
-from constance import config
 from django.utils.translation import gettext_lazy as _
 
+from invoices.pdf_data import billing_config, iter_invoice_items, invoice_pages
+from invoices.pdf_layout import invoice_layout, HEADER_TABLE_STYLE, RECAP_TABLE_STYLE, PRIVATE_PRESTATIONS_TABLE_STYLE
+from invoices.pdf_stream import streaming_pdf_response, STREAM_BATCH_SIZE
+
+
 def pdf_private_invoice(modeladmin, request, queryset):
-    # Create the HttpResponse object with the appropriate PDF headers.
-    response = HttpResponse(content_type='application/pdf')
     # Append invoice number and invoice date
     if len(queryset) != 1:
         _file_name = '-'.join([a.invoice_number for a in queryset.order_by("invoice_number")])
-        response['Content-Disposition'] = 'attachment; filename="invoice%s.pdf"' %(_file_name.replace(" ", "")[:150])
+        content_disposition = 'attachment; filename="invoice%s.pdf"' %(_file_name.replace(" ", "")[:150])
     else:
         if hasattr(queryset[0], 'private_patient'):
-            response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s.pdf"' %(queryset[0].private_patient.name,
-                                                                                              queryset[0].invoice_number,
-                                                                                              queryset[0].invoice_date.strftime('%d-%m-%Y'))
+            content_disposition = 'attachment; filename="invoice-%s-%s-%s.pdf"' %(queryset[0].private_patient.name,
+                                                                                  queryset[0].invoice_number,
+                                                                                  queryset[0].invoice_date.strftime('%d-%m-%Y'))
         elif hasattr(queryset[0], 'patient'):
             _file_name = '-'.join([a.invoice_number for a in queryset.order_by("invoice_number")])
-            response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s.pdf"' %(queryset[0].patient.name,
-                                                                                              queryset[0].invoice_number,
-                                                                                              queryset[0].invoice_date.strftime('%d-%m-%Y'))
+            content_disposition = 'attachment; filename="invoice-%s-%s-%s.pdf"' %(queryset[0].patient.name,
+                                                                                  queryset[0].invoice_number,
+                                                                                  queryset[0].invoice_date.strftime('%d-%m-%Y'))
 
-    elements = []
-    doc = SimpleDocTemplate(response, rightMargin=2*cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1*cm)
-    
+    _payment_ref = _file_name.replace(" ", "")[:10]
+    _recap_date = now().date().strftime('%d-%m-%Y')
+    chunks = get_doc_chunks(queryset, _recap_date, _payment_ref, batch_size=STREAM_BATCH_SIZE)
+
+    return streaming_pdf_response(chunks, content_disposition)
+
+
+def get_doc_chunks(queryset, recap_date, payment_ref, batch_size=None):
     recapitulatif_data = []
+    billing = billing_config()
 
-    for qs in queryset.order_by("invoice_number"):
-        dd = [qs.prestations.all().order_by("date", "carecode__name")[i:i+20] for i in range(0, len(qs.prestations.all()), 20)]
-        for _prestations in dd:
-            _inv = qs.invoice_number + (("" + str(dd.index(_prestations) + 1) + qs.invoice_date.strftime('%m%Y')) if len(dd) > 1 else "")
-            _result = _build_invoices(_prestations, 
-                                      _inv, 
+    for qs in iter_invoice_items(queryset, batch_size):
+        elements = []
+        for _inv, _prestations in invoice_pages(qs):
+            _result = _build_invoices(_prestations,
+                                      _inv,
                                       qs.invoice_date,
                                       qs.medical_prescription,
-                                      qs.accident_id, 
+                                      qs.accident_id,
                                       qs.accident_date,
                                       qs.invoice_send_date,
-                                      qs.patient)
-                                      
+                                      qs.patient,
+                                      billing)
+
             elements.extend(_result["elements"])
             recapitulatif_data.append((_result["invoice_number"], _result["patient_name"], _result["invoice_amount"]))
+        if elements:
+            yield elements
 
-    _payment_ref = _file_name.replace(" ", "")[:10]
-    _recap_date = now().date().strftime('%d-%m-%Y')
-    elements.extend(_build_recap(_recap_date, _payment_ref, recapitulatif_data))
-    doc.build(elements)
-    return response
+    yield _build_recap(recap_date, payment_ref, recapitulatif_data, billing)
 
-def _build_invoices(prestations, invoice_number, invoice_date, prescription_date, accident_id, accident_date, invoice_send_date, patient):
+def _build_invoices(prestations, invoice_number, invoice_date, prescription_date, accident_id, accident_date, invoice_send_date, patient, billing):
     # Draw things on the PDF. Here's where the PDF generation happens.
     # See the ReportLab documentation for the full list of functionality.
     elements = []
+    layout = invoice_layout(billing)
     i = 0
     data = []
     patientSocNumber = '';
@@ -113,11 +115,7 @@ def _build_invoices(prestations, invoice_number, invoice_date, prescription_date
     _total_facture = _compute_sum(data[1:], 7)
     newData.append(('', '', '', 'Total', _compute_sum(data[1:], 4), _compute_sum(data[1:], 5), _compute_sum(data[1:], 6), _compute_sum(data[1:], 7),''))
 
-    headerData = [['IDENTIFICATION DU FOURNISSEUR DE SOINS DE SANTE\n'
-                   + "{0}\n{1}\n{2}\n{3}".format(config.NURSE_NAME, config.NURSE_ADDRESS, config.NURSE_ZIP_CODE_CITY,
-                                                 config.NURSE_PHONE_NUMBER),
-                   'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(config.MAIN_NURSE_CODE)
-                   ], 
+    headerData = [layout.supplier_header,
                   [u'Matricule patient: %s' % smart_text(patientSocNumber.strip()) + "\n"
                    + u'Nom et Pr'+ smart_text("e") + u'nom du patient: %s' % smart_text(patientNameAndFirstName) ,
                    u'Nom: %s' % smart_text(patientName.strip()) +'\n'
@@ -129,57 +127,26 @@ def _build_invoices(prestations, invoice_number, invoice_date, prescription_date
                    + u'Num. accident: %s' % (accident_id if accident_id else "")]]
     
     headerTable = Table(headerData, 2*[10*cm], [2.5*cm, 1*cm, 1.5*cm] )
-    headerTable.setStyle(TableStyle([('ALIGN',(1,1),(-2,-2),'LEFT'),
-                       ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                       ('FONTSIZE', (0,0), (-1,-1), 9),
-                       ('BOX', (0,0), (-1,-1), 0.25, colors.black),
-                       ('SPAN', (1, 1) , (1,2)),
-                       ]))
+    headerTable.setStyle(HEADER_TABLE_STYLE)
     
     
     table = Table(newData, 9*[2*cm], 24*[0.5*cm] )
-    table.setStyle(TableStyle([('ALIGN',(1,1),(-2,-2),'LEFT'),
-                       ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                       ('ALIGN',(0,-1), (-6,-1),'RIGHT'),
-                       ('INNERGRID', (0,-1), (-6,-1), 0, colors.white),
-                       ('ALIGN',(0,-2), (-6,-2),'RIGHT'),
-                       ('INNERGRID', (0,-2), (-6,-2), 0, colors.white),
-                       ('FONTSIZE', (0,0), (-1,-1), 7),
-                       ('BOX', (0,0), (-1,-1), 0.25, colors.black),
-                       ]))
+    table.setStyle(PRIVATE_PRESTATIONS_TABLE_STYLE)
 
     elements.append(headerTable)
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='Center', alignment=TA_CENTER))
     elements.append(Spacer(1, 18))
     if(prescription_date is not None):
-        elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s Ordonnance du %s " %( invoice_number, invoice_date, prescription_date), styles['Heading4']))
+        elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s Ordonnance du %s " %( invoice_number, invoice_date, prescription_date), layout.styles['Heading4']))
     else:
-        elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s " %( invoice_number, invoice_date), styles['Heading4']))
+        elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s " %( invoice_number, invoice_date), layout.styles['Heading4']))
     elements.append(Spacer(1, 18))
 
     elements.append(table)
 
-    _2derniers_cases = Table([["", "Paiement Direct"]], [1*cm, 4*cm], 1*[0.5*cm], hAlign='LEFT' )
-    _2derniers_cases.setStyle(TableStyle([('ALIGN',(1,1),(-2,-2),'RIGHT'),
-                       ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                       ('FONTSIZE', (0,0), (-1,-1), 9),
-                       ('BOX', (0,0), (0,0), 0.75, colors.black),
-                       ('SPAN', (1, 1) , (1,2)),
-                       ]))
-    
     elements.append(Spacer(1, 18))
-    
-    elements.append(_2derniers_cases)
-    _2derniers_cases = Table([["", "Tiers payant"]], [1*cm, 4*cm], 1*[0.5*cm], hAlign='LEFT' )
-    _2derniers_cases.setStyle(TableStyle([('ALIGN',(1,1),(-2,-2),'RIGHT'),
-                       ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                       ('FONTSIZE', (0,0), (-1,-1), 9),
-                       ('BOX', (0,0), (0,0), 0.75, colors.black),
-                       ('SPAN', (1, 1) , (1,2)),
-                       ]))
+    elements.append(layout.direct_payment())
     elements.append(Spacer(1, 18))
-    elements.append(_2derniers_cases)
+    elements.append(layout.third_party_payment())
     elements.append(Spacer(1, 18))
 
     elements.append(PageBreak())
@@ -201,15 +168,13 @@ def _compute_sum(data, position):
     return round(sum, 2)
 
 
-def _build_recap(_recap_date, _recap_ref, recaps):
+def _build_recap(_recap_date, _recap_ref, recaps, billing):
     """
     """
     elements = []
+    layout = invoice_layout(billing)
 
-    _intro = Table([[
-        u"Veuillez trouver ci-joint le récapitulatif des factures ainsi que le montant total à payer"]],
-        [10 * cm, 5 * cm], 1 * [0.5 * cm], hAlign='LEFT')
-    elements.append(_intro)
+    elements.append(layout.recap_intro())
     elements.append(Spacer(1, 18))
 
     data = []
@@ -225,11 +190,7 @@ def _build_recap(_recap_date, _recap_ref, recaps):
     data.append(("", "", u"à reporter", round(total, 2), ""))
 
     table = Table(data, [2*cm, 3*cm , 7*cm, 3*cm], (i+2)*[0.75*cm] )
-    table.setStyle(TableStyle([('ALIGN',(1,1),(-2,-2),'LEFT'),
-                       ('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                       ('FONTSIZE', (0,0), (-1,-1), 9),
-                       ('BOX', (0,0), (-1,-1), 0.25, colors.black),
-                       ]))
+    table.setStyle(RECAP_TABLE_STYLE)
     elements.append(table)
 
 
@@ -248,8 +209,7 @@ def _build_recap(_recap_date, _recap_ref, recaps):
     elements.append(_total_a_payer)
     elements.append(Spacer(1, 18))
 
-    _infos_iban = Table([[u"Numéro IBAN: %s" % config.MAIN_BANK_ACCOUNT]], [10*cm], 1*[0.5*cm], hAlign='LEFT')
-    elements.append( _infos_iban )
+    elements.append(layout.iban())
 
     return elements
 
@@ -1,20 +1,19 @@
 # -*- coding: utf-8 -*-
 import decimal
 
-from constance import config
 from django.http import HttpResponse
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.platypus.doctemplate import SimpleDocTemplate
 from reportlab.platypus.flowables import Spacer, PageBreak
 from reportlab.platypus.para import Paragraph
-from reportlab.platypus.tables import Table, TableStyle
+from reportlab.platypus.tables import Table
 from django.utils.timezone import now
 from django.utils.encoding import smart_text
 from django.utils.translation import gettext_lazy as _
 
+from invoices.pdf_data import billing_config, prefetch_invoice_items, invoice_pages
+from invoices.pdf_layout import invoice_layout, HEADER_TABLE_STYLE, RECAP_TABLE_STYLE, CNS_PRESTATIONS_TABLE_STYLE
+
 def pdf_private_invoice_pp(modeladmin, request, queryset):
     # Create the HttpResponse object with the appropriate PDF headers.
     response = HttpResponse(content_type='application/pdf')
@@ -37,12 +36,10 @@ def pdf_private_invoice_pp(modeladmin, request, queryset):
 
     recapitulatif_data = []
 
-    for qs in queryset.order_by("invoice_number"):
-        dd = [qs.prestations.all().order_by("date", "carecode__name")[i:i + 20] for i in
-              range(0, len(qs.prestations.all()), 20)]
-        for _prestations in dd:
-            _inv = qs.invoice_number + (
-            ("" + str(dd.index(_prestations) + 1) + qs.invoice_date.strftime('%m%Y')) if len(dd) > 1 else "")
+    billing = billing_config()
+
+    for qs in prefetch_invoice_items(queryset.order_by("invoice_number")):
+        for _inv, _prestations in invoice_pages(qs):
             _result = _build_invoices(_prestations,
                                       _inv,
                                       qs.invoice_date,
@@ -50,22 +47,24 @@ def pdf_private_invoice_pp(modeladmin, request, queryset):
                                       qs.accident_id,
                                       qs.accident_date,
                                       qs.patient_invoice_date,
-                                      qs.patient)
+                                      qs.patient,
+                                      billing)
 
             elements.extend(_result["elements"])
             recapitulatif_data.append((_result["invoice_number"], _result["patient_name"], _result["invoice_pp"]))
             elements.append(PageBreak())
 
-    elements.extend(_build_recap(_recap_date, _payment_ref, recapitulatif_data))
+    elements.extend(_build_recap(_recap_date, _payment_ref, recapitulatif_data, billing))
     doc.build(elements)
     return response
 
 
 def _build_invoices(prestations, invoice_number, invoice_date, prescription_date, accident_id, accident_date,
-                    patient_invoice_date, patient):
+                    patient_invoice_date, patient, billing):
     # Draw things on the PDF. Here's where the PDF generation happens.
     # See the ReportLab documentation for the full list of functionality.
     elements = []
+    layout = invoice_layout(billing)
     i = 0
     data = []
     patientSocNumber = ''
@@ -113,13 +112,7 @@ def _build_invoices(prestations, invoice_number, invoice_date, prescription_date
     newData.append(('', '', '', 'Total', "%10.2f" % _compute_sum(data[1:], 4), "%10.2f" % _compute_sum(data[1:], 5),
                     "%10.2f" % _compute_sum(data[1:], 6)))
 
-    headerData = [['IDENTIFICATION DU FOURNISSEUR DE SOINS DE SANTE\n'
-                   + "{0}\n{1}\n{2}\n{3}".format(config.NURSE_NAME,
-                                                 config.NURSE_ADDRESS,
-                                                 config.NURSE_ZIP_CODE_CITY,
-                                                 config.NURSE_PHONE_NUMBER),
-                   'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(config.MAIN_NURSE_CODE)
-                   ],
+    headerData = [layout.supplier_header,
                   [u'Matricule patient: %s' % smart_text(patientSocNumber.strip()) + "\n"
                    + u'Nom et Pr' + smart_text("e") + u'nom du patient: %s' % smart_text(patientNameAndFirstName),
                    u'Nom: %s' % smart_text(patientName.strip()) + '\n'
@@ -131,34 +124,19 @@ def _build_invoices(prestations, invoice_number, invoice_date, prescription_date
                    + u'Num. accident: %s' % (accident_id if accident_id else "")]]
 
     headerTable = Table(headerData, 2 * [10 * cm], [2.5 * cm, 1 * cm, 1.5 * cm])
-    headerTable.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                                     ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                                     ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                     ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                                     ('SPAN', (1, 1), (1, 2)),
-                                     ]))
+    headerTable.setStyle(HEADER_TABLE_STYLE)
 
     table = Table(newData, 9 * [2.5 * cm], 24 * [0.5 * cm])
-    table.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                               ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                               ('ALIGN', (0, -1), (-6, -1), 'RIGHT'),
-                               ('INNERGRID', (0, -1), (-6, -1), 0, colors.white),
-                               ('ALIGN', (0, -2), (-6, -2), 'RIGHT'),
-                               ('INNERGRID', (0, -2), (-6, -2), 0, colors.white),
-                               ('FONTSIZE', (0, 0), (-1, -1), 8),
-                               ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                               ]))
+    table.setStyle(CNS_PRESTATIONS_TABLE_STYLE)
 
     elements.append(headerTable)
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='Center', alignment=TA_CENTER))
     elements.append(Spacer(1, 18))
     if (prescription_date is not None):
         elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s Ordonnance du %s " % (
-        invoice_number, invoice_date, prescription_date), styles['Heading4']))
+        invoice_number, invoice_date, prescription_date), layout.styles['Heading4']))
     else:
         elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s " % (invoice_number, invoice_date),
-                                  styles['Heading4']))
+                                  layout.styles['Heading4']))
 
     elements.append(Spacer(1, 18))
 
@@ -203,15 +181,13 @@ def _compute_sum(data, position):
     return sum
 
 
-def _build_recap(_recap_date, _recap_ref, recaps):
+def _build_recap(_recap_date, _recap_ref, recaps, billing):
     """
     """
     elements = []
+    layout = invoice_layout(billing)
 
-    _intro = Table([[
-                        u"Veuillez trouver ci-joint le récapitulatif des factures ainsi que le montant total à payer"]],
-                   [10 * cm, 5 * cm], 1 * [0.5 * cm], hAlign='LEFT')
-    elements.append(_intro)
+    elements.append(layout.recap_intro())
     elements.append(Spacer(1, 18))
 
     data = []
@@ -227,11 +203,7 @@ def _build_recap(_recap_date, _recap_ref, recaps):
     data.append(("", "", u"à reporter", round(total, 2), ""))
 
     table = Table(data, [2 * cm, 3 * cm, 7 * cm, 3 * cm], (i + 2) * [0.75 * cm])
-    table.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                               ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                               ('FONTSIZE', (0, 0), (-1, -1), 9),
-                               ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                               ]))
+    table.setStyle(RECAP_TABLE_STYLE)
     elements.append(table)
 
     elements.append(Spacer(1, 18))
@@ -250,7 +222,6 @@ def _build_recap(_recap_date, _recap_ref, recaps):
     elements.append(_total_a_payer)
     elements.append(Spacer(1, 18))
 
-    _infos_iban = Table([[u"Numéro IBAN: %s" % config.MAIN_BANK_ACCOUNT]], [10*cm], 1*[0.5*cm], hAlign='LEFT')
-    elements.append(_infos_iban)
+    elements.append(layout.iban())
 
     return elements
@@ -3,11 +3,13 @@ from django.contrib.admin import TabularInline
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin, csrf_protect_m
 from django.contrib.auth.models import User
 from django.core.checks import messages
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseRedirect
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.http import HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
 from django.urls import reverse, path
 from django.utils.html import format_html
+from django.utils.timezone import now
 
 from invoices.action import export_to_pdf
 from invoices.action_private import pdf_private_invoice
@@ -15,13 +17,16 @@ from invoices.action_private_participation import pdf_private_invoice_pp
 from invoices.employee import Employee, EmployeeContractDetail, JobPosition
 from invoices.forms import ValidityDateFormSet, HospitalizationFormSet, \
     PrestationInlineFormSet, \
-    PatientForm, SimplifiedTimesheetForm, SimplifiedTimesheetDetailForm, InvoiceItemForm
-from invoices.holidays import HolidayRequest
+    PatientForm, SimplifiedTimesheetForm, SimplifiedTimesheetDetailForm, InvoiceItemForm, CnsTariffImportForm
+from invoices.holidays import HolidayRequest, with_contract_hours
 from invoices.invaction import make_private, \
     export_xml
 from invoices.models import CareCode, Prestation, Patient, InvoiceItem, Physician, ValidityDate, MedicalPrescription, \
     Hospitalization, InvoiceItemBatch
 from invoices.notifications import notify_holiday_request_validation
+from invoices import pdf_cache
+from invoices.pdf_cache import cached_pdf_response
+from invoices.processors.tariff_import import import_cns_tariffs, parse_cns_csv, open_cns_csv, TariffImportError
 from invoices.timesheet import Timesheet, TimesheetDetail, TimesheetTask, \
     SimplifiedTimesheetDetail, SimplifiedTimesheet, PublicHolidayCalendarDetail, PublicHolidayCalendar
 from invoices.events import EventType, Event
@@ -79,6 +84,34 @@ class CareCodeAdmin(admin.ModelAdmin):
     actions = [make_private, export_xml]
     inlines = [ValidityDateInline]
 
+    def get_urls(self):
+        urls = super(CareCodeAdmin, self).get_urls()
+        custom_urls = [
+            path('import-tariffs/', self.admin_site.admin_view(self.import_tariffs_view),
+                 name='invoices_carecode_import_tariffs'),
+        ]
+        return custom_urls + urls
+
+    def import_tariffs_view(self, request):
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            raise PermissionDenied
+        report = None
+        form = CnsTariffImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            try:
+                report = import_cns_tariffs(parse_cns_csv(open_cns_csv(form.cleaned_data['file'])),
+                                            form.cleaned_data['start_date'],
+                                            dry_run=form.cleaned_data['dry_run'],
+                                            rename=form.cleaned_data['rename'])
+            except (TariffImportError, UnicodeDecodeError) as e:
+                form.add_error('file', str(e))
+        context = dict(self.admin_site.each_context(request),
+                       opts=self.model._meta,
+                       title='Import CNS tariffs',
+                       form=form,
+                       report=report)
+        return TemplateResponse(request, 'admin/invoices/carecode/import_tariffs.html', context)
+
 
 class EmployeeContractDetailInline(TabularInline):
     extra = 0
@@ -210,7 +243,8 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     from invoices.action_depinsurance import export_to_pdf2
     form = InvoiceItemForm
     date_hierarchy = 'invoice_date'
-    list_display = ('invoice_number', 'patient', 'invoice_month', 'invoice_sent')
+    list_display = ('invoice_number', 'patient', 'invoice_month', 'invoice_sent', 'total_gross', 'total_net',
+                    'total_participation')
     list_filter = ['invoice_date', 'patient__name', 'invoice_sent']
     search_fields = ['patient__name', 'patient__first_name']
     readonly_fields = ('medical_prescription_preview',)
@@ -240,7 +274,7 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     def response_change(self, request, obj):
         queryset = InvoiceItem.objects.filter(id=obj.id)
         if "_print_cns" in request.POST:
-            return export_to_pdf(self, request, queryset)
+            return cached_pdf_response(pdf_cache.CNS, queryset, lambda: export_to_pdf(self, request, queryset))
             # matching_names_except_this = self.get_queryset(request).filter(name=obj.name).exclude(pk=obj.id)
             # matching_names_except_this.delete()
             # obj.is_unique = True
@@ -248,9 +282,12 @@ class InvoiceItemAdmin(admin.ModelAdmin):
             # self.message_user(request, "This villain is now unique")
             # return HttpResponseRedirect(".")
         if "_print_private_invoice" in request.POST:
-            return pdf_private_invoice(self, request, queryset)
+            # the recap page is dated of the day
+            return cached_pdf_response(pdf_cache.PRIVATE, queryset,
+                                       lambda: pdf_private_invoice(self, request, queryset), extra=(now().date(),))
         if "_print_personal_participation" in request.POST:
-            return pdf_private_invoice_pp(self, request, queryset)
+            return cached_pdf_response(pdf_cache.PERSONAL_PARTICIPATION, queryset,
+                                       lambda: pdf_private_invoice_pp(self, request, queryset))
         return super().response_change(request, obj)
 
     # def response_post_save_change(self, request, obj):
@@ -287,8 +324,49 @@ class InvoiceItemInlineAdmin(admin.TabularInline):
 
 
 class InvoiceItemBatchAdmin(admin.ModelAdmin):
+    class Media:
+        js = [
+            "js/batch-pdf-status.js",
+        ]
+
     inlines = [InvoiceItemInlineAdmin]
-    readonly_fields = ('file',)
+    list_display = ('start_date', 'end_date', 'send_date', 'pdf_status', 'total_gross', 'total_net',
+                    'total_participation')
+    readonly_fields = ('file', 'pdf_status_display')
+    actions = ['generate_pdf']
+
+    def pdf_status_display(self, obj):
+        if obj.pk is None:
+            return ''
+        return format_html('<span class="batch-pdf-status" data-url="{}">{}</span>',
+                           reverse('admin:invoices_invoiceitembatch_pdf_status', args=(obj.pk,)),
+                           obj.pdf_status)
+
+    pdf_status_display.short_description = 'PDF'
+
+    def get_urls(self):
+        urls = super(InvoiceItemBatchAdmin, self).get_urls()
+        custom_urls = [
+            path('<int:batch_id>/pdf-status/', self.admin_site.admin_view(self.pdf_status_view),
+                 name='invoices_invoiceitembatch_pdf_status'),
+        ]
+        return custom_urls + urls
+
+    def pdf_status_view(self, request, batch_id):
+        batch = get_object_or_404(InvoiceItemBatch, pk=batch_id)
+        return JsonResponse({'state': batch.pdf_state,
+                             'progress': batch.pdf_progress,
+                             'total': batch.pdf_total,
+                             'status': batch.pdf_status,
+                             'finished': batch.pdf_state in (None, InvoiceItemBatch.PDF_DONE,
+                                                             InvoiceItemBatch.PDF_FAILED)})
+
+    def generate_pdf(self, request, queryset):
+        from invoices.processors.batch_pdf import schedule_batch_pdf_generation
+        for batch in queryset:
+            schedule_batch_pdf_generation(batch)
+
+    generate_pdf.short_description = 'Generate PDF'
 
 
 admin.site.register(InvoiceItemBatch, InvoiceItemBatchAdmin)
@@ -352,6 +430,10 @@ class HolidayRequestAdmin(admin.ModelAdmin):
     readonly_fields = ('request_accepted', 'validated_by', 'employee', 'request_creator', 'force_creation')
     actions = ['validate_or_invalidate_request', ]
     list_display = ('employee', 'start_date', 'end_date', 'reason', 'request_accepted', 'validated_by', 'hours_taken')
+    list_select_related = ('employee', 'validated_by__user')
+
+    def get_queryset(self, request):
+        return with_contract_hours(super(HolidayRequestAdmin, self).get_queryset(request))
 
     def validate_or_invalidate_request(self, request, queryset):
         if not request.user.is_superuser:
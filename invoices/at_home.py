@@ -0,0 +1,97 @@
+import threading
+import time
+
+from constance import config
+from django.conf import settings
+from django.db.models import Q
+
+
+class AtHomeCareCode:
+    """
+    CareCode of the AT_HOME_CARE_CODE setting, resolved once per process instead of once per saved prestation.
+
+    The CareCode and constance signals drop it; other processes do not receive them and reload it after
+    AT_HOME_CARE_CODE_TIMEOUT seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._care_code = None
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._care_code = None
+
+    def get(self):
+        from invoices.models import CareCode
+
+        timeout = settings.AT_HOME_CARE_CODE_TIMEOUT
+        care_code = self._care_code
+        if care_code is None or time.monotonic() - self._loaded_at > timeout:
+            # outside of the lock: constance saves missing settings, its signal calls invalidate()
+            code = config.AT_HOME_CARE_CODE
+            with self._lock:
+                if self._care_code is None or time.monotonic() - self._loaded_at > timeout:
+                    self._care_code = CareCode.objects.get(code=code)
+                    self._loaded_at = time.monotonic()
+                care_code = self._care_code
+
+        return care_code
+
+
+at_home_care_code = AtHomeCareCode()
+
+
+def pair_at_home_prestations(prestations):
+    """
+    Creates the missing at-home pairs of saved prestations: one query finds the pairs that already exist, one
+    bulk_create adds the others. bulk_create sends no signal, the calendar entries of the pairs are recorded in
+    bulk. Returns the created pairs.
+    """
+    from invoices.backends import google_sync_enabled
+    from invoices.calendar_outbox import CalendarOutboxEntry, record_calendar_changes
+    from invoices.models import Prestation
+    from invoices.totals import refresh_invoice_totals
+
+    candidates = [prestation for prestation in prestations
+                  if prestation.at_home and prestation.at_home_paired_id is None]
+    if not candidates:
+        return []
+
+    care_code = at_home_care_code.get()
+    existing = Prestation.objects.filter(
+        Q(carecode=care_code, invoice_item__in=set(p.invoice_item_id for p in candidates),
+          date__in=set(p.date for p in candidates)) |
+        Q(at_home_paired__in=[p.id for p in candidates])).order_by() \
+        .values_list('invoice_item_id', 'date', 'carecode_id', 'at_home_paired_id')
+    paired_ids = set()
+    paired_dates = set()
+    for invoice_item_id, date, carecode_id, at_home_paired_id in existing:
+        paired_ids.add(at_home_paired_id)
+        if carecode_id == care_code.id:
+            paired_dates.add((invoice_item_id, date))
+
+    pairs = []
+    for prestation in candidates:
+        key = (prestation.invoice_item_id, prestation.date)
+        if prestation.id in paired_ids or key in paired_dates:
+            continue
+        # two at-home prestations at the same time share the pair
+        paired_dates.add(key)
+        pairs.append(Prestation(invoice_item_id=prestation.invoice_item_id,
+                                employee_id=prestation.employee_id,
+                                carecode=care_code,
+                                quantity=prestation.quantity,
+                                date=prestation.date,
+                                at_home=False,
+                                at_home_paired=prestation))
+
+    Prestation.objects.bulk_create(pairs)
+    if pairs:
+        refresh_invoice_totals(set(pair.invoice_item_id for pair in pairs))
+    if pairs and google_sync_enabled():
+        record_calendar_changes(CalendarOutboxEntry.PRESTATION, [pair.id for pair in pairs],
+                                CalendarOutboxEntry.UPDATE)
+
+    return pairs
@@ -0,0 +1,59 @@
+import threading
+
+from constance import config
+from django.conf import settings
+
+GOOGLE = 'google'
+LOCAL = 'local'
+
+_lock = threading.Lock()
+_backends = {}
+
+
+def use_local_backends():
+    return settings.GOOGLE_SERVICES_BACKEND == LOCAL
+
+
+def google_sync_enabled():
+    """
+    Whether the signals push changes to the calendars and the Drive folder permissions: always with the local
+    backends, only when USE_GDRIVE is set with Google.
+    """
+    return use_local_backends() or bool(config.USE_GDRIVE)
+
+
+def _get_backend(name, google_factory, local_factory):
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = local_factory() if use_local_backends() else google_factory()
+
+    return backend
+
+
+def get_drive_storage():
+    from invoices.storages import CustomizedGoogleDriveStorage, LocalDriveStorage
+
+    return _get_backend('drive', CustomizedGoogleDriveStorage, LocalDriveStorage)
+
+
+def get_batch_storage():
+    from invoices.storages import LazyGoogleDriveStorage, LocalDriveStorage
+
+    return _get_backend('batch', LazyGoogleDriveStorage, LocalDriveStorage)
+
+
+def get_prestation_calendar():
+    from invoices.gcalendar import PrestationGoogleCalendar
+    from invoices.gcalendar_local import InMemoryPrestationCalendar
+
+    return _get_backend('prestation_calendar', PrestationGoogleCalendar, InMemoryPrestationCalendar)
+
+
+def get_event_calendar():
+    from invoices.gcalendar2 import PrestationGoogleCalendarSurLu
+    from invoices.gcalendar_local import InMemoryEventCalendar
+
+    return _get_backend('event_calendar', PrestationGoogleCalendarSurLu, InMemoryEventCalendar)
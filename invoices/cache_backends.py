@@ -0,0 +1,105 @@
+import pickle
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from redis import WatchError
+
+
+class RedisCache(BaseCache):
+    """
+    Django cache stored in the Redis server of the RQ queues, shared by the web, worker and clock processes.
+    Integers are stored as such so that incr() updates them in Redis, the other values are pickled.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from worker import conn
+            self._client = conn
+        return self._client
+
+    def _key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _expiry(self, timeout):
+        # milliseconds, None never expires
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else int(timeout * 1000)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        expiry = self._expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            return False
+        return bool(self.client.set(self._key(key, version), _encode(value), px=expiry, nx=True))
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self._key(key, version))
+        return default if value is None else _decode(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expiry = self._expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            self.client.delete(key)
+        else:
+            self.client.set(key, _encode(value), px=expiry)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        expiry = self._expiry(timeout)
+        if expiry is None:
+            return bool(self.client.persist(key)) or bool(self.client.exists(key))
+        return bool(self.client.pexpire(key, max(expiry, 1)))
+
+    def delete(self, key, version=None):
+        return bool(self.client.delete(self._key(key, version)))
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self._key(key, version) for key in keys])
+        return {key: _decode(value) for key, value in zip(keys, values) if value is not None}
+
+    def has_key(self, key, version=None):
+        return bool(self.client.exists(self._key(key, version)))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # missing keys raise ValueError like the other backends, rather than starting from 0
+                    pipe.watch(key)
+                    if not pipe.exists(key):
+                        raise ValueError("Key '%s' not found" % key)
+                    pipe.multi()
+                    pipe.incrby(key, delta)
+                    return pipe.execute()[0]
+                except WatchError:
+                    continue
+
+    def clear(self):
+        # only the keys of the cache, the server also holds the RQ queues
+        keys = list(self.client.scan_iter(match='%s:*' % self.key_prefix))
+        if keys:
+            self.client.delete(*keys)
+
+
+def _encode(value):
+    if type(value) is int:
+        return value
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(value):
+    try:
+        return int(value)
+    except ValueError:
+        return pickle.loads(value)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.cache import cache
+
+
+def _new_version():
+    # versions lost with the cache restart from the clock rather than 0, keys used before are never built again
+    return int(time.time() * 1000)
+
+
+def versions(keys):
+    """The current version stored under each of the keys, the missing ones being initialised."""
+    stored = cache.get_many(keys)
+    for key in keys:
+        if key not in stored:
+            cache.add(key, _new_version(), None)
+            stored[key] = cache.get(key)
+
+    return [stored[key] for key in keys]
+
+
+def bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _new_version(), None)
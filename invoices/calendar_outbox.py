@@ -0,0 +1,106 @@
+import logging
+import threading
+
+from django.db import models, transaction, connection
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+logger = logging.getLogger(__name__)
+
+_pending_sync = threading.local()
+
+
+class CalendarOutboxEntry(models.Model):
+    """
+    Pending Google Calendar change of a Prestation or an Event, written in the transaction that saves or deletes it
+    and sent by the worker. There is at most one entry per object: repeated saves only bump the entry.
+    """
+
+    class Meta:
+        verbose_name = _('Calendar outbox entry')
+        verbose_name_plural = _('Calendar outbox entries')
+        unique_together = ('object_type', 'object_id')
+
+    PRESTATION = 'prestation'
+    EVENT = 'event'
+    OBJECT_TYPES = [
+        (PRESTATION, _('Prestation')),
+        (EVENT, _('Event'))
+    ]
+
+    UPDATE = 1
+    DELETE = 2
+    ACTIONS = [
+        (UPDATE, _('Create or update')),
+        (DELETE, _('Delete'))
+    ]
+
+    object_type = models.CharField(_('Object type'), max_length=20, choices=OBJECT_TYPES)
+    object_id = models.PositiveIntegerField(_('Object id'))
+    action = models.PositiveSmallIntegerField(_('Action'), choices=ACTIONS)
+    calendar_id = models.CharField(_('Calendar'), max_length=254, blank=True, default='')
+    previous_calendar_id = models.CharField(_('Previous calendar'), max_length=254, blank=True, default='')
+    updated_at = models.DateTimeField(_('Updated at'), auto_now=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last error'), blank=True, default='')
+    # set by the drain job sending the entry, a job which died leaves it to the next ones once expired
+    claimed_until = models.DateTimeField(_('Claimed until'), blank=True, null=True)
+
+    def __str__(self):
+        return '%s %s %s' % (self.get_action_display(), self.object_type, self.object_id)
+
+
+def record_calendar_change(object_type, object_id, action, calendar_id='', previous_calendar_id=None):
+    with transaction.atomic():
+        entry = CalendarOutboxEntry.objects.select_for_update() \
+            .filter(object_type=object_type, object_id=object_id).first()
+        if entry is None:
+            entry = CalendarOutboxEntry(object_type=object_type, object_id=object_id)
+        # the object is still in the calendar of the first pending change, the later ones were never sent
+        if previous_calendar_id and not entry.previous_calendar_id:
+            entry.previous_calendar_id = previous_calendar_id
+        if entry.previous_calendar_id == calendar_id:
+            entry.previous_calendar_id = ''
+        entry.action = action
+        entry.calendar_id = calendar_id
+        entry.attempts = 0
+        entry.last_error = ''
+        entry.claimed_until = None
+        entry.save()
+    schedule_calendar_sync()
+
+
+def record_calendar_changes(object_type, object_ids, action, calendar_id=''):
+    """
+    record_calendar_change for many objects with three queries, for the objects saved without signals.
+    """
+    object_ids = set(object_ids)
+    if not object_ids:
+        return
+    entries = CalendarOutboxEntry.objects.filter(object_type=object_type, object_id__in=object_ids)
+    existing_ids = set(entries.values_list('object_id', flat=True))
+    entries.update(action=action, calendar_id=calendar_id, attempts=0, last_error='', claimed_until=None,
+                   updated_at=timezone.now())
+    CalendarOutboxEntry.objects.bulk_create([
+        CalendarOutboxEntry(object_type=object_type, object_id=object_id, action=action, calendar_id=calendar_id)
+        for object_id in object_ids - existing_ids])
+    schedule_calendar_sync()
+
+
+def schedule_calendar_sync():
+    # one drain job per transaction, however many objects it saved. The flag is the list of commit hooks the job
+    # was added to: the connection starts a new one on commit and on the rollback of a transaction or a savepoint.
+    if not connection.in_atomic_block or getattr(_pending_sync, 'hooks', None) is not connection.run_on_commit:
+        transaction.on_commit(_enqueue_calendar_sync)
+        _pending_sync.hooks = connection.run_on_commit if connection.in_atomic_block else None
+
+
+def _enqueue_calendar_sync():
+    from invoices.processors.calendar_sync import enqueue_calendar_sync
+
+    _pending_sync.hooks = None
+    try:
+        enqueue_calendar_sync()
+    except Exception:
+        # the entries stay in the outbox, the clock retries them
+        logger.exception('Could not enqueue the calendar sync')
@@ -1,23 +1,14 @@
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import IntegerField, Max, Q
-from django.db.models.functions import Cast
+from django.db import models, transaction
 from django_countries.fields import CountryField
 
+from invoices import numbering
 from invoices.models import Patient, MedicalPrescription
+from invoices.numbering import peek_invoice_number, reserve_invoice_number, follow_invoice_number
 
 
 def get_default_contractor_invoice_number():
-    default_invoice_number = 0
-    max_invoice_number = ContractorInvoiceItem.objects.filter(Q(invoice_number__iregex=r'^\d+$')).annotate(
-        invoice_number_int=Cast('invoice_number', IntegerField())).aggregate(Max('invoice_number_int'))
-
-    if max_invoice_number['invoice_number_int__max'] is not None:
-        default_invoice_number = max_invoice_number['invoice_number_int__max']
-
-    default_invoice_number += 1
-
-    return default_invoice_number
+    return peek_invoice_number(numbering.CONTRACTOR)
 
 
 class Contractor(models.Model):
@@ -114,6 +105,19 @@ class ContractorInvoiceItem(models.Model):
     medical_prescription = models.ForeignKey(MedicalPrescription, related_name='invoice_items', null=True, blank=True,
                                              help_text='Please chose a Medical Prescription', on_delete=models.SET_NULL)
 
+    def __init__(self, *args, **kwargs):
+        super(ContractorInvoiceItem, self).__init__(*args, **kwargs)
+        self._original_invoice_number = self.__dict__.get('invoice_number')
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                self.invoice_number = reserve_invoice_number(numbering.CONTRACTOR, self.invoice_number, self.pk)
+            elif self.__dict__.get('invoice_number') != self._original_invoice_number:
+                follow_invoice_number(numbering.CONTRACTOR, self.invoice_number)
+            super(ContractorInvoiceItem, self).save(*args, **kwargs)
+        self._original_invoice_number = self.__dict__.get('invoice_number')
+
     def clean(self, *args, **kwargs):
         super(ContractorInvoiceItem, self).clean_fields()
         messages = self.validate(self.id, self.__dict__)
@@ -5,7 +5,9 @@ from django.db import models
 from django.db.models.signals import pre_save, post_delete, post_save
 from django.dispatch import receiver
 
+from invoices.backends import google_sync_enabled
 from invoices.storages import CustomizedGoogleDriveStorage
+from invoices.timesheet_cache import invalidate_timesheet_totals, previous_value, EMPLOYEE, USER
 
 
 class JobPosition(models.Model):
@@ -85,6 +87,8 @@ class EmployeeContractDetail(models.Model):
 def user_pre_save_gservices_permissions(sender, instance, **kwargs):
     from invoices.models import prestation_gcalendar
     from invoices.models import gd_storage
+    if not google_sync_enabled():
+        return
     try:
         origin_user = User.objects.filter(pk=instance.id).get()
         origin_email = origin_user.email
@@ -104,7 +108,7 @@ def user_revoke_gservices_permissions(sender, instance, **kwargs):
     from invoices.models import prestation_gcalendar
     from invoices.models import gd_storage
     email = instance.email
-    if email:
+    if email and google_sync_enabled():
         has_access = False
         prestation_gcalendar.update_calendar_permissions(email, has_access)
         path = CustomizedGoogleDriveStorage.MEDICAL_PRESCRIPTION_FOLDER
@@ -116,7 +120,7 @@ def user_revoke_gservices_permissions(sender, instance, **kwargs):
 def medical_prescription_clean_gdrive_post_delete(sender, instance, **kwargs):
     from invoices.models import gd_storage
     email = instance.user.email
-    if email:
+    if email and google_sync_enabled():
         path = CustomizedGoogleDriveStorage.MEDICAL_PRESCRIPTION_FOLDER
         has_access = instance.has_gdrive_access
         gd_storage.update_folder_permissions_v3(path, email, has_access)
@@ -127,7 +131,7 @@ def medical_prescription_clean_gdrive_post_delete(sender, instance, **kwargs):
 def employee_update_gcalendar_permissions(sender, instance, **kwargs):
     from invoices.models import prestation_gcalendar
     email = instance.user.email
-    if email:
+    if email and google_sync_enabled():
         has_access = instance.has_gcalendar_access
         prestation_gcalendar.update_calendar_permissions(email, has_access)
 
@@ -137,9 +141,24 @@ def employee_revoke_gservices_permissions(sender, instance, **kwargs):
     from invoices.models import prestation_gcalendar
     from invoices.models import gd_storage
     email = instance.user.email
-    if email:
+    if email and google_sync_enabled():
         has_access = False
         prestation_gcalendar.update_calendar_permissions(email, has_access)
         path = CustomizedGoogleDriveStorage.MEDICAL_PRESCRIPTION_FOLDER
         gd_storage.update_folder_permissions_v3(path, email, has_access)
         gd_storage.update_folder_permissions_v3(gd_storage.INVOICEITEM_BATCH_FOLDER, email, has_access)
+
+
+@receiver(pre_save, sender=EmployeeContractDetail, dispatch_uid="contract_detail_remember_employee")
+def contract_detail_remember_employee(sender, instance, **kwargs):
+    instance._previous_employee_id = previous_value(instance, 'employee_link_id')
+
+
+@receiver([post_save, post_delete], sender=EmployeeContractDetail,
+          dispatch_uid="contract_detail_refresh_timesheet_cache")
+def contract_detail_refresh_timesheet_cache(sender, instance, **kwargs):
+    employee_ids = set([instance.employee_link_id, getattr(instance, '_previous_employee_id', None)]) - {None}
+    # the absence hours of a timesheet are computed with the contract of its user
+    user_ids = Employee.objects.filter(id__in=employee_ids).values_list('user_id', flat=True)
+    invalidate_timesheet_totals(*[(EMPLOYEE, employee_id) for employee_id in employee_ids] +
+                                [(USER, user_id) for user_id in user_ids])
@@ -1,17 +1,23 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import hashlib
+
+from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_delete, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 
+from invoices.backends import google_sync_enabled
+from invoices.cache_versions import versions, bump_version
+from invoices.calendar_outbox import CalendarOutboxEntry, record_calendar_change
 from invoices.employee import Employee
-from invoices.gcalendar2 import PrestationGoogleCalendarSurLu
 from invoices.models import Patient
+from invoices.overlaps import overlapping_day_times
+from invoices.timesheet_cache import previous_value
 
 
 class EventType(models.Model):
@@ -108,31 +114,88 @@ class Event(models.Model):
 
 @receiver(pre_save, sender=Event, dispatch_uid="event_update_gcalendar_event")
 def create_or_update_google_calendar(sender, instance, **kwargs):
-    if "soin" == instance.event_type.name:
-        calendar_gcalendar = PrestationGoogleCalendarSurLu()
+    if "soin" == instance.event_type.name and google_sync_enabled():
+        previous_calendar_id = None
         if instance.pk:
-            old_event = Event.objects.get(pk=instance.pk)
-            if old_event.employees != instance.employees:
-                calendar_gcalendar.delete_event(old_event)
-        calendar_gcalendar.update_event(instance)
+            old_event = Event.objects.select_related('employees__user').get(pk=instance.pk)
+            if old_event.employees != instance.employees and old_event.employees is not None:
+                previous_calendar_id = old_event.employees.user.email
+        instance._gcalendar_previous_calendar_id = previous_calendar_id
+
+
+@receiver(post_save, sender=Event, dispatch_uid="event_record_gcalendar_change")
+def record_google_calendar_change(sender, instance, **kwargs):
+    # set by the pre_save receiver when the change has to be synced
+    if '_gcalendar_previous_calendar_id' in instance.__dict__:
+        previous_calendar_id = instance.__dict__.pop('_gcalendar_previous_calendar_id')
+        calendar_id = instance.employees.user.email if instance.employees else ''
+        record_calendar_change(CalendarOutboxEntry.EVENT, instance.id, CalendarOutboxEntry.UPDATE,
+                               calendar_id=calendar_id, previous_calendar_id=previous_calendar_id)
 
 
 @receiver(post_delete, sender=Event, dispatch_uid="event_delete_gcalendar_event")
 def delete_google_calendar(sender, instance, **kwargs):
-    if "soin" == instance.event_type.name:
-        calendar_gcalendar = PrestationGoogleCalendarSurLu()
-        calendar_gcalendar.delete_event(instance)
+    if "soin" == instance.event_type.name and google_sync_enabled():
+        calendar_id = instance.employees.user.email if instance.employees else ''
+        record_calendar_change(CalendarOutboxEntry.EVENT, instance.id, CalendarOutboxEntry.DELETE,
+                               calendar_id=calendar_id)
+
+
+# the rendered calendar of a month is keyed by the version of the month, bumped when one of its events changes, and by
+# the version of the names shown in the events, bumped when a patient, an employee or an event type changes.
+EVENT_CALENDAR_NAMES_VERSION = 'event-calendar-version:names'
+
+
+def _event_calendar_month_version(year, month):
+    return 'event-calendar-version:%s-%s' % (year, month)
+
+
+def event_calendar_key(year, month, withyear=True, events=None):
+    """The cache key of the month rendered with the events queryset, all the events when None."""
+    events_filter = hashlib.md5(str(events.query).encode()).hexdigest() if events is not None else 'all'
+    month_version, names_version = versions([_event_calendar_month_version(year, month),
+                                             EVENT_CALENDAR_NAMES_VERSION])
+    return 'event-calendar:%s-%s:%d:%s:%s:%s' % (year, month, withyear, events_filter, month_version, names_version)
+
+
+def invalidate_event_calendar(*days):
+    for year, month in set((day.year, day.month) for day in days if day is not None):
+        bump_version(_event_calendar_month_version(year, month))
+
+
+@receiver(pre_save, sender=Event, dispatch_uid="event_remember_calendar_day")
+def remember_event_calendar_day(sender, instance, **kwargs):
+    instance._event_calendar_previous_day = previous_value(instance, 'day')
+
+
+@receiver(post_save, sender=Event, dispatch_uid="event_invalidate_calendar")
+@receiver(post_delete, sender=Event, dispatch_uid="event_delete_invalidate_calendar")
+def invalidate_event_calendar_month(sender, instance, **kwargs):
+    invalidate_event_calendar(instance.day, instance.__dict__.pop('_event_calendar_previous_day', None))
+
+
+@receiver(post_save, sender=EventType, dispatch_uid="event_type_invalidate_calendar")
+@receiver(post_delete, sender=EventType, dispatch_uid="event_type_delete_invalidate_calendar")
+@receiver(post_save, sender=Patient, dispatch_uid="patient_invalidate_event_calendar")
+@receiver(post_save, sender=Employee, dispatch_uid="employee_invalidate_event_calendar")
+def invalidate_event_calendar_names(sender, instance, **kwargs):
+    bump_version(EVENT_CALENDAR_NAMES_VERSION)
+
+
+@receiver(post_save, sender=User, dispatch_uid="user_invalidate_event_calendar")
+def invalidate_event_calendar_user_names(sender, instance, update_fields=None, **kwargs):
+    # the logins only update last_login
+    if update_fields is None or 'first_name' in update_fields:
+        bump_version(EVENT_CALENDAR_NAMES_VERSION)
 
 
 def validate_date_range(instance_id, data):
     messages = {}
-    conflicts_count = Event.objects.filter(day=data['day']).filter(
-        Q(time_start_event__range=(data['time_start_event'], data['time_end_event'])) |
-        Q(time_end_event__range=(data['time_start_event'], data['time_end_event'])) |
-        Q(time_start_event__lte=data['time_start_event'], time_end_event__gte=data['time_start_event']) |
-        Q(time_start_event__lte=data['time_end_event'], time_end_event__gte=data['time_end_event'])
-    ).filter(
-        employees_id=data['employees_id']).exclude(
+    if data['time_start_event'] is None:
+        return messages
+    conflicts_count = overlapping_day_times(Event.objects.filter(employees_id=data['employees_id']),
+                                            'day', 'time_start_event', 'time_end_event',
+                                            data['day'], data['time_start_event'], data['time_end_event']).exclude(
         pk=instance_id).count()
     if 0 < conflicts_count:
         messages = {'time_start_event': _("Intersection with other %s") % Event._meta.verbose_name_plural}
@@ -4,8 +4,11 @@ from dal import autocomplete
 from django import forms
 from django.forms import BaseInlineFormSet, ValidationError, ModelForm
 
+from invoices.at_home import pair_at_home_prestations
 from invoices.models import InvoiceItem, MedicalPrescription
 from invoices.timesheet import SimplifiedTimesheet, SimplifiedTimesheetDetail
+from invoices.validators.prestations import validate_prestations
+from invoices.totals import refresh_invoice_totals
 from invoices.widgets import CodeSnWidget
 
 
@@ -38,10 +41,47 @@ class ValidityDateFormSet(BaseInlineFormSet):
 
 
 class PrestationInlineFormSet(BaseInlineFormSet):
+    def _construct_form(self, i, **kwargs):
+        form = super(PrestationInlineFormSet, self)._construct_form(i, **kwargs)
+        # Prestation.clean leaves the checks hitting the database to validate_prestations
+        form.instance.validated_in_batch = True
+        return form
+
     def clean(self):
         super(PrestationInlineFormSet, self).clean()
         if hasattr(self, 'cleaned_data'):
             self.validate_max_limit(self.cleaned_data)
+            self.validate_prestations()
+
+    def save(self, commit=True):
+        for form in self.forms:
+            form.instance.paired_in_batch = True
+            form.instance.totals_in_batch = commit
+        instances = super(PrestationInlineFormSet, self).save(commit)
+        if commit:
+            pair_at_home_prestations(instances)
+            refresh_invoice_totals([self.instance.id] + [instance.invoice_item_id for instance in instances])
+
+        return instances
+
+    def validate_prestations(self):
+        # the rows with field errors are reported as such, their instance may miss its care code or date
+        forms = [form for form in self.forms
+                 if form.cleaned_data and not form.errors and not self._should_delete_form(form)]
+        rows = []
+        for form in forms:
+            prestation = form.instance
+            rows.append((prestation.id, {'id': prestation.id,
+                                         'invoice_item': self.instance,
+                                         'patient': self.instance.patient,
+                                         'carecode_id': prestation.carecode_id,
+                                         'employee_id': prestation.employee_id,
+                                         'date': prestation.date,
+                                         'at_home': prestation.at_home}))
+
+        for form, messages in zip(forms, validate_prestations(rows)):
+            for field, message in messages.items():
+                form.add_error(field if field in form.fields else None, message)
 
     @staticmethod
     def validate_max_limit(cleaned_data):
@@ -179,6 +219,15 @@ class PatientForm(ModelForm):
 
     def __init__(self, *args, **kwargs):
         super(PatientForm, self).__init__(*args, **kwargs)
+
+
+class CnsTariffImportForm(forms.Form):
+    file = forms.FileField(label='CSV file', help_text='name;code;coef;amount rows, as in initialdata')
+    start_date = forms.DateField(label='Tariffs start date', help_text='YYYY-MM-DD')
+    dry_run = forms.BooleanField(label='Dry run', required=False, initial=True,
+                                 help_text='Only show the changes, uncheck to apply them')
+    rename = forms.BooleanField(label='Rename care codes', required=False, initial=False,
+                                help_text='Also replace the names and descriptions of the existing care codes')
 #
 #
 # class PrestationActionForm(forms.Form):
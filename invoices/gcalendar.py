@@ -1,17 +1,46 @@
-import httplib2
+import threading
 import uuid
 import datetime
 
-from apiclient import discovery
 from googleapiclient.errors import HttpError
 from oauth2client.service_account import ServiceAccountCredentials
 from django.conf import settings
 from django.utils import timezone
 
+from invoices import google_clients
+
+
+BATCH_MAX_REQUESTS = 50
+
+
+def execute_batch(service, requests):
+    """
+    Sends the (key, request) pairs in batch requests of BATCH_MAX_REQUESTS and returns the exception of each
+    request by key, None when it succeeded.
+    """
+    errors = {}
+
+    def callback(request_id, response, exception):
+        errors[keys[request_id]] = exception
+
+    for i in range(0, len(requests), BATCH_MAX_REQUESTS):
+        keys = {}
+        batch = service.new_batch_http_request(callback=callback)
+        for key, request in requests[i:i + BATCH_MAX_REQUESTS]:
+            request_id = str(len(keys))
+            keys[request_id] = key
+            batch.add(request, request_id=request_id)
+        batch.execute()
+
+    return errors
+
+
+def is_not_found(error):
+    return isinstance(error, HttpError) and error.resp.status in (404, 410)
+
 
 class PrestationGoogleCalendar:
     summary = 'Prestations'
-    calendar = None
 
     def get_credentials(self):
         credentials = ServiceAccountCredentials.from_json_keyfile_name(self._json_keyfile_path,
@@ -21,25 +50,35 @@ class PrestationGoogleCalendar:
 
     def __init__(self, json_keyfile_path=None):
         """
-        Handles credentials and builds the google service.
+        Nothing is read nor requested here: the credentials, the google service and the calendar are set up on
+        first use and shared by the process.
 
         :param _json_keyfile_path: Path
-        :param user_email: String
-        :raise ValueError:
         """
         self._json_keyfile_path = json_keyfile_path or settings.GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE
+        self._calendar = None
+        self._lock = threading.Lock()
+
+    @property
+    def _service(self):
+        credentials = google_clients.get_credentials(('calendar', self._json_keyfile_path), self.get_credentials)
+        return google_clients.get_service('calendar', 'v3', credentials)
 
-        credentials = self.get_credentials()
-        http = credentials.authorize(httplib2.Http())
-        self._service = discovery.build('calendar', 'v3', http=http)
-        self._set_calendar()
+    @property
+    def calendar(self):
+        if self._calendar is None:
+            with self._lock:
+                if self._calendar is None:
+                    self._set_calendar()
+
+        return self._calendar
 
     def _set_calendar(self):
         calendar = self._get_existing_calendar()
         if calendar is None:
             calendar = self._create_calendar()
 
-        self.calendar = calendar
+        self._calendar = calendar
 
     def _get_existing_calendar(self):
         calendar = None
@@ -63,11 +102,7 @@ class PrestationGoogleCalendar:
     def _get_event_id(prestation_id):
         return str(uuid.uuid5(uuid.NAMESPACE_DNS, 'NURSE_PRESTATION_GCALENDAR' + str(prestation_id)).hex)
 
-    def update_event(self, prestation):
-        now = timezone.now()
-        if prestation.date <= now:
-            return None
-
+    def get_event_body(self, prestation):
         event_id = self._get_event_id(prestation_id=prestation.id)
         descr_line = "<b>%s</b> %s<br>"
         description = descr_line % ('Patient:', prestation.invoice_item.patient)
@@ -91,6 +126,15 @@ class PrestationGoogleCalendar:
             }
         }
 
+        return event_body
+
+    def update_event(self, prestation):
+        now = timezone.now()
+        if prestation.date <= now:
+            return None
+
+        event_body = self.get_event_body(prestation)
+        event_id = event_body['id']
         event = self.get_event(event_id=event_id)
         if event is None:
             event = self._service.events().insert(calendarId=self.calendar['id'], body=event_body).execute()
@@ -100,6 +144,36 @@ class PrestationGoogleCalendar:
 
         return event
 
+    def update_events(self, prestations):
+        """
+        Creates or updates the events of the prestations with batch requests: one update per event then one insert
+        for the events that do not exist yet. Returns the errors by prestation id.
+        """
+        now = timezone.now()
+        bodies = dict((prestation.id, self.get_event_body(prestation)) for prestation in prestations
+                      if prestation.date > now)
+        requests = [(prestation_id, self._service.events().update(calendarId=self.calendar['id'],
+                                                                  eventId=body['id'],
+                                                                  body=body))
+                    for prestation_id, body in bodies.items()]
+        errors = execute_batch(self._service, requests)
+        missing = [prestation_id for prestation_id, error in errors.items() if is_not_found(error)]
+        requests = [(prestation_id, self._service.events().insert(calendarId=self.calendar['id'],
+                                                                  body=bodies[prestation_id]))
+                    for prestation_id in missing]
+        errors.update(execute_batch(self._service, requests))
+
+        return dict((prestation_id, error) for prestation_id, error in errors.items() if error is not None)
+
+    def delete_events(self, prestation_ids):
+        requests = [(prestation_id, self._service.events().delete(calendarId=self.calendar['id'],
+                                                                  eventId=self._get_event_id(prestation_id)))
+                    for prestation_id in prestation_ids]
+        errors = execute_batch(self._service, requests)
+
+        return dict((prestation_id, error) for prestation_id, error in errors.items()
+                    if error is not None and not is_not_found(error))
+
     def delete_event(self, prestation_id):
         event_id = self._get_event_id(prestation_id=prestation_id)
         try:
@@ -2,13 +2,15 @@ import uuid
 import datetime
 
 import pytz
-from apiclient import discovery
 from google.oauth2 import service_account
 from googleapiclient.errors import HttpError
 from oauth2client.service_account import ServiceAccountCredentials
 from django.conf import settings
 from django.utils import timezone
 
+from invoices import google_clients
+from invoices.gcalendar import execute_batch, is_not_found
+
 
 class PrestationGoogleCalendarSurLu:
     summary = 'Prestations'
@@ -26,18 +28,18 @@ class PrestationGoogleCalendarSurLu:
 
     def __init__(self, json_keyfile_path=None):
         """
-        Handles credentials and builds the google service.
+        Nothing is read nor requested here: the credentials and the google service are set up on first use and
+        shared by the process.
 
         :param _json_keyfile_path: Path
-        :param user_email: String
-        :raise ValueError:
         """
         self._json_keyfile_path = json_keyfile_path or settings.GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE2
 
-        credentials = self.get_credentials()
-        # http = credentials.authorize(httplib2.Http())
-        self._service = discovery.build('calendar', 'v3', credentials=credentials)
-        # self._set_calendar()
+    @property
+    def _service(self):
+        credentials = google_clients.get_credentials(('calendar-sur-lu', self._json_keyfile_path),
+                                                     self.get_credentials)
+        return google_clients.get_service('calendar', 'v3', credentials)
 
     def _set_calendar(self):
         calendar = self._get_existing_calendar()
@@ -79,7 +81,7 @@ class PrestationGoogleCalendarSurLu:
     def _get_event_id(event_id):
         return str(uuid.uuid5(uuid.NAMESPACE_DNS, 'NURSE_PRESTATION_GCALENDAR' + str(event_id)).hex)
 
-    def update_event(self, event):
+    def get_event_body(self, event):
         event_id = self._get_event_id(event_id=event.id)
         descr_line = "<b>%s</b> %s<br>"
         description = descr_line % ('Patient:', event.patient)
@@ -118,6 +120,11 @@ class PrestationGoogleCalendarSurLu:
             }
         }
 
+        return event_body
+
+    def update_event(self, event):
+        event_body = self.get_event_body(event)
+        event_id = event_body['id']
         gmail_event = self.get_event(event_id=event_id, calendar_id=event.employees.user.email)
         if gmail_event is None:
             gmail_event = self._service.events().insert(calendarId=event.employees.user.email,
@@ -137,6 +144,34 @@ class PrestationGoogleCalendarSurLu:
 
         return event
 
+    def update_events(self, events):
+        """
+        Creates or updates the events in their employee calendar with batch requests. Returns the errors by event id.
+        """
+        bodies = dict((event.id, (event.employees.user.email, self.get_event_body(event))) for event in events)
+        requests = [(event_id, self._service.events().update(calendarId=calendar_id, eventId=body['id'], body=body))
+                    for event_id, (calendar_id, body) in bodies.items()]
+        errors = execute_batch(self._service, requests)
+        missing = [event_id for event_id, error in errors.items() if is_not_found(error)]
+        requests = [(event_id, self._service.events().insert(calendarId=bodies[event_id][0],
+                                                             body=bodies[event_id][1]))
+                    for event_id in missing]
+        errors.update(execute_batch(self._service, requests))
+
+        return dict((event_id, error) for event_id, error in errors.items() if error is not None)
+
+    def delete_events(self, calendar_events):
+        """
+        Deletes the (event id, calendar id) pairs with batch requests. Returns the errors by pair, events already
+        gone are not errors.
+        """
+        requests = [((event_id, calendar_id),
+                     self._service.events().delete(calendarId=calendar_id, eventId=self._get_event_id(event_id)))
+                    for event_id, calendar_id in calendar_events]
+        errors = execute_batch(self._service, requests)
+
+        return dict((key, error) for key, error in errors.items() if error is not None and not is_not_found(error))
+
     def get_event(self, event_id, calendar_id):
         try:
             event = self._service.events().get(calendarId=calendar_id, eventId=event_id).execute()
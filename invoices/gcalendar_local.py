@@ -0,0 +1,148 @@
+import threading
+import time
+import uuid
+from copy import deepcopy
+
+import httplib2
+from django.conf import settings
+from googleapiclient.errors import HttpError
+
+from invoices.gcalendar import PrestationGoogleCalendar
+from invoices.gcalendar2 import PrestationGoogleCalendarSurLu
+
+
+class InMemoryCalendarService:
+    """
+    Stand-in for the Google Calendar v3 service covering the calls made by the calendar classes. Every request,
+    and every batch request, waits latency seconds as a round trip to Google would.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = settings.LOCAL_CALENDAR_LATENCY if latency is None else latency
+        self.requests_count = 0
+        self._lock = threading.Lock()
+        self._calendars = {}
+        self._events = {}
+        self._acl = {}
+
+    def calendarList(self):
+        return _Resource(self, list=lambda **kwargs: {'items': list(self._calendars.values())})
+
+    def calendars(self):
+        return _Resource(self, insert=self._insert_calendar)
+
+    def events(self):
+        return _Resource(self, get=self._get_event, insert=self._insert_event, update=self._update_event,
+                         delete=self._delete_event)
+
+    def acl(self):
+        return _Resource(self, list=lambda calendarId: {'items': list(self._acl.get(calendarId, {}).values())},
+                         insert=self._insert_rule, delete=self._delete_rule)
+
+    def new_batch_http_request(self, callback=None):
+        return _BatchRequest(self, callback)
+
+    def execute(self, function, kwargs):
+        self.wait()
+        with self._lock:
+            return function(**kwargs)
+
+    def wait(self):
+        with self._lock:
+            self.requests_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _insert_calendar(self, body):
+        calendar = dict(body, id=uuid.uuid4().hex)
+        self._calendars[calendar['id']] = calendar
+        return deepcopy(calendar)
+
+    def _get_event(self, calendarId, eventId):
+        if (calendarId, eventId) not in self._events:
+            raise _not_found()
+        return deepcopy(self._events[(calendarId, eventId)])
+
+    def _insert_event(self, calendarId, body):
+        if (calendarId, body['id']) in self._events:
+            raise HttpError(httplib2.Response({'status': 409}), b'Conflict')
+        self._events[(calendarId, body['id'])] = deepcopy(body)
+        return deepcopy(body)
+
+    def _update_event(self, calendarId, eventId, body):
+        self._get_event(calendarId, eventId)
+        self._events[(calendarId, eventId)] = deepcopy(body)
+        return deepcopy(body)
+
+    def _delete_event(self, calendarId, eventId):
+        self._get_event(calendarId, eventId)
+        del self._events[(calendarId, eventId)]
+
+    def _insert_rule(self, calendarId, body):
+        rule = dict(body, id='user:%s' % body['scope']['value'])
+        self._acl.setdefault(calendarId, {})[rule['id']] = rule
+        return rule
+
+    def _delete_rule(self, calendarId, ruleId):
+        self._acl.get(calendarId, {}).pop(ruleId, None)
+
+
+class _Resource:
+    def __init__(self, service, **methods):
+        self._service = service
+        self._methods = methods
+
+    def __getattr__(self, name):
+        return lambda **kwargs: _Request(self._service, self._methods[name], kwargs)
+
+
+class _Request:
+    def __init__(self, service, function, kwargs):
+        self.service = service
+        self.function = function
+        self.kwargs = kwargs
+
+    def execute(self):
+        return self.service.execute(self.function, self.kwargs)
+
+
+class _BatchRequest:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        self.requests.append((request_id or str(len(self.requests)), request, callback or self.callback))
+
+    def execute(self):
+        self.service.wait()
+        for request_id, request, callback in self.requests:
+            response, exception = None, None
+            try:
+                with self.service._lock:
+                    response = request.function(**request.kwargs)
+            except HttpError as e:
+                exception = e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+def _not_found():
+    return HttpError(httplib2.Response({'status': 404}), b'Not Found')
+
+
+class InMemoryPrestationCalendar(PrestationGoogleCalendar):
+    _service = None
+
+    def __init__(self, service=None):
+        super(InMemoryPrestationCalendar, self).__init__()
+        self._service = service or InMemoryCalendarService()
+
+
+class InMemoryEventCalendar(PrestationGoogleCalendarSurLu):
+    _service = None
+
+    def __init__(self, service=None):
+        super(InMemoryEventCalendar, self).__init__()
+        self._service = service or InMemoryCalendarService()
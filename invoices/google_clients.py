@@ -0,0 +1,59 @@
+import json
+import threading
+
+import httplib2
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+
+_lock = threading.Lock()
+_credentials = {}
+_discovery_documents = {}
+_local = threading.local()
+
+
+def get_credentials(key, factory):
+    """
+    Returns the credentials built by factory for key, once per process. The authorized http objects refresh the
+    shared credentials when their token expires.
+    """
+    credentials = _credentials.get(key)
+    if credentials is None:
+        with _lock:
+            credentials = _credentials.get(key)
+            if credentials is None:
+                credentials = _credentials[key] = factory()
+
+    return credentials
+
+
+def get_discovery_document(api, version):
+    document = _discovery_documents.get((api, version))
+    if document is None:
+        with _lock:
+            document = _discovery_documents.get((api, version))
+            if document is None:
+                uri = discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+                response, content = httplib2.Http().request(uri)
+                if response.status >= 400:
+                    raise HttpError(response, content, uri=uri)
+                document = _discovery_documents[(api, version)] = json.loads(content)
+
+    return document
+
+
+def get_service(api, version, credentials):
+    """
+    Returns the service of the api for the credentials. httplib2 is not thread safe so each thread builds its own
+    service, from the discovery document fetched once per process.
+    """
+    services = getattr(_local, 'services', None)
+    if services is None:
+        services = _local.services = {}
+    key = (api, version, id(credentials))
+    service = services.get(key)
+    if service is None:
+        service = services[key] = discovery.build_from_document(get_discovery_document(api, version),
+                                                                credentials=credentials)
+
+    return service
+
@@ -1,19 +1,22 @@
 # -*- coding: utf-8 -*-
-from datetime import date, timedelta
+from datetime import date
 
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django_currentuser.db.models import CurrentUserField
 
 from helpers.employee import get_admin_emails
-from invoices.employee import Employee
+from invoices.employee import Employee, EmployeeContractDetail
 from invoices.notifications import send_email_notification
+from invoices.overlaps import overlapping_dates
+from invoices.timesheet_cache import invalidate_timesheet_totals, previous_value, USER
 from invoices.validators import validators
+from invoices.working_calendar import leave_hours
 
 
 class HolidayRequest(models.Model):
@@ -49,26 +52,14 @@ class HolidayRequest(models.Model):
 
     @property
     def hours_taken(self):
-        import holidays
-        lu_holidays = holidays.Luxembourg()
-        counter = 0
-        delta = self.end_date - self.start_date
-        date_comp = self.start_date
-        jours_feries = 0
         if self.reason > 1:
             return "Non applicable"
-        for i in range(delta.days + 1):
-            if date_comp.weekday() < 5:
-                counter += 1
-            if date_comp in lu_holidays:
-                jours_feries = jours_feries + 1
-            date_comp = date_comp + timedelta(days=1)
-        hours_jour = Employee.objects.get(user_id=self.employee.id).employeecontractdetail_set.filter(
-            start_date__lte=self.start_date).first().number_of_hours / 5
-        return [(counter - jours_feries) * hours_jour,
-                "explication: ( %d jours congés - %d jours fériés )  x %d nombre h. /j" % (counter,
-                                                                                           jours_feries,
-                                                                                           hours_jour)]
+        if hasattr(self, 'contract_hours'):
+            number_of_hours = self.contract_hours
+        else:
+            number_of_hours = Employee.objects.get(user_id=self.employee.id).employeecontractdetail_set.filter(
+                start_date__lte=self.start_date).first().number_of_hours
+        return leave_hours(self.start_date, self.end_date, number_of_hours / 5)
 
     def clean(self, *args, **kwargs):
         exclude = []
@@ -107,15 +98,20 @@ class HolidayRequest(models.Model):
             self.employee, self.REASONS[self.reason - 1][1], self.start_date, self.end_date)
 
 
+def with_contract_hours(queryset):
+    """
+    Annotates the holiday requests with the weekly hours of the contract of their employee at their start date,
+    hours_taken reads them instead of querying the contract of each request.
+    """
+    contract_details = EmployeeContractDetail.objects.filter(employee_link__user_id=OuterRef('employee_id'),
+                                                             start_date__lte=OuterRef('start_date')).order_by('id')
+    return queryset.annotate(contract_hours=Subquery(contract_details.values('number_of_hours')[:1]))
+
+
 def validate_date_range(instance_id, data):
     messages = {}
-    conflicts_count = HolidayRequest.objects.filter(
-        Q(start_date__range=(data['start_date'], data['end_date'])) |
-        Q(end_date__range=(data['start_date'], data['end_date'])) |
-        Q(start_date__lte=data['start_date'], end_date__gte=data['start_date']) |
-        Q(start_date__lte=data['end_date'], end_date__gte=data['end_date'])
-    ).filter(
-        employee_id=data['employee_id']).exclude(
+    conflicts_count = overlapping_dates(HolidayRequest.objects.filter(employee_id=data['employee_id']),
+                                        'start_date', 'end_date', data['start_date'], data['end_date']).exclude(
         pk=instance_id).count()
     if 0 < conflicts_count:
         messages = {'start_date': "Intersection avec d'autres demandes"}
@@ -124,8 +120,8 @@ def validate_date_range(instance_id, data):
 
 def validate_requests_from_other_employees(instance_id, data):
     messages = {}
-    conflicts = HolidayRequest.objects.filter(end_date__lte=data['end_date'], end_date__gte=data['start_date']) | \
-                HolidayRequest.objects.filter(start_date__gte=data['start_date'], start_date__lte=data['end_date'])
+    conflicts = overlapping_dates(HolidayRequest.objects, 'start_date', 'end_date', data['start_date'],
+                                  data['end_date'])
     conflicts = conflicts.filter(request_accepted=True).filter(reason=1).exclude(employee_id=data['employee_id']).exclude(pk=instance_id)
     if 0 < conflicts.count():
         for conflict in conflicts:
@@ -143,3 +139,14 @@ def notify_holiday_request_creation(sender, instance, created, **kwargs):
         send_email_notification('A new holiday request from %s' % instance,
                                 'please validate. %s' % url,
                                 to_emails)
+
+
+@receiver(pre_save, sender=HolidayRequest, dispatch_uid="holiday_request_remember_user")
+def holiday_request_remember_user(sender, instance, **kwargs):
+    instance._previous_employee_id = previous_value(instance, 'employee_id')
+
+
+@receiver([post_save, post_delete], sender=HolidayRequest, dispatch_uid="holiday_request_refresh_timesheet_cache")
+def holiday_request_refresh_timesheet_cache(sender, instance, **kwargs):
+    invalidate_timesheet_totals((USER, instance.employee_id),
+                                (USER, getattr(instance, '_previous_employee_id', None)))
@@ -3,53 +3,116 @@ import sys
 import os
 
 from io import BytesIO
+
+from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.platypus.flowables import Spacer, PageBreak, Image
 from reportlab.platypus.para import Paragraph
-from reportlab.platypus.tables import Table, TableStyle
+from reportlab.platypus.tables import Table
 from reportlab.platypus.doctemplate import SimpleDocTemplate
 import pytz
 from django.utils.encoding import smart_text
 import decimal
-from constance import config
+
+from invoices.pdf_data import billing_config, iter_invoice_items, invoice_pages
+from invoices.pdf_layout import invoice_layout, HEADER_TABLE_STYLE, RECAP_TABLE_STYLE, FINAL_PAGE_TOTAL_STYLE, \
+    CNS_PRESTATIONS_TABLE_STYLE
+from invoices.prescription_images import prefetch_prescription_images, prescription_image, PRINT_WIDTH, \
+    PRINT_HEIGHT
 
 
 def get_doc_elements(queryset, med_p=False):
     elements = []
+    for chunk in get_doc_chunks(queryset, med_p):
+        elements.extend(chunk)
+
+    return elements
+
+
+def get_doc_chunks(queryset, med_p=False, batch_size=None):
+    """Yields the flowables invoice by invoice, then the recap and final page built from the running totals."""
     summary_data = []
     already_added_images = []
-    for qs in queryset.order_by("invoice_number"):
-        dd = [qs.prestations.all().order_by("date", "carecode__name")[i:i + 20] for i in
-              range(0, len(qs.prestations.all()), 20)]
-        for _prestations in dd:
-            _inv = qs.invoice_number + (
-                ("" + str(dd.index(_prestations) + 1) + qs.invoice_date.strftime('%m%Y')) if len(dd) > 1 else "")
-            _result = _build_invoices(_prestations,
-                                      _inv,
-                                      qs.invoice_date,
-                                      qs.accident_id,
-                                      qs.accident_date)
-
-            elements.extend(_result["elements"])
-            summary_data.append((_result["invoice_number"], _result["patient_name"], _result["invoice_amount"]))
+    billing = billing_config()
+    images = prefetch_prescription_images(queryset) if med_p else None
+    try:
+        for qs in iter_invoice_items(queryset, batch_size):
+            elements, summaries = build_invoice_item(qs, billing, med_p, already_added_images, images=images)
+            summary_data.extend(summaries)
+            if elements:
+                yield elements
+    finally:
+        if images is not None:
+            images.close(wait=False)
+    yield build_recap_pages(summary_data, billing)
+
+
+def build_invoice_item(qs, billing, med_p=False, already_added_images=None, layout=None, images=None):
+    """
+    Returns the flowables of all the sheets of one invoice and their (number, patient, amount) summaries. The
+    prescription scan is taken from the prefetched images when given, downloaded otherwise.
+    """
+    layout = layout or invoice_layout(billing)
+    elements = []
+    summary_data = []
+    for _inv, _prestations in invoice_pages(qs):
+        _result = _build_invoices(_prestations,
+                                  _inv,
+                                  qs.invoice_date,
+                                  qs.accident_id,
+                                  qs.accident_date,
+                                  layout)
+
+        elements.extend(_result["elements"])
+        summary_data.append((_result["invoice_number"], _result["patient_name"], _result["invoice_amount"]))
+        elements.append(InvoiceSheetEnd())
+        if med_p and qs.medical_prescription and bool(qs.medical_prescription.file) \
+                and qs.medical_prescription.file.name not in already_added_images:
+            image = images.get(qs.medical_prescription.file.name) if images is not None else None
+            if image is None:
+                image = prescription_image(qs.medical_prescription.file)
+            elements.append(Image(BytesIO(image), width=PRINT_WIDTH, height=PRINT_HEIGHT))
             elements.append(PageBreak())
-            if med_p and qs.medical_prescription and bool(qs.medical_prescription.file) \
-                    and qs.medical_prescription.file.file.name not in already_added_images:
-                elements.append(Image(qs.medical_prescription.file, width=469.88, height=773.19))
-                elements.append(PageBreak())
-                already_added_images.append(qs.medical_prescription.file.file.name)
+            already_added_images.append(qs.medical_prescription.file.name)
+
+    return elements, summary_data
+
+
+def build_recap_pages(summary_data, billing, layout=None):
+    layout = layout or invoice_layout(billing)
     recap_data = _build_recap(summary_data)
-    elements.extend(recap_data[0])
+    elements = recap_data[0]
     elements.append(PageBreak())
-    elements.extend(_build_final_page(recap_data[1], recap_data[2]))
+    elements.extend(_build_final_page(recap_data[1], recap_data[2], layout))
 
     return elements
 
 
+class InvoiceSheetEnd(PageBreak):
+    """PageBreak closing one invoice sheet, lets the doc template count rendered sheets."""
+    pass
+
+
+class ProgressDocTemplate(SimpleDocTemplate):
+    def __init__(self, filename, progress_callback=None, **kw):
+        SimpleDocTemplate.__init__(self, filename, **kw)
+        self.progress_callback = progress_callback
+        self.sheets_total = 0
+        self.sheets_done = 0
+
+    def build(self, flowables, **kw):
+        self.sheets_total = len([f for f in flowables if isinstance(f, InvoiceSheetEnd)])
+        self.sheets_done = 0
+        SimpleDocTemplate.build(self, flowables, **kw)
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, InvoiceSheetEnd):
+            self.sheets_done += 1
+            if self.progress_callback:
+                self.progress_callback(self.sheets_done, self.sheets_total)
+
+
 def _build_recap(recaps):
     elements = []
     data = []
@@ -63,61 +126,23 @@ def _build_recap(recaps):
     data.append(("", "", u"à reporter", round(total, 2), ""))
 
     table = Table(data, [2 * cm, 3 * cm, 7 * cm, 3 * cm, 3 * cm], (i + 2) * [0.75 * cm])
-    table.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                               ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                               ('FONTSIZE', (0, 0), (-1, -1), 9),
-                               ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                               ]))
+    table.setStyle(RECAP_TABLE_STYLE)
     elements.append(table)
     return elements, total, i
 
 
-def _build_final_page(total, order_number):
-    elements = []
-    data = [["RELEVE DES NOTES D’HONORAIRES DES"],
-            ["ACTES ET SERVICES DES INFIRMIERS"]]
-    table = Table(data, [10 * cm], [0.75 * cm, 0.75 * cm])
-    table.setStyle(TableStyle([('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                               ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
-                               ('FONTSIZE', (0, 0), (-1, -1), 12),
-                               ('BOX', (0, 0), (-1, -1), 1.25, colors.black),
-                               ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-                               ]))
-    elements.append(table)
-    elements.append(Spacer(1, 18))
-    data2 = [[u"Identification du fournisseur de", config.NURSE_NAME, "", u"réservé à l’union des caisses de maladie"],
-             [u"soins de santé", "", "", ""],
-             [u"Coordonnées bancaires :", config.MAIN_BANK_ACCOUNT, "", ""],
-             ["Code: ", config.MAIN_NURSE_CODE, "", ""]]
-    table2 = Table(data2, [5 * cm, 3 * cm, 3 * cm, 7 * cm], [1.25 * cm, 0.5 * cm, 1.25 * cm, 1.25 * cm])
-    table2.setStyle(TableStyle([('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                                ('ALIGN', (3, 0), (3, 0), 'CENTER'),
-                                ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
-                                ('SPAN', (1, 2), (2, 2)),
-                                ('FONTSIZE', (0, 0), (-1, -1), 8),
-                                ('BOX', (3, 0), (3, 3), 0.25, colors.black),
-                                ('BOX', (3, 0), (3, 1), 0.25, colors.black),
-                                ('BOX', (1, 3), (1, 3), 1, colors.black)]))
-    elements.append(table2)
-    elements.append(Spacer(1, 20))
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
-    elements.append(Paragraph(
-        u"Récapitulation des notes d’honoraires du chef de la fourniture de soins de santé dispensés aux personnes protégées relevant de l’assurance maladie / assurance accidents ou de l’assurance dépendance.",
-        styles['Justify']))
-    elements.append(Spacer(2, 20))
-    elements.append(
-        Paragraph(u"Pendant la période du :.................................. au :..................................",
-                  styles['Justify']))
+def _build_final_page(total, order_number, layout):
+    elements = [layout.final_page_title(),
+                Spacer(1, 18),
+                layout.final_page_supplier(),
+                Spacer(1, 20),
+                layout.final_page_summary(),
+                Spacer(2, 20),
+                layout.final_page_period()]
     data3 = [["Nombre des mémoires d’honoraires ou\nd’enregistrements du support informatique:",
               order_number]]
     table3 = Table(data3, [9 * cm, 8 * cm], [1.25 * cm])
-    table3.setStyle(TableStyle([('ALIGN', (0, 0), (0, 0), 'LEFT'),
-                                ('ALIGN', (-1, -1), (-1, -1), 'CENTER'),
-                                ('VALIGN', (-1, -1), (-1, -1), 'MIDDLE'),
-                                ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
-                                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                ('BOX', (1, 0), (-1, -1), 1.25, colors.black)]))
+    table3.setStyle(FINAL_PAGE_TOTAL_STYLE)
     elements.append(Spacer(2, 20))
     elements.append(table3)
     elements.append(Spacer(2, 20))
@@ -125,22 +150,14 @@ def _build_final_page(total, order_number):
         u"Montant total des honoraires à charge de\nl’organisme assureur (montant net cf. zone 14) du\nmém. d’honoraires):",
         "%.2f EUR" % round(total, 2)]]
     table4 = Table(data4, [9 * cm, 8 * cm], [1.25 * cm])
-    table4.setStyle(TableStyle([('ALIGN', (0, 0), (0, 0), 'LEFT'),
-                                ('ALIGN', (-1, -1), (-1, -1), 'CENTER'),
-                                ('VALIGN', (-1, -1), (-1, -1), 'MIDDLE'),
-                                ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
-                                ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                ('BOX', (1, 0), (-1, -1), 1.25, colors.black)]))
+    table4.setStyle(FINAL_PAGE_TOTAL_STYLE)
     elements.append(table4)
     elements.append(Spacer(40, 60))
-    styles.add(ParagraphStyle(name='Left', alignment=TA_LEFT))
-    elements.append(Paragraph(
-        u"Certifié sincère et véritable, mais non encore acquitté: ________________ ,le ______________________",
-        styles['Left']))
+    elements.append(layout.final_page_certification())
     return elements
 
 
-def _build_invoices(prestations, invoice_number, invoice_date, accident_id, accident_date):
+def _build_invoices(prestations, invoice_number, invoice_date, accident_id, accident_date, layout):
     # Draw things on the PDF. Here's where the PDF generation happens.
     # See the ReportLab documentation for the full list of functionality.
     # import pydevd; pydevd.settrace()
@@ -188,11 +205,7 @@ def _build_invoices(prestations, invoice_number, invoice_date, accident_id, acci
             newData.append(('', '', '', 'Sous-Total', _gross_sum, _net_sum, '', '', ''))
     newData.append(('', '', '', 'Total', _compute_sum(data[1:], 4), _compute_sum(data[1:], 5), '', '', ''))
 
-    headerData = [['IDENTIFICATION DU FOURNISSEUR DE SOINS DE SANTE\n'
-                   + "{0}\n{1}\n{2}\n{3}".format(config.NURSE_NAME, config.NURSE_ADDRESS, config.NURSE_ZIP_CODE_CITY,
-                                                 config.NURSE_PHONE_NUMBER),
-                   'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(config.MAIN_NURSE_CODE)
-                   ],
+    headerData = [layout.supplier_header,
                   [u'Matricule patient: %s' % smart_text(patientSocNumber.strip()) + "\n"
                    + u'Nom et Pr' + smart_text("e") + u'nom du patient: %s' % smart_text(patientNameAndFirstName),
                    u'Nom: %s' % smart_text(patientName.strip()) + '\n'
@@ -204,60 +217,26 @@ def _build_invoices(prestations, invoice_number, invoice_date, accident_id, acci
                    + u'Num. accident: %s' % (accident_id if accident_id else "")]]
 
     headerTable = Table(headerData, 2 * [10 * cm], [2.5 * cm, 1 * cm, 1.5 * cm])
-    headerTable.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                                     ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                                     ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                     ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                                     ('SPAN', (1, 1), (1, 2)),
-                                     ]))
+    headerTable.setStyle(HEADER_TABLE_STYLE)
 
     table = Table(newData, 9 * [2 * cm], 24 * [0.5 * cm])
-    table.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
-                               ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                               ('ALIGN', (0, -1), (-6, -1), 'RIGHT'),
-                               ('INNERGRID', (0, -1), (-6, -1), 0, colors.white),
-                               ('ALIGN', (0, -2), (-6, -2), 'RIGHT'),
-                               ('INNERGRID', (0, -2), (-6, -2), 0, colors.white),
-                               ('FONTSIZE', (0, 0), (-1, -1), 8),
-                               ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-                               ]))
+    table.setStyle(CNS_PRESTATIONS_TABLE_STYLE)
 
     elements.append(headerTable)
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='Center', alignment=TA_CENTER))
     elements.append(Spacer(1, 18))
-    elements.append(
-        Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s" % (invoice_number, invoice_date), styles['Center']))
+    elements.append(Paragraph(u"Mémoire d'Honoraires Num. %s en date du : %s" % (invoice_number, invoice_date),
+                              layout.styles['Center']))
     elements.append(Spacer(1, 18))
 
     elements.append(table)
 
-    _2derniers_cases = Table([["", "Paiement Direct"]], [1 * cm, 4 * cm], 1 * [0.5 * cm], hAlign='LEFT')
-    _2derniers_cases.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'RIGHT'),
-                                          ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                                          ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                          ('BOX', (0, 0), (0, 0), 0.75, colors.black),
-                                          ('SPAN', (1, 1), (1, 2)),
-                                          ]))
-
     elements.append(Spacer(1, 18))
-
-    elements.append(_2derniers_cases)
-    _2derniers_cases = Table([["", "Tiers payant"]], [1 * cm, 4 * cm], 1 * [0.5 * cm], hAlign='LEFT')
-    _2derniers_cases.setStyle(TableStyle([('ALIGN', (1, 1), (-2, -2), 'RIGHT'),
-                                          ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
-                                          ('FONTSIZE', (0, 0), (-1, -1), 9),
-                                          ('BOX', (0, 0), (0, 0), 0.75, colors.black),
-                                          ('SPAN', (1, 1), (1, 2)),
-                                          ]))
+    elements.append(layout.direct_payment())
     elements.append(Spacer(1, 18))
-    elements.append(_2derniers_cases)
+    elements.append(layout.third_party_payment())
     elements.append(Spacer(1, 18))
 
-    _pouracquit_signature = Table([["Pour acquit, le:", "Signature et cachet"]], [10 * cm, 10 * cm], 1 * [0.5 * cm],
-                                  hAlign='LEFT')
-
-    elements.append(_pouracquit_signature)
+    elements.append(layout.acquit_signature())
     return {"elements": elements, "invoice_number": invoice_number,
             "patient_name": patientName + " " + patientFirstName, "invoice_amount": newData[23][5]}
 
@@ -285,11 +264,16 @@ class InvoiceItemBatchPdf:
         return os.path.join(gd_storage.INVOICEITEM_BATCH_FOLDER, filename)
 
     @staticmethod
-    def get_inmemory_pdf(batch):
+    def get_inmemory_pdf(batch, progress_callback=None):
         io_buffer = BytesIO()
-        doc = SimpleDocTemplate(io_buffer, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
-        elements = get_doc_elements(batch.invoice_items)
-        doc.build(elements)
+        if settings.PDF_RENDER_PROCESSES > 1:
+            from invoices.pdf_parallel import render_cns_pdf
+            render_cns_pdf(batch.invoice_items.all(), io_buffer, progress_callback=progress_callback)
+        else:
+            doc = ProgressDocTemplate(io_buffer, progress_callback=progress_callback, rightMargin=2 * cm,
+                                      leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
+            elements = get_doc_elements(batch.invoice_items)
+            doc.build(elements)
 
         f = io_buffer.getvalue()
         in_memory_file = InMemoryUploadedFile(io_buffer,
@@ -4,7 +4,6 @@ import os
 
 from io import BytesIO
 
-from constance import config
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER
@@ -18,32 +17,40 @@ import pytz
 from django.utils.encoding import smart_text
 import decimal
 
+from invoices.pdf_data import billing_config, iter_invoice_items, invoice_pages
+
 
 def get_doc_elements(queryset, payment_ref):
     elements = []
+    for chunk in get_doc_chunks(queryset, payment_ref):
+        elements.extend(chunk)
+
+    return elements
+
+
+def get_doc_chunks(queryset, payment_ref, batch_size=None):
     recapitulatif_data = []
+    billing = billing_config()
 
-    for qs in queryset.order_by("invoice_number"):
-        dd = [qs.prestations.all().order_by("date", "carecode__name")[i:i + 20] for i in
-              range(0, len(qs.prestations.all()), 20)]
-        for _prestations in dd:
-            _inv = qs.invoice_number + (
-                ("" + str(dd.index(_prestations) + 1) + qs.invoice_date.strftime('%m%Y')) if len(dd) > 1 else "")
+    for qs in iter_invoice_items(queryset, batch_size):
+        elements = []
+        for _inv, _prestations in invoice_pages(qs):
             _result = _build_invoices(_prestations,
                                       _inv,
                                       qs.invoice_date,
                                       qs.accident_id,
-                                      qs.accident_date)
+                                      qs.accident_date,
+                                      billing)
 
             elements.extend(_result["elements"])
             recapitulatif_data.append((_result["invoice_number"], _result["patient_name"], _result["invoice_amount"]))
             elements.append(PageBreak())
-    elements.extend(_build_recap(recapitulatif_data, payment_ref))
-
-    return elements
+        if elements:
+            yield elements
+    yield _build_recap(recapitulatif_data, payment_ref, billing)
 
 
-def _build_recap(recaps, payment_ref):
+def _build_recap(recaps, payment_ref, billing):
     elements = []
     data = []
     i = 0
@@ -82,7 +89,7 @@ def _build_recap(recaps, payment_ref):
     elements.append(_total_a_payer)
     elements.append(Spacer(1, 18))
 
-    _infos_iban = Table([[u"Numéro IBAN: %s" % config.MAIN_BANK_ACCOUNT]], [10*cm], 1*[0.5*cm], hAlign='LEFT')
+    _infos_iban = Table([[u"Numéro IBAN: %s" % billing['MAIN_BANK_ACCOUNT']]], [10*cm], 1*[0.5*cm], hAlign='LEFT')
     elements.append(_infos_iban)
 
     elements.append(Spacer(1, 18))
@@ -93,7 +100,7 @@ def _build_recap(recaps, payment_ref):
     return elements
 
 
-def _build_invoices(prestations, invoice_number, invoice_date, accident_id, accident_date):
+def _build_invoices(prestations, invoice_number, invoice_date, accident_id, accident_date, billing):
     # Draw things on the PDF. Here's where the PDF generation happens.
     # See the ReportLab documentation for the full list of functionality.
     # import pydevd; pydevd.settrace()
@@ -143,11 +150,11 @@ def _build_invoices(prestations, invoice_number, invoice_date, accident_id, acci
     _total_facture = _compute_sum(data[1:], 5)
 
     headerData = [['IDENTIFICATION DU FOURNISSEUR DE SOINS DE SANTE\n'
-                    + "{0}\n{1}\n{2}\n{3}".format(config.NURSE_NAME,
-                                                  config.NURSE_ADDRESS,
-                                                  config.NURSE_ZIP_CODE_CITY,
-                                                  config.NURSE_PHONE_NUMBER),
-                    'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(config.MAIN_NURSE_CODE)
+                    + "{0}\n{1}\n{2}\n{3}".format(billing['NURSE_NAME'],
+                                                  billing['NURSE_ADDRESS'],
+                                                  billing['NURSE_ZIP_CODE_CITY'],
+                                                  billing['NURSE_PHONE_NUMBER']),
+                    'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(billing['MAIN_NURSE_CODE'])
                    ],
                   [u'Matricule patient: %s' % smart_text(patientSocNumber.strip()) + "\n"
                    + u'Nom et Pr' + smart_text("e") + u'nom du patient: %s' % smart_text(patientNameAndFirstName),
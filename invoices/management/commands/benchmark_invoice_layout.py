@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from invoices.invoiceitem_pdf import build_invoice_item
+from invoices.models import InvoiceItem
+from invoices.pdf_data import billing_config, iter_invoice_items
+from invoices.pdf_layout import InvoiceLayout, invoice_layout
+from invoices.pdf_stream import render_chunk
+from invoices.tariffs import tariff_index
+
+
+class Command(BaseCommand):
+    help = 'Compares the rendering cost of a CNS invoice with a layout built for each invoice and the shared one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='Number of most recent invoices to render')
+
+    def handle(self, *args, **options):
+        ids = list(InvoiceItem.objects.filter(is_private=False).order_by('-id')
+                   .values_list('id', flat=True)[:options['limit']])
+        invoice_items = list(iter_invoice_items(InvoiceItem.objects.filter(id__in=ids)))
+        billing = billing_config()
+        tariff_index.load()
+        if not invoice_items:
+            self.stdout.write('No invoices to render')
+            return
+
+        before = self.render(invoice_items, lambda: InvoiceLayout(billing), billing)
+        after = self.render(invoice_items, lambda: invoice_layout(billing), billing)
+
+        self.stdout.write('%d invoices, layout built per invoice: %.2fms per invoice, shared layout: %.2fms '
+                          'per invoice' % (len(invoice_items), before * 1000, after * 1000))
+        self.stdout.write(self.style.SUCCESS('Speedup x%.2f' % (before / after)))
+
+    def render(self, invoice_items, layout, billing):
+        start = time.perf_counter()
+        for invoice_item in invoice_items:
+            elements, summaries = build_invoice_item(invoice_item, billing, layout=layout())
+            render_chunk(elements).close()
+
+        return (time.perf_counter() - start) / len(invoice_items)
@@ -0,0 +1,57 @@
+import os
+import time
+from io import BytesIO
+
+from PyPDF2 import PdfFileReader
+from django.core.management.base import BaseCommand, CommandError
+from reportlab.lib.units import cm
+from reportlab.platypus.doctemplate import SimpleDocTemplate
+
+from invoices.invoiceitem_pdf import get_doc_elements
+from invoices.models import InvoiceItem
+from invoices.pdf_parallel import render_cns_pdf
+
+
+class Command(BaseCommand):
+    help = 'Compares the serial and the parallel rendering of the CNS invoices PDF'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500, help='Number of most recent invoices to render')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Rendering processes')
+        parser.add_argument('--med-p', action='store_true', help='Include the medical prescriptions')
+
+    def handle(self, *args, **options):
+        ids = list(InvoiceItem.objects.filter(is_private=False).order_by('-id')
+                   .values_list('id', flat=True)[:options['limit']])
+        queryset = InvoiceItem.objects.filter(id__in=ids)
+
+        start = time.perf_counter()
+        serial = BytesIO()
+        doc = SimpleDocTemplate(serial, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
+        doc.build(get_doc_elements(queryset, options['med_p']))
+        serial_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parallel = render_cns_pdf(queryset, BytesIO(), options['med_p'], processes=options['processes'])
+        parallel_duration = time.perf_counter() - start
+
+        self.stdout.write('%d invoices, serial: %.2fs (%d bytes), %d processes: %.2fs (%d bytes)' % (
+            len(ids), serial_duration, len(serial.getvalue()), options['processes'], parallel_duration,
+            len(parallel.getvalue())))
+
+        serial_pages, parallel_pages = pages_text(serial), pages_text(parallel)
+        if len(serial_pages) != len(parallel_pages):
+            raise CommandError('The parallel PDF has %d pages instead of %d' % (len(parallel_pages),
+                                                                               len(serial_pages)))
+        differing = [str(number) for number, (serial_text, parallel_text) in
+                     enumerate(zip(serial_pages, parallel_pages), 1) if serial_text != parallel_text]
+        if differing:
+            raise CommandError('The text of the pages %s of the parallel PDF differs' % ', '.join(differing))
+
+        self.stdout.write(self.style.SUCCESS('Same %d pages, speedup x%.2f' % (
+            len(serial_pages), serial_duration / parallel_duration)))
+
+
+def pages_text(output):
+    reader = PdfFileReader(output, strict=False)
+    return [reader.getPage(number).extractText() for number in range(reader.getNumPages())]
@@ -1,12 +1,13 @@
 from django.core.management.base import BaseCommand
 
-from invoices.processors.birthdays import process_and_generate
+from invoices.processors.birthdays import generate_birthday_events
 
 
 class Command(BaseCommand):
     help = 'Checks for patient birthdays'
 
     def handle(self, *args, **options):
-        process_result = process_and_generate(30)
-        self.stdout.write(self.style.SUCCESS('Process result %s') % process_result)
+        created, skipped = generate_birthday_events(30)
+        self.stdout.write(self.style.SUCCESS('Process result %d birthday events created, %d already existing')
+                          % (len(created), len(skipped)))
         return
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from invoices.processors.calendar_sync import drain_calendar_outbox
+
+
+class Command(BaseCommand):
+    help = 'Sends the pending Prestation and Event changes to Google Calendar'
+
+    def handle(self, *args, **options):
+        sent, failed = drain_calendar_outbox()
+        self.stdout.write(self.style.SUCCESS('Calendar sync: %s sent, %s failed') % (sent, failed))
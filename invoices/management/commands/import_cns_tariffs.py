@@ -0,0 +1,36 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from invoices.processors.tariff_import import parse_cns_csv, import_cns_tariffs, TariffImportError
+
+
+class Command(BaseCommand):
+    help = 'Imports the CNS care code tariffs of a CSV file (name;code;coef;amount rows)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file, relative paths are looked up in IMPORTER_CSV_FOLDER too')
+        parser.add_argument('--start-date', required=True, help='First day of the tariffs, YYYY-MM-DD')
+        parser.add_argument('--dry-run', action='store_true', help='Only report the changes')
+        parser.add_argument('--rename', action='store_true',
+                            help='Also replace the names and descriptions of the existing care codes')
+        parser.add_argument('--encoding', default='utf-8-sig')
+
+    def handle(self, *args, **options):
+        start_date = parse_date(options['start_date'])
+        if start_date is None:
+            raise CommandError('Invalid start date %s' % options['start_date'])
+        path = options['path']
+        if not os.path.exists(path):
+            path = os.path.join(settings.IMPORTER_CSV_FOLDER, path)
+
+        try:
+            with open(path, encoding=options['encoding'], newline='') as csv_file:
+                report = import_cns_tariffs(parse_cns_csv(csv_file), start_date, dry_run=options['dry_run'],
+                                            rename=options['rename'])
+        except (OSError, TariffImportError) as e:
+            raise CommandError(e)
+
+        self.stdout.write(self.style.SUCCESS(str(report)))
@@ -0,0 +1,37 @@
+from datetime import date
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.holidays import HolidayRequest, with_contract_hours
+from invoices.working_calendar import leave_days
+
+
+class Command(BaseCommand):
+    help = 'Prints the accepted leaves of every employee for a year: days, public holidays and hours'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=timezone.now().year)
+
+    def handle(self, *args, **options):
+        first_day = date(options['year'], 1, 1)
+        last_day = date(options['year'], 12, 31)
+        requests = list(with_contract_hours(HolidayRequest.objects.filter(
+            request_accepted=True, reason=1, start_date__lte=last_day, end_date__gte=first_day))
+                        .select_related('employee').order_by('employee__username', 'start_date'))
+        # the leaves spanning two years only count their days of the year
+        days, public_holidays = leave_days([max(r.start_date, first_day) for r in requests],
+                                           [min(r.end_date, last_day) for r in requests])
+        hours = (days - public_holidays) * np.array([(r.contract_hours or 0) / 5 for r in requests], dtype=float)
+
+        report = {}
+        for i, holiday_request in enumerate(requests):
+            totals = report.setdefault(holiday_request.employee.username, [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += int(days[i])
+            totals[2] += int(public_holidays[i])
+            totals[3] += float(hours[i])
+        for username, (count, leave_days_count, public_holidays_count, leave_hours) in report.items():
+            self.stdout.write('%s: %d requests, %d days - %d public holidays, %.1f h' % (
+                username, count, leave_days_count, public_holidays_count, leave_hours))
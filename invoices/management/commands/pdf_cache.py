@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from invoices.pdf_cache import get_pdf_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows the entries, size, hits and misses of the invoice PDF cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Removes all the cached PDFs')
+
+    def handle(self, *args, **options):
+        cache = get_pdf_cache()
+        if cache is None:
+            raise CommandError('The PDF cache is disabled, see PDF_CACHE_BACKEND')
+        if options['clear']:
+            cache.clear()
+
+        self.stdout.write('%(entries)s PDFs, %(size)s bytes, %(hits)s hits, %(misses)s misses' % cache.stats())
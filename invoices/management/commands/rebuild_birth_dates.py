@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from invoices.models import Patient, patient_birth_date, birth_month_day
+
+
+class Command(BaseCommand):
+    help = 'Derives again the birth date of the patients from their code_sn, after bulk updates bypassing save'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report the birth dates that differ')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        patients = []
+        for patient in Patient.objects.only('code_sn', 'birth_date', 'birth_month_day').order_by('id').iterator():
+            birth_date = patient_birth_date(patient.code_sn)
+            if (patient.birth_date, patient.birth_month_day) != (birth_date, birth_month_day(birth_date)):
+                self.stdout.write('patient %s: %s instead of %s' % (patient.id, patient.birth_date, birth_date))
+                patient.birth_date = birth_date
+                patient.birth_month_day = birth_month_day(birth_date)
+                patients.append(patient)
+        if options['verify'] and patients:
+            raise CommandError('%s birth dates differ' % len(patients))
+        if not options['verify']:
+            with transaction.atomic():
+                Patient.objects.bulk_update(patients, ['birth_date', 'birth_month_day'],
+                                            batch_size=options['chunk_size'])
+
+        self.stdout.write(self.style.SUCCESS('%s birth dates %s' % (len(patients),
+                                                                    'differ' if options['verify'] else 'updated')))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from invoices.models import InvoiceItem, InvoiceItemBatch
+from invoices.totals import refresh_invoice_totals, refresh_batch_totals
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored totals of the invoice items and batches from their prestations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report the totals that differ')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+        invoice_item_ids = list(InvoiceItem.objects.order_by('id').values_list('id', flat=True))
+        mismatches = []
+        for i in range(0, len(invoice_item_ids), options['chunk_size']):
+            with transaction.atomic():
+                mismatches.extend(('invoice item',) + mismatch for mismatch in
+                                  refresh_invoice_totals(invoice_item_ids[i:i + options['chunk_size']], verify))
+        with transaction.atomic():
+            mismatches.extend(('batch',) + mismatch for mismatch in
+                              refresh_batch_totals(InvoiceItemBatch.objects.values_list('id', flat=True), verify))
+
+        for kind, pk, stored, computed in mismatches:
+            self.stdout.write('%s %s: %s instead of %s' % (kind, pk, ', '.join(str(total) for total in stored),
+                                                           ', '.join(str(total) for total in computed)))
+        if verify and mismatches:
+            raise CommandError('%s stored totals differ' % len(mismatches))
+
+        self.stdout.write(self.style.SUCCESS('%s invoice items checked, %s totals %s' % (
+            len(invoice_item_ids), len(mismatches), 'differ' if verify else 'updated')))
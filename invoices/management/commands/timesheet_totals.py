@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from invoices.timesheet_totals import TimesheetMonth
+
+
+def format_hours(seconds):
+    return "%d h:%d mn" % (seconds // 3600, (seconds % 3600) // 60)
+
+
+class Command(BaseCommand):
+    help = 'Prints the totals of the simplified timesheets of all the employees for a month'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, default=timezone.now().year)
+        parser.add_argument('--month', type=int, default=timezone.now().month)
+
+    def handle(self, *args, **options):
+        month = TimesheetMonth(options['year'], options['month'])
+        for timesheet in sorted(month.timesheets, key=lambda t: t.employee.user.username):
+            totals = month.totals(timesheet)
+            self.stdout.write('%s: %s worked, %s on Sundays, %s on public holidays, %s h of absence, %d working days, '
+                              'balance %s' % (timesheet.employee.user.username,
+                                              format_hours(totals['total'].total_seconds()),
+                                              format_hours(totals['total_sundays'].total_seconds()),
+                                              format_hours(totals['total_public_holidays'].total_seconds()),
+                                              totals['total_hours_holidays_taken'][0],
+                                              totals['working_days'],
+                                              format_hours(totals['balance']) if totals['balance'] is not None
+                                              else '-'))
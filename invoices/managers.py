@@ -1,5 +1,26 @@
+import time
+from collections import namedtuple
+
+from django.db import transaction
 from django.db.models import Q
 
+from invoices.totals import refresh_batch_totals
+
+
+class BatchAssociation(namedtuple('BatchAssociation', ['associated_ids', 'disassociated_ids', 'duration'])):
+    @property
+    def associated_count(self):
+        return len(self.associated_ids)
+
+    @property
+    def disassociated_count(self):
+        return len(self.disassociated_ids)
+
+    def __str__(self):
+        return '%s invoice items associated, %s disassociated in %.3fs' % (self.associated_count,
+                                                                            self.disassociated_count,
+                                                                            self.duration)
+
 
 class InvoiceItemBatchManager:
     def __init__(self):
@@ -7,18 +28,36 @@ class InvoiceItemBatchManager:
 
     @staticmethod
     def update_associated_invoiceitems(batch_instance):
-        InvoiceItemBatchManager.disassociate_invoiceitems(batch_instance=batch_instance)
-        InvoiceItemBatchManager.associate_invoiceitems(batch_instance=batch_instance)
+        """
+        Brings the batch members in line with its dates with two set based updates in one transaction. Only the
+        rows that change are written; their ids are returned for the callers invalidating caches.
+        """
+        started_at = time.monotonic()
+        with transaction.atomic():
+            disassociated_ids = InvoiceItemBatchManager.disassociate_invoiceitems(batch_instance=batch_instance)
+            associated_ids = InvoiceItemBatchManager.associate_invoiceitems(batch_instance=batch_instance)
+            if associated_ids or disassociated_ids:
+                refresh_batch_totals([batch_instance.id])
+
+        return BatchAssociation(associated_ids, disassociated_ids, time.monotonic() - started_at)
+
+    @staticmethod
+    def _update_batch(queryset, batch_instance):
+        with transaction.atomic():
+            ids = list(queryset.select_for_update().order_by().values_list('id', flat=True))
+            if ids:
+                # update() skips InvoiceItem.save(), which has nothing to do when only the batch changes
+                queryset.model.objects.filter(id__in=ids).update(batch=batch_instance)
+
+        return ids
 
     @staticmethod
     def disassociate_invoiceitems(batch_instance):
         from invoices.models import InvoiceItem
         queryset = InvoiceItem.objects.filter(
-            (Q(invoice_date__lte=batch_instance.start_date) | Q(invoice_date__gte=batch_instance.end_date)) & Q(
+            (Q(invoice_date__lt=batch_instance.start_date) | Q(invoice_date__gt=batch_instance.end_date)) & Q(
                 batch=batch_instance))
-        for invoiceitem in queryset:
-            invoiceitem.batch = None
-            invoiceitem.save()
+        return InvoiceItemBatchManager._update_batch(queryset, None)
 
     @staticmethod
     def associate_invoiceitems(batch_instance):
@@ -26,6 +65,4 @@ class InvoiceItemBatchManager:
         queryset = InvoiceItem.objects.filter(
             Q(invoice_date__range=(batch_instance.start_date, batch_instance.end_date)) & Q(batch__isnull=True) & Q(
                 is_private=False))
-        for invoiceitem in queryset:
-            invoiceitem.batch = batch_instance
-            invoiceitem.save()
+        return InvoiceItemBatchManager._update_batch(queryset, batch_instance)
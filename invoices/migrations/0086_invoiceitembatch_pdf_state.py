@@ -0,0 +1,33 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0085_drivers_lcnce_birth_place_employee'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='pdf_error',
+            field=models.TextField(blank=True, default='', verbose_name='PDF generation error'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='pdf_progress',
+            field=models.PositiveIntegerField(default=0, verbose_name='Invoices rendered'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='pdf_state',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Pending'), (2, 'Rendering'), (3, 'Uploading'), (4, 'Done'), (5, 'Failed')], null=True, verbose_name='PDF generation state'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='pdf_total',
+            field=models.PositiveIntegerField(default=0, verbose_name='Invoices to render'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0086_invoiceitembatch_pdf_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarOutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(choices=[('prestation', 'Prestation'), ('event', 'Event')], max_length=20, verbose_name='Object type')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Object id')),
+                ('action', models.PositiveSmallIntegerField(choices=[(1, 'Create or update'), (2, 'Delete')], verbose_name='Action')),
+                ('calendar_id', models.CharField(blank=True, default='', max_length=254, verbose_name='Calendar')),
+                ('previous_calendar_id', models.CharField(blank=True, default='', max_length=254, verbose_name='Previous calendar')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last error')),
+            ],
+            options={
+                'verbose_name': 'Calendar outbox entry',
+                'verbose_name_plural': 'Calendar outbox entries',
+                'unique_together': {('object_type', 'object_id')},
+            },
+        ),
+    ]
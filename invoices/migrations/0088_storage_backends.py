@@ -0,0 +1,25 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:25
+
+from django.db import migrations, models
+import invoices.backends
+import invoices.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0087_calendaroutboxentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoiceitembatch',
+            name='file',
+            field=models.FileField(blank=True, storage=invoices.backends.get_batch_storage, upload_to=invoices.models.invoiceitembatch_filename),
+        ),
+        migrations.AlterField(
+            model_name='medicalprescription',
+            name='file',
+            field=models.ImageField(blank=True, storage=invoices.backends.get_drive_storage, upload_to=invoices.models.update_medical_prescription_filename, validators=[invoices.models.validate_image]),
+        ),
+    ]
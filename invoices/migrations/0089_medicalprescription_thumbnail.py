@@ -0,0 +1,19 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:30
+
+from django.db import migrations, models
+import invoices.thumbnails
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0088_storage_backends'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicalprescription',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, storage=invoices.thumbnails.get_thumbnail_storage, upload_to=''),
+        ),
+    ]
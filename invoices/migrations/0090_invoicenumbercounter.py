@@ -0,0 +1,25 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0089_medicalprescription_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceNumberCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(choices=[('cns', 'CNS invoices'), ('contractor', 'Contractor invoices')], max_length=20, unique=True, verbose_name='Series')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Last number')),
+            ],
+            options={
+                'verbose_name': 'Invoice number counter',
+                'verbose_name_plural': 'Invoice number counters',
+            },
+        ),
+    ]
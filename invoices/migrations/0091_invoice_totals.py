@@ -0,0 +1,43 @@
+# Generated by Django 3.1.3 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0090_invoicenumbercounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='total_gross',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total brut'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='total_net',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total net'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='total_participation',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Participation personnelle'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='total_gross',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total brut'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='total_net',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Total net'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitembatch',
+            name='total_participation',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Participation personnelle'),
+        ),
+    ]
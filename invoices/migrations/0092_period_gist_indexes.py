@@ -0,0 +1,24 @@
+from django.db import migrations
+
+# the expressions are the ones of invoices.overlaps, which the overlap checks query
+PERIOD_INDEXES = [
+    ('invoices_event_period_gist', 'invoices_event',
+     "tsrange(day + time_start_event, GREATEST(day + time_start_event, day + time_end_event), '[]')"),
+    ('invoices_holidayrequest_period_gist', 'invoices_holidayrequest',
+     "daterange(start_date, GREATEST(start_date, end_date), '[]')"),
+    ('invoices_hospitalization_period_gist', 'invoices_hospitalization',
+     "daterange(start_date, GREATEST(start_date, end_date), '[]')"),
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0091_invoice_totals'),
+    ]
+
+    operations = [
+        migrations.RunSQL('CREATE INDEX %s ON %s USING gist ((%s))' % index,
+                          reverse_sql='DROP INDEX %s' % index[0])
+        for index in PERIOD_INDEXES
+    ]
@@ -0,0 +1,38 @@
+from datetime import date
+
+from django.db import migrations, models
+
+
+def backfill_birth_dates(apps, schema_editor):
+    PatientModel = apps.get_model('invoices', 'Patient')
+    patients = []
+    for patient in PatientModel.objects.only('code_sn').iterator():
+        code_sn = patient.code_sn.replace(' ', '')
+        try:
+            patient.birth_date = date(int(code_sn[:4]), int(code_sn[4:6]), int(code_sn[6:8]))
+        except ValueError:
+            continue
+        patient.birth_month_day = patient.birth_date.month * 100 + patient.birth_date.day
+        patients.append(patient)
+    PatientModel.objects.bulk_update(patients, ['birth_date', 'birth_month_day'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0092_period_gist_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='birth_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Date de naissance'),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='birth_month_day',
+            field=models.PositiveSmallIntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_birth_dates, migrations.RunPython.noop),
+    ]
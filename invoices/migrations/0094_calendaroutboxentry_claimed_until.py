@@ -0,0 +1,18 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0093_patient_birth_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='calendaroutboxentry',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claimed until'),
+        ),
+    ]
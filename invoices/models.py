@@ -4,43 +4,62 @@ from typing import Optional, Dict, Any
 
 import pytz
 import os
-from copy import deepcopy
+import threading
 from datetime import datetime
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 # from django.core.files.storage import FileSystemStorage
-from django.db import models
-from django.db.models import Q, IntegerField, Max
-from django.db.models.functions import Cast
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db import models, transaction
+from django.db.models import Q, IntegerField
+from django.db.models.signals import post_save, post_delete, pre_save, pre_delete, post_init
 from django.dispatch import receiver
+from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django_countries.fields import CountryField
-from gdstorage.storage import GoogleDriveStorage
 
+from invoices.calendar_outbox import CalendarOutboxEntry, record_calendar_change
 from invoices.invoiceitem_pdf import InvoiceItemBatchPdf
-from invoices.gcalendar import PrestationGoogleCalendar
 from invoices.managers import InvoiceItemBatchManager
+from invoices import numbering
+from invoices.numbering import InvoiceNumberCounter, peek_invoice_number, reserve_invoice_number, \
+    follow_invoice_number
 
 from django.utils.timezone import now
 
+from invoices.backends import get_drive_storage, get_batch_storage, get_prestation_calendar, google_sync_enabled
 from invoices.storages import CustomizedGoogleDriveStorage
+from invoices.tariffs import tariff_index
+from invoices.at_home import at_home_care_code, pair_at_home_prestations
+from invoices.overlaps import overlapping_dates
+from invoices.totals import refresh_invoice_totals, refresh_batch_totals, invoice_item_ids_for_care_codes, \
+    update_fields_without_totals
+from invoices.thumbnails import get_thumbnail_storage, store_thumbnail, read_file, delete_thumbnail
 from constance import config
+from constance.signals import config_updated
 
 from invoices.employee import Employee
 from invoices.validators.validators import MyRegexValidator
 
-prestation_gcalendar = PrestationGoogleCalendar()
-gd_storage: CustomizedGoogleDriveStorage = CustomizedGoogleDriveStorage()
-batch_gd_storage: GoogleDriveStorage = GoogleDriveStorage()
-# else:
-#    gd_storage = FileSystemStorage()
+prestation_gcalendar = get_prestation_calendar()
+gd_storage = get_drive_storage()
+batch_gd_storage = get_batch_storage()
 
 logger = logging.getLogger(__name__)
 
 
-class CareCode(models.Model):
+class TotalsDependenciesMixin(object):
+    """
+    Keeps the values of TOTALS_DEPENDENCIES stored for the instance up to date when it is reloaded, the next save
+    compares to them to know which totals to refresh.
+    """
+
+    def refresh_from_db(self, using=None, fields=None):
+        super(TotalsDependenciesMixin, self).refresh_from_db(using, fields)
+        store_loaded_totals_dependencies(self, fields)
+
+
+class CareCode(TotalsDependenciesMixin, models.Model):
     class Meta:
         ordering = ['-id']
 
@@ -56,23 +75,18 @@ class CareCode(models.Model):
 
     @property
     def current_gross_amount(self):
-        return self.gross_amount(datetime.date.today())
+        return self.gross_amount(now())
 
     def gross_amount(self, date):
-        for v in self.validity_dates.all():
-            if date.date() >= v.start_date:
-                if v.end_date is None:
-                    return v.gross_amount
-                elif date.date() <= v.end_date:
-                    return v.gross_amount
-        return 0
+        return tariff_index.gross_amount(self.id, date)
 
     def net_amount(self, date, private_patient, participation_statutaire):
         if not private_patient:
+            gross_amount = self.gross_amount(date)
             if self.reimbursed and not self.contribution_undue:
-                return round(((self.gross_amount(date) * 88) / 100), 2) + self._fin_part(date, participation_statutaire)
+                return round(((gross_amount * 88) / 100), 2) + self._fin_part(date, participation_statutaire)
             else:
-                return self.gross_amount(date)
+                return gross_amount
         else:
             return 0
 
@@ -113,7 +127,7 @@ class CareCode(models.Model):
         return messages
 
 
-class ValidityDate(models.Model):
+class ValidityDate(TotalsDependenciesMixin, models.Model):
     """
     CareCode cannot have start and end validity dates that overlap.
     Depending on Prestation date, gross_amount that is calculated in Invoice will differ.
@@ -160,6 +174,20 @@ class ValidityDate(models.Model):
         return messages
 
 
+@receiver([post_save, post_delete], sender=CareCode, dispatch_uid="carecode_invalidate_tariff_index")
+@receiver([post_save, post_delete], sender=ValidityDate, dispatch_uid="validitydate_invalidate_tariff_index")
+def invalidate_tariff_index(sender, **kwargs):
+    tariff_index.invalidate()
+    transaction.on_commit(tariff_index.invalidate)
+
+
+@receiver([post_save, post_delete], sender=CareCode, dispatch_uid="carecode_invalidate_at_home_care_code")
+@receiver(config_updated, dispatch_uid="config_invalidate_at_home_care_code")
+def invalidate_at_home_care_code(sender, **kwargs):
+    at_home_care_code.invalidate()
+    transaction.on_commit(at_home_care_code.invalidate)
+
+
 def extract_birth_date(code_sn) -> object:
     stripped_sn_code = code_sn.replace(" ", "")
     if stripped_sn_code is not None and (stripped_sn_code[:4]).isdigit():
@@ -169,6 +197,20 @@ def extract_birth_date(code_sn) -> object:
     return None
 
 
+def patient_birth_date(code_sn):
+    """The birth date the code_sn starts with, None when it does not start with a valid date."""
+    try:
+        born = extract_birth_date(code_sn)
+    except ValueError:
+        return None
+    return born.date() if born is not None else None
+
+
+def birth_month_day(birth_date):
+    """The MMDD key of the birthday, 306 for the 6th of March, in the order of the birthdays of a year."""
+    return birth_date.month * 100 + birth_date.day if birth_date is not None else None
+
+
 def calculate_age(care_date, code_sn):
     if care_date is None:
         care_date = datetime.now()
@@ -179,7 +221,7 @@ def calculate_age(care_date, code_sn):
 
 
 # TODO: synchronize patient details with Google contacts
-class Patient(models.Model):
+class Patient(TotalsDependenciesMixin, models.Model):
     class Meta:
         ordering = ['-id']
 
@@ -200,6 +242,9 @@ class Patient(models.Model):
     participation_statutaire = models.BooleanField(default=False)
     is_private = models.BooleanField(default=False)
     date_of_death = models.DateField(u"Date de décès", default=None, blank=True, null=True)
+    # derived from code_sn on save, see the rebuild_birth_dates command
+    birth_date = models.DateField(u"Date de naissance", blank=True, null=True, editable=False)
+    birth_month_day = models.PositiveSmallIntegerField(blank=True, null=True, editable=False, db_index=True)
 
     @property
     def age(self):
@@ -212,6 +257,14 @@ class Patient(models.Model):
     def __str__(self):  # Python 3: def __str__(self):,
         return '%s %s' % (self.name.strip(), self.first_name.strip())
 
+    def save(self, *args, **kwargs):
+        self.birth_date = patient_birth_date(self.code_sn)
+        self.birth_month_day = birth_month_day(self.birth_date)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'code_sn' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'birth_date', 'birth_month_day'}
+        super(Patient, self).save(*args, **kwargs)
+
     def clean(self, *args, **kwargs):
         self.code_sn = self.format_code_sn(self.code_sn)
         super(Patient, self).clean_fields()
@@ -346,13 +399,8 @@ class Hospitalization(models.Model):
     @staticmethod
     def validate_date_range(instance_id, data):
         messages = {}
-        conflicts_cnt = Hospitalization.objects.filter(
-            Q(start_date__range=(data['start_date'], data['end_date'])) |
-            Q(end_date__range=(data['start_date'], data['end_date'])) |
-            Q(start_date__lte=data['start_date'], end_date__gte=data['start_date']) |
-            Q(start_date__lte=data['end_date'], end_date__gte=data['end_date'])
-        ).filter(
-            patient_id=data['patient'].id).exclude(
+        conflicts_cnt = overlapping_dates(Hospitalization.objects.filter(patient_id=data['patient'].id),
+                                          'start_date', 'end_date', data['start_date'], data['end_date']).exclude(
             pk=instance_id).count()
         if 0 < conflicts_cnt:
             messages = {'start_date': 'Intersection with other Hospitalizations'}
@@ -433,9 +481,10 @@ class MedicalPrescription(models.Model):
                                 on_delete=models.CASCADE)
     date = models.DateField('Date ordonnance')
     end_date = models.DateField('Date fin des soins', null=True, blank=True)
-    file = models.ImageField(storage=gd_storage, blank=True,
+    file = models.ImageField(storage=get_drive_storage, blank=True,
                              upload_to=update_medical_prescription_filename,
                              validators=[validate_image])
+    thumbnail = models.ImageField(storage=get_thumbnail_storage, blank=True, editable=False)
     _original_file = None
 
     @property
@@ -478,13 +527,22 @@ class MedicalPrescription(models.Model):
             max_width = '800'
         if max_height is None:
             max_height = '800'
-        # used in the admin site model as a "thumbnail"
-        link = self.file.storage.get_thumbnail_link(getattr(self.file, 'name', None))
+        # used in the admin site model as a "thumbnail", rendered locally when the scan is uploaded
+        link = self.thumbnail_url
         styles = "max-width: %spx; max-height: %spx;" % (max_width, max_height)
         tag = '<img src="{}" style="{}"/>'.format(link, styles)
 
         return mark_safe(tag)
 
+    @property
+    def thumbnail_url(self):
+        if self.thumbnail:
+            return self.thumbnail.url
+        if self.file and self.pk:
+            # scans uploaded before the previews existed, rendered on first display
+            return reverse('medical-prescription-thumbnail', args=[self.pk])
+        return ''
+
     def get_original_file(self):
         return self._original_file
 
@@ -509,6 +567,18 @@ def medical_prescription_clean_gdrive_pre_save(sender, instance, **kwargs):
         gd_storage.delete(origin_file.name)
 
 
+@receiver(pre_save, sender=MedicalPrescription, dispatch_uid="medical_prescription_thumbnail_pre_save")
+def medical_prescription_thumbnail_pre_save(sender, instance, **kwargs):
+    origin_thumbnail = instance.thumbnail.name
+    if not instance.file:
+        instance.thumbnail = ''
+    elif not instance.file._committed:
+        # the upload is still in memory, no need to download it back from the Drive
+        instance.thumbnail = store_thumbnail(read_file(instance.file))
+    if origin_thumbnail and origin_thumbnail != instance.thumbnail.name:
+        delete_thumbnail(origin_thumbnail, exclude_pk=instance.pk)
+
+
 @receiver(post_save, sender=MedicalPrescription, dispatch_uid="medical_prescription_clean_gdrive_post_save")
 def medical_prescription_clean_gdrive_post_save(sender, instance, **kwargs):
     if instance.file.name:
@@ -520,19 +590,11 @@ def medical_prescription_clean_gdrive_post_save(sender, instance, **kwargs):
 def medical_prescription_clean_gdrive_post_delete(sender, instance, **kwargs):
     if instance.file.name:
         gd_storage.delete(instance.file.name)
+    delete_thumbnail(instance.thumbnail.name)
 
 
 def get_default_invoice_number():
-    default_invoice_number = 0
-    max_invoice_number = InvoiceItem.objects.filter(Q(invoice_number__iregex=r'^\d+$')).annotate(
-        invoice_number_int=Cast('invoice_number', IntegerField())).aggregate(Max('invoice_number_int'))
-
-    if max_invoice_number['invoice_number_int__max'] is not None:
-        default_invoice_number = max_invoice_number['invoice_number_int__max']
-
-    default_invoice_number += 1
-
-    return default_invoice_number
+    return peek_invoice_number(numbering.CNS)
 
 
 def invoiceitembatch_filename(instance, filename):
@@ -540,15 +602,36 @@ def invoiceitembatch_filename(instance, filename):
 
 
 class InvoiceItemBatch(models.Model):
+    PDF_PENDING = 1
+    PDF_RENDERING = 2
+    PDF_UPLOADING = 3
+    PDF_DONE = 4
+    PDF_FAILED = 5
+    PDF_STATES = [
+        (PDF_PENDING, 'Pending'),
+        (PDF_RENDERING, 'Rendering'),
+        (PDF_UPLOADING, 'Uploading'),
+        (PDF_DONE, 'Done'),
+        (PDF_FAILED, 'Failed')
+    ]
+
     start_date = models.DateField('Invoice batch start date')
     end_date = models.DateField('Invoice batch start date')
     send_date = models.DateField(null=True, blank=True)
     payment_date = models.DateField(null=True, blank=True)
-    file = models.FileField(storage=batch_gd_storage, blank=True, upload_to=invoiceitembatch_filename)
+    file = models.FileField(storage=get_batch_storage, blank=True, upload_to=invoiceitembatch_filename)
+    pdf_state = models.PositiveSmallIntegerField('PDF generation state', choices=PDF_STATES, null=True, blank=True)
+    pdf_progress = models.PositiveIntegerField('Invoices rendered', default=0)
+    pdf_total = models.PositiveIntegerField('Invoices to render', default=0)
+    pdf_error = models.TextField('PDF generation error', blank=True, default='')
+    total_gross = models.DecimalField('Total brut', max_digits=10, decimal_places=2, default=0, editable=False)
+    total_net = models.DecimalField('Total net', max_digits=10, decimal_places=2, default=0, editable=False)
+    total_participation = models.DecimalField('Participation personnelle', max_digits=10, decimal_places=2,
+                                              default=0, editable=False)
     _original_file = None
+    _original_dates = None
 
     # invoices to be corrected
-    # total_amount
 
     def __str__(self):  # Python 3: def __str__(self):
         return 'from %s to %s' % (self.start_date, self.end_date)
@@ -556,10 +639,30 @@ class InvoiceItemBatch(models.Model):
     def __init__(self, *args, **kwargs):
         super(InvoiceItemBatch, self).__init__(*args, **kwargs)
         self._original_file = self.file
+        self._original_dates = (self.start_date, self.end_date)
+
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = update_fields_without_totals(self, kwargs.get('update_fields'))
+        super(InvoiceItemBatch, self).save(*args, **kwargs)
 
     def get_original_file(self):
         return self._original_file
 
+    @property
+    def dates_changed(self):
+        return self._original_dates != (self.start_date, self.end_date)
+
+    @property
+    def pdf_status(self):
+        if self.pdf_state is None:
+            return ''
+        if self.pdf_state == self.PDF_RENDERING:
+            return 'Rendering %s of %s' % (self.pdf_progress, self.pdf_total)
+        if self.pdf_state == self.PDF_FAILED:
+            return 'Failed: %s' % self.pdf_error
+
+        return self.get_pdf_state_display()
+
     def clean(self):
         exclude = []
         super(InvoiceItemBatch, self).clean_fields(exclude)
@@ -592,22 +695,21 @@ def invoiceitembatch_generate_pdf_name(sender, instance, **kwargs):
         batch_gd_storage.delete(origin_file.name)
 
 
-# @receiver(post_save, sender=InvoiceItemBatch, dispatch_uid="invoiceitembatch_post_save")
-# def invoiceitembatch_generate_pdf(sender, instance, **kwargs):
-#     InvoiceItemBatchManager.update_associated_invoiceitems(instance)
-#     file_content = InvoiceItemBatchPdf.get_inmemory_pdf(instance)
-#     path = InvoiceItemBatchPdf.get_path(instance)
-#     instance._original_file = instance.file
-#     batch_gd_storage.save_file(path, file_content)
+@receiver(post_save, sender=InvoiceItemBatch, dispatch_uid="invoiceitembatch_post_save")
+def invoiceitembatch_generate_pdf(sender, instance, created, **kwargs):
+    if created or instance.dates_changed:
+        from invoices.processors.batch_pdf import schedule_batch_pdf_generation
+        schedule_batch_pdf_generation(instance)
+    instance._original_dates = (instance.start_date, instance.end_date)
 
 
 @receiver(post_delete, sender=InvoiceItemBatch, dispatch_uid="invoiceitembatch_post_delete")
 def medical_prescription_clean_gdrive_post_delete(sender, instance, **kwargs):
     if instance.file.name:
-        gd_storage.delete(instance.file.name)
+        instance.file.storage.delete(instance.file.name)
 
 
-class InvoiceItem(models.Model):
+class InvoiceItem(TotalsDependenciesMixin, models.Model):
     class Meta(object):
         ordering = ['-id']
         verbose_name = u"Mémoire d'honoraire"
@@ -640,6 +742,25 @@ class InvoiceItem(models.Model):
     medical_prescription = models.ForeignKey(MedicalPrescription, related_name='invoice_items', null=True, blank=True,
                                              help_text='Please choose a Medical Prescription',
                                              on_delete=models.SET_NULL)
+    # kept up to date by the signals of invoices.totals, rebuilt by the rebuild_invoice_totals command
+    total_gross = models.DecimalField('Total brut', max_digits=10, decimal_places=2, default=0, editable=False)
+    total_net = models.DecimalField('Total net', max_digits=10, decimal_places=2, default=0, editable=False)
+    total_participation = models.DecimalField('Participation personnelle', max_digits=10, decimal_places=2,
+                                              default=0, editable=False)
+
+    def __init__(self, *args, **kwargs):
+        super(InvoiceItem, self).__init__(*args, **kwargs)
+        self._original_invoice_number = self.__dict__.get('invoice_number')
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            if self._state.adding:
+                self.invoice_number = reserve_invoice_number(numbering.CNS, self.invoice_number, self.pk)
+            elif self.__dict__.get('invoice_number') != self._original_invoice_number:
+                follow_invoice_number(numbering.CNS, self.invoice_number)
+            kwargs['update_fields'] = update_fields_without_totals(self, kwargs.get('update_fields'))
+            super(InvoiceItem, self).save(*args, **kwargs)
+        self._original_invoice_number = self.__dict__.get('invoice_number')
 
     def clean(self, *args, **kwargs):
         super(InvoiceItem, self).clean_fields()
@@ -710,7 +831,7 @@ class InvoiceItem(models.Model):
         return 'invoice_number',
 
 
-class Prestation(models.Model):
+class Prestation(TotalsDependenciesMixin, models.Model):
     class Meta:
         ordering = ['-date']
     invoice_item = models.ForeignKey(InvoiceItem,
@@ -758,6 +879,9 @@ class Prestation(models.Model):
             exclude = ['invoice_item']
 
         super(Prestation, self).clean_fields(exclude)
+        if getattr(self, 'validated_in_batch', False):
+            # PrestationInlineFormSet validates all its rows at once
+            return
         messages = self.validate(self.id, self.as_dict())
         if messages:
             raise ValidationError(messages)
@@ -917,26 +1041,171 @@ class Prestation(models.Model):
 
 @receiver(post_save, sender=Prestation, dispatch_uid="create_at_home_prestation")
 def create_prestation_at_home_pair(sender, instance, **kwargs):
-    if instance.at_home and instance.at_home_paired is None and not hasattr(instance, 'paired_at_home'):
-        at_home_carecode = CareCode.objects.get(code=config.AT_HOME_CARE_CODE)
-        at_home_pair_exists = Prestation.objects.filter(invoice_item=instance.invoice_item, date=instance.date,
-                                                        carecode=at_home_carecode).exists()
-        if not at_home_pair_exists:
-            pair = deepcopy(instance)
-            pair.pk = None
-            pair.carecode = at_home_carecode
-            pair.at_home = False
-            pair.at_home_paired = instance
-            pair.save()
+    # PrestationInlineFormSet pairs all its prestations once they are saved
+    if instance.at_home and not getattr(instance, 'paired_in_batch', False):
+        pair_at_home_prestations([instance])
 
 
 @receiver(post_save, sender=Prestation, dispatch_uid="update_prestation_gcalendar_events")
 def update_prestation_gcalendar_events(sender, instance, **kwargs):
-    # if config.USE_GDRIVE:
-    prestation_gcalendar.update_event(instance)
+    if google_sync_enabled():
+        record_calendar_change(CalendarOutboxEntry.PRESTATION, instance.id, CalendarOutboxEntry.UPDATE)
 
 
 @receiver(post_delete, sender=Prestation, dispatch_uid="delete_prestation_gcalendar_events")
 def delete_prestation_gcalendar_events(sender, instance, **kwargs):
-    # if config.USE_GDRIVE:
-    prestation_gcalendar.delete_event(instance.id)
+    if google_sync_enabled():
+        record_calendar_change(CalendarOutboxEntry.PRESTATION, instance.id, CalendarOutboxEntry.DELETE)
+
+
+TOTALS_DEPENDENCIES = {
+    Prestation: ('invoice_item_id',),
+    InvoiceItem: ('batch_id', 'patient_id'),
+    ValidityDate: ('start_date', 'end_date', 'care_code_id'),
+    CareCode: ('reimbursed', 'contribution_undue'),
+    Patient: ('is_private', 'participation_statutaire', 'code_sn'),
+}
+
+
+def loaded_totals_dependencies(instance):
+    # None when the instance is new or one of the fields is deferred
+    if instance.pk is None or any(field not in instance.__dict__ for field in TOTALS_DEPENDENCIES[type(instance)]):
+        return None
+    return tuple(instance.__dict__[field] for field in TOTALS_DEPENDENCIES[type(instance)])
+
+
+def store_loaded_totals_dependencies(instance, fields=None):
+    """Takes the values of the fields, all of them by default, as the ones stored for the instance."""
+    loaded = getattr(instance, '_loaded_totals_dependencies', None)
+    if fields is None:
+        instance._loaded_totals_dependencies = loaded_totals_dependencies(instance)
+    elif loaded is not None:
+        fields = set(instance._meta.get_field(field).attname for field in fields)
+        instance._loaded_totals_dependencies = tuple(instance.__dict__[field] if field in fields else value for
+                                                     field, value in zip(TOTALS_DEPENDENCIES[type(instance)], loaded))
+
+
+@receiver(post_init, sender=Prestation, dispatch_uid="prestation_load_totals_dependencies")
+@receiver(post_init, sender=InvoiceItem, dispatch_uid="invoiceitem_load_totals_dependencies")
+@receiver(post_init, sender=ValidityDate, dispatch_uid="validitydate_load_totals_dependencies")
+@receiver(post_init, sender=CareCode, dispatch_uid="carecode_load_totals_dependencies")
+@receiver(post_init, sender=Patient, dispatch_uid="patient_load_totals_dependencies")
+def load_totals_dependencies(sender, instance, **kwargs):
+    instance._loaded_totals_dependencies = loaded_totals_dependencies(instance)
+
+
+@receiver(pre_save, sender=Prestation, dispatch_uid="prestation_remember_totals_dependencies")
+@receiver(pre_save, sender=InvoiceItem, dispatch_uid="invoiceitem_remember_totals_dependencies")
+@receiver(pre_save, sender=ValidityDate, dispatch_uid="validitydate_remember_totals_dependencies")
+@receiver(pre_save, sender=CareCode, dispatch_uid="carecode_remember_totals_dependencies")
+@receiver(pre_save, sender=Patient, dispatch_uid="patient_remember_totals_dependencies")
+def remember_totals_dependencies(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._totals_dependencies = None
+    if raw or instance._state.adding or not writes_totals_dependencies(sender, update_fields):
+        return
+    instance._totals_dependencies = getattr(instance, '_loaded_totals_dependencies', None)
+    if instance._totals_dependencies is None:
+        instance._totals_dependencies = sender.objects.filter(pk=instance.pk).order_by() \
+            .values_list(*TOTALS_DEPENDENCIES[sender]).first()
+
+
+def writes_totals_dependencies(sender, update_fields):
+    if update_fields is None:
+        return True
+    # update_fields may hold the names or the attnames of the fields
+    return any(sender._meta.get_field(field).attname in TOTALS_DEPENDENCIES[sender] for field in update_fields)
+
+
+def totals_dependencies_changed(instance):
+    previous = getattr(instance, '_totals_dependencies', None)
+    current = tuple(getattr(instance, field) for field in TOTALS_DEPENDENCIES[type(instance)])
+    return previous, previous is not None and previous != current
+
+
+# the invoice items being deleted with their prestations, whose totals are not refreshed for each prestation
+_deleted_invoice_items = threading.local()
+
+
+def deleted_invoice_item_ids():
+    if not hasattr(_deleted_invoice_items, 'ids'):
+        _deleted_invoice_items.ids = set()
+    return _deleted_invoice_items.ids
+
+
+@receiver(pre_delete, sender=Prestation, dispatch_uid="prestation_forget_deleted_invoice_item")
+def prestation_forget_deleted_invoice_item(sender, instance, **kwargs):
+    # sent before the one of the invoice item in a cascade, drops what a failed deletion left behind
+    deleted_invoice_item_ids().discard(instance.invoice_item_id)
+
+
+@receiver(pre_delete, sender=InvoiceItem, dispatch_uid="invoiceitem_remember_deletion")
+def invoiceitem_remember_deletion(sender, instance, **kwargs):
+    deleted_invoice_item_ids().add(instance.id)
+
+
+@receiver(post_save, sender=Prestation, dispatch_uid="prestation_refresh_invoice_totals")
+@receiver(post_delete, sender=Prestation, dispatch_uid="prestation_delete_refresh_invoice_totals")
+def prestation_refresh_invoice_totals(sender, instance, raw=False, **kwargs):
+    # PrestationInlineFormSet refreshes its invoice item once all its prestations are saved
+    if raw or getattr(instance, 'totals_in_batch', False) or instance.invoice_item_id in deleted_invoice_item_ids():
+        return
+    previous, changed = totals_dependencies_changed(instance)
+    refresh_invoice_totals([instance.invoice_item_id] + (list(previous) if changed else []))
+
+
+@receiver(post_save, sender=InvoiceItem, dispatch_uid="invoiceitem_refresh_invoice_totals")
+def invoiceitem_refresh_invoice_totals(sender, instance, raw=False, **kwargs):
+    previous, changed = totals_dependencies_changed(instance)
+    if raw or not changed:
+        return
+    previous_batch_id, previous_patient_id = previous
+    if previous_patient_id != instance.patient_id:
+        refresh_invoice_totals([instance.id])
+    refresh_batch_totals([previous_batch_id, instance.batch_id])
+
+
+@receiver(post_delete, sender=InvoiceItem, dispatch_uid="invoiceitem_delete_refresh_batch_totals")
+def invoiceitem_delete_refresh_batch_totals(sender, instance, **kwargs):
+    deleted_invoice_item_ids().discard(instance.id)
+    refresh_batch_totals([instance.batch_id])
+
+
+@receiver(post_save, sender=ValidityDate, dispatch_uid="validitydate_refresh_invoice_totals")
+@receiver(post_delete, sender=ValidityDate, dispatch_uid="validitydate_delete_refresh_invoice_totals")
+def validitydate_refresh_invoice_totals(sender, instance, raw=False, **kwargs):
+    # runs after invalidate_tariff_index, connected first
+    if raw:
+        return
+    periods = [(instance.start_date, instance.end_date, instance.care_code_id)]
+    previous, changed = totals_dependencies_changed(instance)
+    if changed:
+        periods.append(previous)
+    start_date = min(start_date for start_date, end_date, care_code_id in periods)
+    end_dates = [end_date for start_date, end_date, care_code_id in periods]
+    end_date = None if None in end_dates else max(end_dates)
+    refresh_invoice_totals(invoice_item_ids_for_care_codes(
+        set(care_code_id for start_date, end_date, care_code_id in periods), start_date, end_date))
+
+
+@receiver(post_save, sender=CareCode, dispatch_uid="carecode_refresh_invoice_totals")
+def carecode_refresh_invoice_totals(sender, instance, raw=False, **kwargs):
+    previous, changed = totals_dependencies_changed(instance)
+    if not raw and changed:
+        refresh_invoice_totals(invoice_item_ids_for_care_codes([instance.id]))
+
+
+@receiver(post_save, sender=Patient, dispatch_uid="patient_refresh_invoice_totals")
+def patient_refresh_invoice_totals(sender, instance, raw=False, **kwargs):
+    previous, changed = totals_dependencies_changed(instance)
+    if not raw and changed:
+        refresh_invoice_totals(InvoiceItem.objects.filter(patient=instance).order_by().values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Prestation, dispatch_uid="prestation_saved_totals_dependencies")
+@receiver(post_save, sender=InvoiceItem, dispatch_uid="invoiceitem_saved_totals_dependencies")
+@receiver(post_save, sender=ValidityDate, dispatch_uid="validitydate_saved_totals_dependencies")
+@receiver(post_save, sender=CareCode, dispatch_uid="carecode_saved_totals_dependencies")
+@receiver(post_save, sender=Patient, dispatch_uid="patient_saved_totals_dependencies")
+def saved_totals_dependencies(sender, instance, update_fields=None, **kwargs):
+    # connected after the refresh receivers
+    store_loaded_totals_dependencies(instance, update_fields)
@@ -0,0 +1,97 @@
+import re
+
+from django.apps import apps
+from django.db import models
+from django.db.models import IntegerField, Max
+from django.db.models.functions import Cast
+from django.utils.translation import gettext_lazy as _
+
+CNS = 'cns'
+CONTRACTOR = 'contractor'
+
+SERIES_MODELS = {
+    CNS: 'invoices.InvoiceItem',
+    CONTRACTOR: 'invoices.ContractorInvoiceItem',
+}
+
+NUMERIC_INVOICE_NUMBER = re.compile(r'^\d+$')
+
+
+class InvoiceNumberCounter(models.Model):
+    """
+    Last invoice number handed out in a series. Allocations lock the row, so concurrent creators never get the
+    same number and never scan the invoice tables.
+    """
+
+    class Meta:
+        verbose_name = _('Invoice number counter')
+        verbose_name_plural = _('Invoice number counters')
+
+    SERIES = [
+        (CNS, _('CNS invoices')),
+        (CONTRACTOR, _('Contractor invoices'))
+    ]
+
+    series = models.CharField(_('Series'), max_length=20, choices=SERIES, unique=True)
+    last_number = models.PositiveIntegerField(_('Last number'), default=0)
+
+    def __str__(self):
+        return '%s: %s' % (self.get_series_display(), self.last_number)
+
+
+def _max_invoice_number(series):
+    # only run once per series, to start the counter after the numbers already in the table
+    model = apps.get_model(SERIES_MODELS[series])
+    max_invoice_number = model.objects.filter(invoice_number__iregex=r'^\d+$').annotate(
+        invoice_number_int=Cast('invoice_number', IntegerField())).aggregate(Max('invoice_number_int'))
+
+    return max_invoice_number['invoice_number_int__max'] or 0
+
+
+def get_counter(series, lock=False):
+    counter, created = InvoiceNumberCounter.objects.get_or_create(
+        series=series, defaults={'last_number': lambda: _max_invoice_number(series)})
+    if lock and not created:
+        counter = InvoiceNumberCounter.objects.select_for_update().get(pk=counter.pk)
+
+    return counter
+
+
+def peek_invoice_number(series):
+    """
+    Next number of the series, without reserving it: form defaults use it, the number is only taken when the
+    invoice is saved.
+    """
+    return get_counter(series).last_number + 1
+
+
+def reserve_invoice_number(series, invoice_number, instance_id=None):
+    """
+    Takes invoice_number in the series for a new invoice and returns the number to save. Numbers typed by hand
+    move the counter forward; a number already taken since the form was opened is replaced by the next free one.
+    Must run in the transaction saving the invoice so that the counter stays locked until the number is stored.
+    """
+    if invoice_number is None or not NUMERIC_INVOICE_NUMBER.match(str(invoice_number)):
+        return invoice_number
+
+    number = int(invoice_number)
+    counter = get_counter(series, lock=True)
+    if number > counter.last_number:
+        counter.last_number = number
+        counter.save(update_fields=['last_number'])
+        return invoice_number
+
+    model = apps.get_model(SERIES_MODELS[series])
+    if model.objects.filter(invoice_number=invoice_number).exclude(pk=instance_id).exists():
+        counter.last_number += 1
+        counter.save(update_fields=['last_number'])
+        return str(counter.last_number)
+
+    return invoice_number
+
+
+def follow_invoice_number(series, invoice_number):
+    # an edited invoice keeps its number, the counter only needs to stay ahead of it
+    if invoice_number is not None and NUMERIC_INVOICE_NUMBER.match(str(invoice_number)):
+        InvoiceNumberCounter.objects.filter(series=series, last_number__lt=int(invoice_number)) \
+            .update(last_number=int(invoice_number))
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from django.contrib.postgres.fields import DateRangeField, DateTimeRangeField
+from django.db.models import DateTimeField, ExpressionWrapper, F, Func, Value
+from django.db.models.functions import Greatest
+
+
+class Period(Func):
+    """The closed range from start to end, daterange or the tsrange of naive date times."""
+    template = "%(function)s(%(expressions)s, '[]')"
+
+    def __init__(self, start, end, function='daterange'):
+        super().__init__(start, end,
+                         output_field=DateRangeField() if function == 'daterange' else DateTimeRangeField())
+        self.function = function
+
+
+# the periods of the rows, an end missing or before the start being read as the start. They are the expressions of
+# the GiST indexes of migration 0092, keep both in line.
+def date_period(start_field, end_field):
+    return Period(F(start_field), Greatest(start_field, end_field))
+
+
+def day_time_period(day_field, start_field, end_field):
+    start = ExpressionWrapper(F(day_field) + F(start_field), output_field=DateTimeField())
+    end = ExpressionWrapper(F(day_field) + F(end_field), output_field=DateTimeField())
+    return Period(start, Greatest(start, end), 'tsrange')
+
+
+def _overlapping(queryset, period, start, end):
+    return queryset.annotate(period=period).filter(
+        period__overlap=Period(Value(start), Value(max(start, end) if end is not None else start),
+                               period.function))
+
+
+def overlapping_dates(queryset, start_field, end_field, start, end):
+    """The rows of the queryset whose dates overlap the closed range from start to end, date times taken as dates."""
+    to_date = DateRangeField.base_field().to_python
+    return _overlapping(queryset, date_period(start_field, end_field), to_date(start),
+                        to_date(end) if end is not None else None)
+
+
+def overlapping_day_times(queryset, day_field, start_field, end_field, day, start_time, end_time):
+    """The rows of the queryset overlapping the times of the day, the rows without a start time never do."""
+    return _overlapping(queryset.filter(**{'%s__isnull' % start_field: False}),
+                        day_time_period(day_field, start_field, end_field), datetime.combine(day, start_time),
+                        datetime.combine(day, end_time) if end_time is not None else None)
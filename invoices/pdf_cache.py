@@ -0,0 +1,263 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from invoices.pdf_data import billing_config, prefetch_invoice_items
+
+logger = logging.getLogger(__name__)
+
+# bump when the layout of the printed invoices changes, the documents cached before are not served anymore
+PDF_CACHE_VERSION = 1
+
+CNS = 'cns'
+PRIVATE = 'private'
+PERSONAL_PARTICIPATION = 'personal-participation'
+
+FILENAME_SUFFIXES = {
+    CNS: '',
+    PRIVATE: '',
+    PERSONAL_PARTICIPATION: '-part-personnelle',
+}
+
+
+class LocalPdfCache:
+    """
+    PDFs stored as PDF_CACHE_ROOT/<key>.pdf. Reads touch the file, the least recently read ones are removed once
+    the folder holds more than PDF_CACHE_MAX_SIZE bytes. Hits and misses are counted by process.
+    """
+    SUFFIX = '.pdf'
+
+    def __init__(self, root=None, max_size=None):
+        self._root = root
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def root(self):
+        return self._root or settings.PDF_CACHE_ROOT
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else settings.PDF_CACHE_MAX_SIZE
+
+    def _path(self, key):
+        return os.path.join(self.root, key + self.SUFFIX)
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.root) if entry.name.endswith(self.SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            content = None
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return content
+
+    def set(self, key, content):
+        os.makedirs(self.root, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.root, suffix='.tmp', delete=False) as f:
+            f.write(content)
+        os.replace(f.name, self._path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        for entry in self._entries():
+            os.remove(entry.path)
+
+    def stats(self):
+        entries = self._entries()
+        return {'entries': len(entries),
+                'size': sum(entry.stat().st_size for entry in entries),
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+class RedisPdfCache:
+    """
+    PDFs stored in Redis with their last read time in a sorted set: the least recently read ones are removed once
+    the PDFs take more than PDF_CACHE_MAX_SIZE bytes. Hits and misses are counted in Redis for all processes.
+    """
+    PREFIX = 'inur:pdf-cache:'
+
+    def __init__(self, connection, max_size=None):
+        self.connection = connection
+        self._max_size = max_size
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else settings.PDF_CACHE_MAX_SIZE
+
+    def _key(self, name):
+        return self.PREFIX + name
+
+    def get(self, key):
+        content = self.connection.get(self._key('pdf:' + key))
+        pipeline = self.connection.pipeline()
+        if content is None:
+            pipeline.incr(self._key('misses'))
+        else:
+            pipeline.incr(self._key('hits'))
+            pipeline.zadd(self._key('lru'), {key: time.time()})
+        pipeline.execute()
+
+        return content
+
+    def set(self, key, content):
+        pipeline = self.connection.pipeline()
+        pipeline.set(self._key('pdf:' + key), content)
+        pipeline.zadd(self._key('lru'), {key: time.time()})
+        pipeline.hset(self._key('sizes'), key, len(content))
+        pipeline.execute()
+        self.evict()
+
+    def evict(self):
+        sizes = dict((key.decode(), int(size)) for key, size in self.connection.hgetall(self._key('sizes')).items())
+        total_size = sum(sizes.values())
+        for key in self.connection.zrange(self._key('lru'), 0, -1):
+            if total_size <= self.max_size:
+                break
+            key = key.decode()
+            pipeline = self.connection.pipeline()
+            pipeline.delete(self._key('pdf:' + key))
+            pipeline.zrem(self._key('lru'), key)
+            pipeline.hdel(self._key('sizes'), key)
+            pipeline.execute()
+            total_size -= sizes.get(key, 0)
+
+    def clear(self):
+        keys = [self._key('pdf:' + key.decode()) for key in self.connection.zrange(self._key('lru'), 0, -1)]
+        self.connection.delete(self._key('lru'), self._key('sizes'), *keys)
+
+    def stats(self):
+        hits, misses = self.connection.mget(self._key('hits'), self._key('misses'))
+        return {'entries': self.connection.zcard(self._key('lru')),
+                'size': sum(int(size) for size in self.connection.hvals(self._key('sizes'))),
+                'hits': int(hits or 0),
+                'misses': int(misses or 0)}
+
+
+_lock = threading.Lock()
+_caches = {}
+
+
+def get_pdf_cache():
+    """The cache of PDF_CACHE_BACKEND: 'local', 'redis', or None when the backend is empty."""
+    backend = settings.PDF_CACHE_BACKEND
+    if not backend:
+        return None
+    cache = _caches.get(backend)
+    if cache is None:
+        with _lock:
+            cache = _caches.get(backend)
+            if cache is None:
+                if backend == 'redis':
+                    from worker import conn
+                    cache = _caches[backend] = RedisPdfCache(conn)
+                else:
+                    cache = _caches[backend] = LocalPdfCache()
+
+    return cache
+
+
+def invoice_pdf_key(kind, invoice_item, billing, extra=()):
+    """
+    Hash of everything the PDF of kind prints for a prefetched invoice item: its fields, the patient, the
+    prescription, the prestations with their tariffs, the billing settings and the extra values of the render.
+    """
+    patient = invoice_item.patient
+    prescription = invoice_item.medical_prescription
+    prestations = []
+    for prestation in invoice_item.prestations.all():
+        carecode = prestation.carecode
+        employee = prestation.employee
+        prestations.append((prestation.id, prestation.date, prestation.quantity, carecode.code, carecode.name,
+                            carecode.reimbursed, carecode.contribution_undue, carecode.gross_amount(prestation.date),
+                            str(employee) if employee is not None else None,
+                            employee.provider_code if employee is not None else None))
+    data = (PDF_CACHE_VERSION, kind, tuple(extra),
+            (invoice_item.invoice_number, invoice_item.invoice_date, invoice_item.accident_id,
+             invoice_item.accident_date, invoice_item.invoice_send_date, invoice_item.patient_invoice_date),
+            (patient.code_sn, patient.name, patient.first_name, patient.address, patient.zipcode, patient.city,
+             patient.is_private, patient.participation_statutaire and (patient.age or 0) > 18),
+            (str(prescription), prescription.file.name) if prescription is not None else None,
+            tuple(sorted(billing.items())),
+            tuple(prestations))
+
+    return hashlib.sha256(repr(data).encode('utf-8')).hexdigest()
+
+
+def _response_content(response):
+    # response.close() would send request_finished and close the database connection of the running request
+    if response.streaming:
+        return b''.join(response.streaming_content)
+
+    return response.content
+
+
+def cached_pdf_response(kind, queryset, render, extra=()):
+    """
+    Serves the PDF of kind of the single invoice item of queryset from the cache, render() builds the response when
+    it is missing. Selections of several invoices are always rendered.
+    """
+    cache = get_pdf_cache()
+    invoice_items = list(prefetch_invoice_items(queryset)[:2]) if cache is not None else []
+    if len(invoice_items) != 1:
+        return render()
+
+    invoice_item = invoice_items[0]
+    key = invoice_pdf_key(kind, invoice_item, billing_config(), extra)
+    content = cache.get(key)
+    state = 'hit'
+    if content is None:
+        state = 'miss'
+        started_at = time.monotonic()
+        content = _response_content(render())
+        cache.set(key, content)
+        logger.info('%s PDF of invoice %s rendered in %.3fs' % (kind, invoice_item.invoice_number,
+                                                              time.monotonic() - started_at))
+
+    response = HttpResponse(content, content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="invoice-%s-%s-%s%s.pdf"' % (
+        invoice_item.patient.name, invoice_item.invoice_number, invoice_item.invoice_date.strftime('%d-%m-%Y'),
+        FILENAME_SUFFIXES[kind])
+    response['X-PDF-Cache'] = state
+
+    return response
@@ -0,0 +1,80 @@
+from constance import config
+from django.conf import settings
+from django.db.models import Prefetch
+
+BILLING_CONFIG_KEYS = ('NURSE_NAME', 'NURSE_ADDRESS', 'NURSE_ZIP_CODE_CITY', 'NURSE_PHONE_NUMBER', 'MAIN_NURSE_CODE',
+                       'MAIN_BANK_ACCOUNT')
+
+
+def _config_values(keys):
+    """
+    Returns the constance settings of keys. mget, from the constance Backend interface, reads them in a single
+    query but is only reachable through the private config._backend; they are read one by one without it.
+    """
+    mget = getattr(getattr(config, '_backend', None), 'mget', None)
+    if mget is None:
+        return {key: getattr(config, key) for key in keys}
+    values = {key: settings.CONSTANCE_CONFIG[key][0] for key in keys}
+    values.update(mget(keys))
+
+    return values
+
+
+def billing_config():
+    """Returns the constance settings printed on invoices."""
+    return _config_values(BILLING_CONFIG_KEYS)
+
+
+def prefetch_invoice_items(queryset):
+    """
+    Loads everything the PDF builders read from an InvoiceItem queryset: patient, medical prescription,
+    prestations in printing order with their care code and employee. Tariffs come from the tariff index.
+    """
+    from invoices.models import Prestation
+
+    prestations = Prestation.objects.select_related('carecode', 'employee', 'employee__user') \
+        .order_by('date', 'carecode__name')
+
+    return queryset.select_related('patient', 'medical_prescription', 'medical_prescription__prescriptor') \
+        .prefetch_related(Prefetch('prestations', queryset=prestations))
+
+
+def iter_invoice_items(queryset, batch_size=None):
+    """
+    Iterates the invoices of the queryset ordered by invoice number, prefetched all at once or, when
+    batch_size is given, by blocks of batch_size invoices so that memory does not grow with the selection.
+    """
+    if batch_size is None:
+        yield from prefetch_invoice_items(queryset.order_by("invoice_number"))
+        return
+
+    for batch in invoice_item_batches(queryset, batch_size):
+        yield from prefetch_invoice_items(batch)
+
+
+def invoice_item_batches(queryset, batch_size):
+    """The invoices of the queryset ordered by invoice number, as querysets of batch_size invoices."""
+    from invoices.models import InvoiceItem
+
+    ids = list(queryset.order_by("invoice_number").values_list('id', flat=True))
+    for i in range(0, len(ids), batch_size):
+        yield InvoiceItem.objects.filter(id__in=ids[i:i + batch_size]).order_by("invoice_number")
+
+
+def invoice_pages(invoice_item):
+    """
+    Splits the prestations of an invoice in sheets of InvoiceItem.PRESTATION_LIMIT_MAX, each with its own
+    invoice number when the invoice does not fit on one sheet.
+    """
+    if 'prestations' in getattr(invoice_item, '_prefetched_objects_cache', {}):
+        prestations = list(invoice_item.prestations.all())
+    else:
+        prestations = list(invoice_item.prestations.select_related('carecode', 'employee')
+                           .order_by('date', 'carecode__name'))
+    page_size = invoice_item.PRESTATION_LIMIT_MAX
+    pages = [prestations[i:i + page_size] for i in range(0, len(prestations), page_size)]
+    if len(pages) == 1:
+        return [(invoice_item.invoice_number, pages[0])]
+
+    return [(invoice_item.invoice_number + str(index + 1) + invoice_item.invoice_date.strftime('%m%Y'), page)
+            for index, page in enumerate(pages)]
@@ -0,0 +1,170 @@
+import threading
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus.para import Paragraph
+from reportlab.platypus.tables import Table, TableStyle
+
+HEADER_TABLE_STYLE = TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
+                                 ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+                                 ('FONTSIZE', (0, 0), (-1, -1), 9),
+                                 ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+                                 ('SPAN', (1, 1), (1, 2)),
+                                 ])
+
+RECAP_TABLE_STYLE = TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
+                                ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+                                ('FONTSIZE', (0, 0), (-1, -1), 9),
+                                ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+                                ])
+
+CHECKBOX_TABLE_STYLE = TableStyle([('ALIGN', (1, 1), (-2, -2), 'RIGHT'),
+                                   ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+                                   ('FONTSIZE', (0, 0), (-1, -1), 9),
+                                   ('BOX', (0, 0), (0, 0), 0.75, colors.black),
+                                   ('SPAN', (1, 1), (1, 2)),
+                                   ])
+
+FINAL_PAGE_TOTAL_STYLE = TableStyle([('ALIGN', (0, 0), (0, 0), 'LEFT'),
+                                     ('ALIGN', (-1, -1), (-1, -1), 'CENTER'),
+                                     ('VALIGN', (-1, -1), (-1, -1), 'MIDDLE'),
+                                     ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
+                                     ('FONTSIZE', (0, 0), (-1, -1), 9),
+                                     ('BOX', (1, 0), (-1, -1), 1.25, colors.black)])
+
+
+def prestations_table_style(font_size):
+    return TableStyle([('ALIGN', (1, 1), (-2, -2), 'LEFT'),
+                       ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+                       ('ALIGN', (0, -1), (-6, -1), 'RIGHT'),
+                       ('INNERGRID', (0, -1), (-6, -1), 0, colors.white),
+                       ('ALIGN', (0, -2), (-6, -2), 'RIGHT'),
+                       ('INNERGRID', (0, -2), (-6, -2), 0, colors.white),
+                       ('FONTSIZE', (0, 0), (-1, -1), font_size),
+                       ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+                       ])
+
+
+CNS_PRESTATIONS_TABLE_STYLE = prestations_table_style(8)
+PRIVATE_PRESTATIONS_TABLE_STYLE = prestations_table_style(7)
+
+
+def checkbox_table(label):
+    table = Table([["", label]], [1 * cm, 4 * cm], 1 * [0.5 * cm], hAlign='LEFT')
+    table.setStyle(CHECKBOX_TABLE_STYLE)
+
+    return table
+
+
+FINAL_PAGE_TITLE_STYLE = TableStyle([('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                                     ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
+                                     ('FONTSIZE', (0, 0), (-1, -1), 12),
+                                     ('BOX', (0, 0), (-1, -1), 1.25, colors.black),
+                                     ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                                     ])
+
+FINAL_PAGE_SUPPLIER_STYLE = TableStyle([('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+                                        ('ALIGN', (3, 0), (3, 0), 'CENTER'),
+                                        ('INNERGRID', (0, 0), (-1, -1), 0, colors.white),
+                                        ('SPAN', (1, 2), (2, 2)),
+                                        ('FONTSIZE', (0, 0), (-1, -1), 8),
+                                        ('BOX', (3, 0), (3, 3), 0.25, colors.black),
+                                        ('BOX', (3, 0), (3, 1), 0.25, colors.black),
+                                        ('BOX', (1, 3), (1, 3), 1, colors.black)])
+
+FINAL_PAGE_SUMMARY = u"Récapitulation des notes d’honoraires du chef de la fourniture de soins de santé dispensés " \
+                     u"aux personnes protégées relevant de l’assurance maladie / assurance accidents ou de " \
+                     u"l’assurance dépendance."
+FINAL_PAGE_PERIOD = u"Pendant la période du :.................................. au :.................................."
+FINAL_PAGE_CERTIFICATION = u"Certifié sincère et véritable, mais non encore acquitté: ________________ ," \
+                           u"le ______________________"
+
+
+class InvoiceLayout:
+    """
+    The parts of the invoice PDFs that are the same on every sheet and depend on the billing settings only: the
+    paragraph styles and the cells of the supplier header, of the static tables and of the final page. ReportLab
+    keeps the state of a document on its flowables, the methods build new ones from the shared cells and styles.
+    """
+
+    def __init__(self, billing):
+        self.billing = billing
+        self.styles = getSampleStyleSheet()
+        self.styles.add(ParagraphStyle(name='Center', alignment=TA_CENTER))
+        self.styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
+        self.styles.add(ParagraphStyle(name='Left', alignment=TA_LEFT))
+
+        self.supplier_header = ['IDENTIFICATION DU FOURNISSEUR DE SOINS DE SANTE\n'
+                                + "{0}\n{1}\n{2}\n{3}".format(billing['NURSE_NAME'], billing['NURSE_ADDRESS'],
+                                                              billing['NURSE_ZIP_CODE_CITY'],
+                                                              billing['NURSE_PHONE_NUMBER']),
+                                'CODE DU FOURNISSEUR DE SOINS DE SANTE\n{0}'.format(billing['MAIN_NURSE_CODE'])]
+        self.iban_data = [[u"Numéro IBAN: %s" % billing['MAIN_BANK_ACCOUNT']]]
+        self.final_page_supplier_data = [[u"Identification du fournisseur de", billing['NURSE_NAME'], "",
+                                          u"réservé à l’union des caisses de maladie"],
+                                         [u"soins de santé", "", "", ""],
+                                         [u"Coordonnées bancaires :", billing['MAIN_BANK_ACCOUNT'], "", ""],
+                                         ["Code: ", billing['MAIN_NURSE_CODE'], "", ""]]
+
+    def direct_payment(self):
+        return checkbox_table("Paiement Direct")
+
+    def third_party_payment(self):
+        return checkbox_table("Tiers payant")
+
+    def acquit_signature(self):
+        return Table([["Pour acquit, le:", "Signature et cachet"]], [10 * cm, 10 * cm], 1 * [0.5 * cm],
+                     hAlign='LEFT')
+
+    def recap_intro(self):
+        return Table([[u"Veuillez trouver ci-joint le récapitulatif des factures ainsi que le montant total à payer"]],
+                     [10 * cm, 5 * cm], 1 * [0.5 * cm], hAlign='LEFT')
+
+    def iban(self):
+        return Table(self.iban_data, [10 * cm], 1 * [0.5 * cm], hAlign='LEFT')
+
+    def final_page_title(self):
+        table = Table([["RELEVE DES NOTES D’HONORAIRES DES"], ["ACTES ET SERVICES DES INFIRMIERS"]], [10 * cm],
+                      [0.75 * cm, 0.75 * cm])
+        table.setStyle(FINAL_PAGE_TITLE_STYLE)
+
+        return table
+
+    def final_page_supplier(self):
+        table = Table(self.final_page_supplier_data, [5 * cm, 3 * cm, 3 * cm, 7 * cm],
+                      [1.25 * cm, 0.5 * cm, 1.25 * cm, 1.25 * cm])
+        table.setStyle(FINAL_PAGE_SUPPLIER_STYLE)
+
+        return table
+
+    def final_page_summary(self):
+        return Paragraph(FINAL_PAGE_SUMMARY, self.styles['Justify'])
+
+    def final_page_period(self):
+        return Paragraph(FINAL_PAGE_PERIOD, self.styles['Justify'])
+
+    def final_page_certification(self):
+        return Paragraph(FINAL_PAGE_CERTIFICATION, self.styles['Left'])
+
+
+_lock = threading.Lock()
+_layouts = {}
+
+
+def invoice_layout(billing):
+    """
+    The layout of the billing settings, built on first use. A change of the settings builds a new one, the layout
+    of the previous settings is dropped.
+    """
+    key = tuple(sorted(billing.items()))
+    layout = _layouts.get(key)
+    if layout is None:
+        with _lock:
+            layout = _layouts.get(key)
+            if layout is None:
+                _layouts.clear()
+                layout = _layouts[key] = InvoiceLayout(billing)
+
+    return layout
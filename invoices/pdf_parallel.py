@@ -0,0 +1,104 @@
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+
+from invoices.invoiceitem_pdf import build_invoice_item, build_recap_pages
+from invoices.pdf_data import billing_config, invoice_item_batches, prefetch_invoice_items
+from invoices.pdf_stream import render_chunk, merge_files, STREAM_BATCH_SIZE
+from invoices.prescription_images import prefetch_prescription_images
+from invoices.tariffs import tariff_index
+
+# invoices and settings of the running render, inherited by the forked processes
+_job = {}
+_inherited_connections = []
+
+
+def _init_worker():
+    # never talk to the database on the sockets inherited from the parent process: they are kept referenced so
+    # they are not closed from here, and Django opens its own connection if a worker ever needs one
+    for connection in connections.all():
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+            connection.connection = None
+
+
+def _render_invoice(index):
+    invoice_item, with_image = _job['invoices'][index]
+    elements, summary_data = build_invoice_item(invoice_item, _job['billing'], with_image, [],
+                                                images=_job['images'])
+    chunk = render_chunk(elements)
+    try:
+        return chunk.read(), summary_data
+    finally:
+        chunk.close()
+
+
+def sheets_count(queryset):
+    """The sheets of the invoices of the queryset, counted by the database, see invoice_pages."""
+    from invoices.models import InvoiceItem
+
+    page_size = InvoiceItem.PRESTATION_LIMIT_MAX
+    return sum((count + page_size - 1) // page_size for count in
+               queryset.order_by().annotate(prestations_count=Count('prestations'))
+               .values_list('prestations_count', flat=True))
+
+
+def render_cns_pdf(queryset, output, med_p=False, processes=None, progress_callback=None):
+    """
+    Writes the CNS invoices document of the queryset to output, each invoice being rendered to its own PDF by a
+    pool of forked processes. The invoices are stitched in invoice_number order and followed by the recap and
+    final page, the pages are the same as the ones of get_doc_elements().
+
+    Forking from a web request is not safe, this runs in the RQ worker. The invoices are loaded by blocks of
+    STREAM_BATCH_SIZE, and the prescription scans of a block downloaded, before forking the processes rendering
+    it, so the processes do not query the database nor the Drive.
+    """
+    processes = processes or settings.PDF_RENDER_PROCESSES
+    billing = billing_config()
+    sheets_total = sheets_count(queryset)
+    tariff_index.load()
+
+    files = []
+    summary_data = []
+    already_added_images = []
+    try:
+        for batch in invoice_item_batches(queryset, STREAM_BATCH_SIZE):
+            images = prefetch_prescription_images(batch) if med_p else None
+            invoices = []
+            for qs in prefetch_invoice_items(batch):
+                with_image = med_p and qs.medical_prescription and bool(qs.medical_prescription.file) \
+                             and qs.medical_prescription.file.name not in already_added_images
+                if with_image:
+                    already_added_images.append(qs.medical_prescription.file.name)
+                invoices.append((qs, with_image))
+            if images is not None:
+                images.close()
+
+            _job.update(invoices=invoices, billing=billing, images=images)
+            try:
+                with ProcessPoolExecutor(max_workers=processes,
+                                         mp_context=multiprocessing.get_context('fork'),
+                                         initializer=_init_worker) as executor:
+                    chunksize = max(1, len(invoices) // (processes * 4))
+                    for content, invoice_summary_data in executor.map(_render_invoice, range(len(invoices)),
+                                                                      chunksize=chunksize):
+                        chunk = tempfile.TemporaryFile()
+                        chunk.write(content)
+                        chunk.seek(0)
+                        files.append(chunk)
+                        summary_data.extend(invoice_summary_data)
+                        if progress_callback:
+                            progress_callback(len(summary_data), sheets_total)
+            finally:
+                _job.clear()
+        files.append(render_chunk(build_recap_pages(summary_data, billing)))
+    except Exception:
+        for chunk in files:
+            chunk.close()
+        raise
+
+    return merge_files(files, output)
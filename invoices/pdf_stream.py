@@ -0,0 +1,151 @@
+import tempfile
+from wsgiref.util import FileWrapper
+
+from django.http import StreamingHttpResponse
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from reportlab.lib.units import cm
+from reportlab.platypus.doctemplate import SimpleDocTemplate
+from reportlab.platypus.flowables import PageBreak
+
+# invoices prefetched at once while streaming an export
+STREAM_BATCH_SIZE = 100
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+def render_chunk(elements):
+    """Renders a list of flowables to a temporary PDF file, trailing page breaks are dropped."""
+    while elements and isinstance(elements[-1], PageBreak):
+        elements.pop()
+    chunk = tempfile.TemporaryFile()
+    doc = SimpleDocTemplate(chunk, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
+    doc.build(elements)
+    chunk.seek(0)
+
+    return chunk
+
+
+def merge_chunks(chunks, output):
+    """
+    Renders every chunk (a list of flowables, usually one invoice) to its own temporary PDF and appends it to
+    output, so that only one chunk is in memory at a time.
+    """
+    return merge_files((render_chunk(elements) for elements in chunks), output)
+
+
+def merge_files(files, output):
+    """Concatenates the PDF files into output, each file is closed as soon as its pages are copied."""
+    writer = IncrementalPdfWriter(output)
+    for chunk in files:
+        try:
+            writer.append(chunk)
+        finally:
+            chunk.close()
+    writer.close()
+    output.seek(0)
+
+    return output
+
+
+class _Reference(IndirectObject):
+    # a reference renumbered for the output, never resolved
+    def __init__(self, number):
+        super().__init__(number, 0, None)
+
+
+class IncrementalPdfWriter:
+    """
+    Writes a PDF file made of the pages of the appended ones. The objects of a file are written to output as soon
+    as it is appended, only their offsets and the numbers of the pages are kept until close() writes the page tree
+    and the cross-reference table.
+    """
+    PAGES = 1
+
+    def __init__(self, output):
+        self.output = output
+        self.offsets = [None]
+        self.pages = []
+        output.write(b'%PDF-1.4\n%\x93\x8c\x8b\x9e\n')
+
+    def append(self, chunk):
+        reader = PdfFileReader(chunk, strict=False)
+        # the pages read flattened, with the attributes inherited from their page tree
+        pages = [reader.getPage(i) for i in range(reader.getNumPages())]
+        numbers = {}
+        pending = []
+
+        def renumber(reference):
+            key = (reference.idnum, reference.generation)
+            if key not in numbers:
+                numbers[key] = self._new_number()
+                pending.append(reference)
+            return _Reference(numbers[key])
+
+        for page in pages:
+            if page.indirectRef is not None:
+                numbers[(page.indirectRef.idnum, page.indirectRef.generation)] = self._new_number()
+        for page in pages:
+            number = numbers[(page.indirectRef.idnum, page.indirectRef.generation)] \
+                if page.indirectRef is not None else self._new_number()
+            page[NameObject('/Parent')] = _Reference(self.PAGES)
+            self._write(number, _renumbered(page, renumber))
+            self.pages.append(number)
+        while pending:
+            reference = pending.pop()
+            self._write(numbers[(reference.idnum, reference.generation)],
+                        _renumbered(reference.getObject(), renumber))
+
+    def close(self):
+        self._write(self.PAGES, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(_Reference(number) for number in self.pages),
+            NameObject('/Count'): NumberObject(len(self.pages)),
+        }))
+        catalog = self._new_number()
+        self._write(catalog, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): _Reference(self.PAGES),
+        }))
+        xref = self.output.tell()
+        self.output.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        for offset in self.offsets:
+            self.output.write(b'%010d 00000 n \n' % offset)
+        self.output.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                          % (len(self.offsets) + 1, catalog, xref))
+
+    def _new_number(self):
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def _write(self, number, obj):
+        self.offsets[number - 1] = self.output.tell()
+        self.output.write(b'%d 0 obj\n' % number)
+        obj.writeToStream(self.output, None)
+        self.output.write(b'\nendobj\n')
+
+
+def _renumbered(obj, renumber):
+    # in place: the objects of an appended file are written once and dropped with its reader
+    if isinstance(obj, _Reference):
+        return obj
+    if isinstance(obj, IndirectObject):
+        return renumber(obj)
+    if isinstance(obj, DictionaryObject):
+        for key, value in list(obj.items()):
+            obj[key] = _renumbered(value, renumber)
+    elif isinstance(obj, ArrayObject):
+        for i, value in enumerate(obj):
+            obj[i] = _renumbered(value, renumber)
+
+    return obj
+
+
+def pdf_file_response(output, content_disposition):
+    response = StreamingHttpResponse(FileWrapper(output, STREAM_BLOCK_SIZE), content_type='application/pdf')
+    response['Content-Disposition'] = content_disposition
+
+    return response
+
+
+def streaming_pdf_response(chunks, content_disposition):
+    return pdf_file_response(merge_chunks(chunks, tempfile.TemporaryFile()), content_disposition)
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+
+from invoices.pdf_cache import LocalPdfCache
+from invoices.thumbnails import read_file
+
+logger = logging.getLogger(__name__)
+
+# size of the prescription pages of the CNS invoices, in points
+PRINT_WIDTH = 469.88
+PRINT_HEIGHT = 773.19
+
+
+class PrescriptionImageCache(LocalPdfCache):
+    """The downscaled scans, stored as PRESCRIPTION_IMAGE_CACHE_ROOT/<key>.jpg."""
+    SUFFIX = '.jpg'
+
+    @property
+    def root(self):
+        return self._root or settings.PRESCRIPTION_IMAGE_CACHE_ROOT
+
+    @property
+    def max_size(self):
+        return self._max_size if self._max_size is not None else settings.PRESCRIPTION_IMAGE_CACHE_MAX_SIZE
+
+
+prescription_image_cache = PrescriptionImageCache()
+
+
+def print_image(data, dpi=None):
+    """The scan data resized to the prescription page at dpi, or the data itself when Pillow cannot read it."""
+    dpi = dpi or settings.PRESCRIPTION_IMAGE_DPI
+    try:
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+        image.thumbnail((round(PRINT_WIDTH * dpi / 72), round(PRINT_HEIGHT * dpi / 72)), Image.LANCZOS)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, 'JPEG', quality=85, optimize=True)
+    except (IOError, ValueError, Image.DecompressionBombError):
+        logger.exception('Cannot downscale the prescription scan')
+        return data
+
+    return output.getvalue()
+
+
+def prescription_image(field_file):
+    """
+    The print version of the scan of field_file, read from the cache when the Drive file did not change since it
+    was downloaded.
+    """
+    version = field_file.storage.file_version(field_file.name)
+    if version is None:
+        return print_image(read_file(field_file))
+
+    key = hashlib.sha1(repr((version, settings.PRESCRIPTION_IMAGE_DPI)).encode('utf-8')).hexdigest()
+    data = prescription_image_cache.get(key)
+    if data is None:
+        data = print_image(read_file(field_file))
+        prescription_image_cache.set(key, data)
+
+    return data
+
+
+class PrescriptionImages:
+    """
+    Downloads the scans of the prescriptions on a pool of threads as soon as it is created, get() waits for the
+    one of a file name. The threads only talk to the Drive, never to the database.
+    """
+
+    def __init__(self, prescriptions, threads=None):
+        field_files = {}
+        for prescription in prescriptions:
+            if prescription.file:
+                field_files.setdefault(prescription.file.name, prescription.file)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(threads or settings.PRESCRIPTION_DOWNLOAD_THREADS,
+                                                                   len(field_files))))
+        self._futures = dict((name, self._executor.submit(prescription_image, field_file))
+                             for name, field_file in field_files.items())
+
+    def get(self, name):
+        future = self._futures.get(name)
+        return future.result() if future is not None else None
+
+    def close(self, wait=True):
+        if not wait:
+            for future in self._futures.values():
+                future.cancel()
+        self._executor.shutdown(wait=wait)
+
+
+def prefetch_prescription_images(queryset, threads=None):
+    """Starts the downloads of the prescription scans of the invoice items of queryset."""
+    from invoices.models import MedicalPrescription
+
+    prescriptions = MedicalPrescription.objects.filter(id__in=queryset.values('medical_prescription_id')) \
+        .exclude(file='')
+
+    return PrescriptionImages(prescriptions, threads)
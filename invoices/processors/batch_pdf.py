@@ -0,0 +1,52 @@
+import logging
+
+from django.db import transaction
+from rq import Queue
+
+from invoices.invoiceitem_pdf import InvoiceItemBatchPdf
+from invoices.managers import InvoiceItemBatchManager
+from invoices.models import InvoiceItemBatch
+from worker import conn
+
+logger = logging.getLogger(__name__)
+
+BATCH_PDF_QUEUE = 'default'
+BATCH_PDF_JOB_TIMEOUT = 3600
+
+
+def schedule_batch_pdf_generation(batch):
+    _set_state(batch.pk, InvoiceItemBatch.PDF_PENDING, pdf_progress=0, pdf_total=0, pdf_error='')
+    batch.pdf_state = InvoiceItemBatch.PDF_PENDING
+    # the worker must see the committed batch and its dates
+    transaction.on_commit(lambda: Queue(BATCH_PDF_QUEUE, connection=conn).enqueue(generate_batch_pdf,
+                                                                                  batch.pk,
+                                                                                  job_timeout=BATCH_PDF_JOB_TIMEOUT))
+
+
+def generate_batch_pdf(batch_id):
+    batch = InvoiceItemBatch.objects.get(pk=batch_id)
+    try:
+        association = InvoiceItemBatchManager.update_associated_invoiceitems(batch)
+        logger.info('Batch %s: %s' % (batch_id, association))
+        _set_state(batch_id, InvoiceItemBatch.PDF_RENDERING, pdf_progress=0, pdf_total=0)
+
+        def progress(done, total):
+            _set_state(batch_id, InvoiceItemBatch.PDF_RENDERING, pdf_progress=done, pdf_total=total)
+
+        file_content = InvoiceItemBatchPdf.get_inmemory_pdf(batch, progress_callback=progress)
+        _set_state(batch_id, InvoiceItemBatch.PDF_UPLOADING)
+        # a new rendering replaces the file, under the name the batch already holds
+        storage = batch.file.storage
+        if storage.exists(batch.file.name):
+            storage.delete(batch.file.name)
+        name = storage.save(batch.file.name, file_content)
+        _set_state(batch_id, InvoiceItemBatch.PDF_DONE, file=name)
+    except Exception as e:
+        logger.exception('PDF generation failed for batch %s' % batch_id)
+        _set_state(batch_id, InvoiceItemBatch.PDF_FAILED, pdf_error=str(e) or e.__class__.__name__)
+        raise
+
+
+def _set_state(batch_id, state, **fields):
+    # update() keeps the batch pre/post save hooks (file renaming, rescheduling) out of the way
+    InvoiceItemBatch.objects.filter(pk=batch_id).update(pdf_state=state, **fields)
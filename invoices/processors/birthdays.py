@@ -1,13 +1,21 @@
-import re
+import calendar
+from datetime import date, datetime
 
+from django.db.models import Q
 from django.utils import timezone
 
 from invoices.events import EventType, Event
-from invoices.models import Patient, extract_birth_date, calculate_age
+from invoices.models import Patient, calculate_age, birth_month_day
+from invoices.processors.generated_events import generate_events
 
 
 def process_and_generate(num_days: int):
-    events_processed = []
+    created, skipped = generate_birthday_events(num_days)
+    return created + skipped
+
+
+def generate_birthday_events(num_days: int):
+    """Creates the missing birthday events of the next num_days days, returns the created and the skipped ones."""
     even_type_birthday = EventType.objects.filter(to_be_generated=True, name__icontains='Birthdays').first()
     if not even_type_birthday:
         even_type_birthday = EventType(
@@ -16,45 +24,60 @@ def process_and_generate(num_days: int):
         )
         even_type_birthday.save()
 
-    this_day = timezone.datetime.today()
+    this_day = date.today()
     last_day = this_day + timezone.timedelta(days=+num_days)
 
-    patients = list_patients_with_birth_date_in_range_still_alive(this_day, last_day)
-    for patient in patients:
-        patient_birthday = extract_birth_date(patient.code_sn)
-        if patient_birthday.replace(year=last_day.year) <= last_day:
-            searches_date = timezone.now().replace(last_day.year, patient_birthday.month, patient_birthday.day)
-            events = Event.objects.filter(day=searches_date).filter(event_type__name='Birthdays')
-            if not events:
-                event = Event(
-                    day=searches_date,
+    return generate_events(even_type_birthday, birthday_events(even_type_birthday, this_day, last_day),
+                           this_day, last_day)
+
+
+def birthday_events(event_type, start_date, end_date):
+    generated_on = timezone.now()
+    for patient in list_patients_with_birth_date_in_range_still_alive(start_date, end_date):
+        for year in range(start_date.year, end_date.year + 1):
+            try:
+                birthday = patient.birth_date.replace(year=year)
+            except ValueError:
+                # born on the 29th of February
+                continue
+            if start_date <= birthday <= end_date:
+                yield Event(
+                    day=birthday,
                     state=1,
-                    event_type=even_type_birthday,
+                    event_type=event_type,
                     notes='%s will turn %d \n generated on %s' % (patient,
-                                                                  calculate_age(None, patient.code_sn),
-                                                                  timezone.now()),
+                                                                   calculate_age(birthday, patient.code_sn),
+                                                                   generated_on),
                     patient=patient
                 )
-                event.save()
-                events_processed.append(event)
-            else:
-                for e in events:
-                    events_processed.append(e)
-
-    return events_processed
 
 
 def list_patients_with_birth_date_in_range_still_alive(start_date_range, end_date_range):
-    my_regexp = re.compile(
-        '^[0-9]{4}(' + _build_date_range_in_regexp(start_date_range, end_date_range) + ')')
-    return Patient.objects.filter(code_sn__regex=my_regexp.pattern).filter(date_of_death__isnull=True)
-
-
-def _build_date_range_in_regexp(start_date, end_date):
-    dateDelta = (end_date - start_date).days
-    STR = ''
-    for date in range(dateDelta + 1):
-        focusedDate = start_date + timezone.timedelta(date)
-        STR += focusedDate.strftime("%m%d") + '|'
-    STR = STR[:-1]
-    return STR
+    return Patient.objects.filter(birthdays_between(start_date_range, end_date_range)).filter(
+        date_of_death__isnull=True)
+
+
+def _as_date(day):
+    return day.date() if isinstance(day, datetime) else day
+
+
+def birthdays_between(start_date, end_date):
+    """
+    Q of the patients whose birthday falls from start_date to end_date, both included, on the indexed MMDD key of
+    their birth date. The range wraps around the end of the year, the 29th of February only counts in leap years.
+    """
+    start_date, end_date = _as_date(start_date), _as_date(end_date)
+    if end_date < start_date:
+        return Q(pk__in=[])
+    start_key, end_key = birth_month_day(start_date), birth_month_day(end_date)
+    if 365 <= (end_date - start_date).days:
+        birthdays = Q(birth_month_day__isnull=False)
+    elif start_date.year == end_date.year:
+        birthdays = Q(birth_month_day__range=(start_key, end_key))
+    else:
+        birthdays = Q(birth_month_day__gte=start_key) | Q(birth_month_day__lte=end_key)
+    if not any(calendar.isleap(year) and start_date <= date(year, 2, 29) <= end_date
+               for year in range(start_date.year, end_date.year + 1)):
+        birthdays &= ~Q(birth_month_day=229)
+
+    return birthdays
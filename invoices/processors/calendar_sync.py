@@ -0,0 +1,122 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rq import Queue
+
+from invoices.calendar_outbox import CalendarOutboxEntry
+from worker import conn
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_SYNC_QUEUE = 'default'
+CALENDAR_SYNC_BATCH_SIZE = 200
+# longer than the Google batch requests of a drain batch take
+CALENDAR_SYNC_CLAIM_DURATION = timedelta(minutes=10)
+
+
+def enqueue_calendar_sync():
+    # jobs running side by side are harmless: each one claims the entries it sends and skips the claimed ones
+    return Queue(CALENDAR_SYNC_QUEUE, connection=conn).enqueue(drain_calendar_outbox)
+
+
+def drain_calendar_outbox(batch_size=CALENDAR_SYNC_BATCH_SIZE):
+    """
+    Sends the outbox entries to Google Calendar in batch requests until the outbox is empty or a whole batch
+    failed. The entries of a batch are claimed in a short transaction before they are sent so that the jobs running
+    side by side skip them, and an entry is removed once sent unless it was updated meanwhile. Returns the
+    (sent, failed) counts.
+    """
+    sent = failed = 0
+    while True:
+        entries = _claim_entries(batch_size)
+        if not entries:
+            return sent, failed
+
+        errors = _sync_entries(entries)
+        for entry in entries:
+            error = errors.get(entry.pk)
+            if error is None:
+                CalendarOutboxEntry.objects.filter(pk=entry.pk, updated_at=entry.updated_at).delete()
+                sent += 1
+            else:
+                CalendarOutboxEntry.objects.filter(pk=entry.pk, updated_at=entry.updated_at) \
+                    .update(attempts=entry.attempts + 1, last_error=str(error), claimed_until=None)
+                failed += 1
+        if len(errors) == len(entries) or len(entries) < batch_size:
+            return sent, failed
+
+
+def _claim_entries(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        # entries which already failed come last so that they do not hold back the new ones
+        entries = list(CalendarOutboxEntry.objects.select_for_update(skip_locked=True)
+                       .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+                       .order_by('attempts', 'updated_at')[:batch_size])
+        CalendarOutboxEntry.objects.filter(pk__in=[entry.pk for entry in entries]) \
+            .update(claimed_until=now + CALENDAR_SYNC_CLAIM_DURATION)
+
+    return entries
+
+
+def _sync_entries(entries):
+    errors = {}
+    prestation_entries = [e for e in entries if e.object_type == CalendarOutboxEntry.PRESTATION]
+    event_entries = [e for e in entries if e.object_type == CalendarOutboxEntry.EVENT]
+    for sync, selected in ((_sync_prestations, prestation_entries), (_sync_events, event_entries)):
+        if not selected:
+            continue
+        try:
+            errors.update(sync(selected))
+        except Exception as e:
+            logger.exception('Calendar sync failed')
+            errors.update((entry.pk, e) for entry in selected)
+
+    return errors
+
+
+def _sync_prestations(entries):
+    from invoices.models import Prestation, prestation_gcalendar
+
+    entries_by_id = dict((entry.object_id, entry) for entry in entries)
+    updated_ids = [entry.object_id for entry in entries if entry.action == CalendarOutboxEntry.UPDATE]
+    deleted_ids = [entry.object_id for entry in entries if entry.action == CalendarOutboxEntry.DELETE]
+    prestations = list(Prestation.objects.filter(id__in=updated_ids)
+                       .select_related('invoice_item__patient', 'carecode'))
+
+    errors = {}
+    if prestations:
+        errors.update(prestation_gcalendar.update_events(prestations))
+    if deleted_ids:
+        errors.update(prestation_gcalendar.delete_events(deleted_ids))
+
+    return dict((entries_by_id[prestation_id].pk, error) for prestation_id, error in errors.items())
+
+
+def _sync_events(entries):
+    from invoices.backends import get_event_calendar
+    from invoices.events import Event
+
+    entries_by_id = dict((entry.object_id, entry) for entry in entries)
+    updated_ids = [entry.object_id for entry in entries if entry.action == CalendarOutboxEntry.UPDATE]
+    events = list(Event.objects.filter(id__in=updated_ids, event_type__name='soin', employees__isnull=False)
+                  .select_related('patient', 'employees__user'))
+
+    calendar_events = set()
+    for entry in entries:
+        if entry.action == CalendarOutboxEntry.DELETE and entry.calendar_id:
+            calendar_events.add((entry.object_id, entry.calendar_id))
+        if entry.previous_calendar_id and entry.previous_calendar_id != entry.calendar_id:
+            calendar_events.add((entry.object_id, entry.previous_calendar_id))
+    if not events and not calendar_events:
+        return {}
+
+    calendar = get_event_calendar()
+    errors = calendar.update_events(events)
+    errors.update((event_id, error) for (event_id, calendar_id), error
+                  in calendar.delete_events(sorted(calendar_events)).items())
+
+    return dict((entries_by_id[event_id].pk, error) for event_id, error in errors.items())
@@ -0,0 +1,24 @@
+from django.db import transaction
+
+from invoices.events import Event, invalidate_event_calendar
+
+
+def event_key(event):
+    return event.patient_id, event.event_type_id, event.day
+
+
+def generate_events(event_type, events, start_date, end_date):
+    """
+    Saves the events of event_type generated from start_date to end_date which do not exist yet, an event being
+    identified by its (patient, type, day). Returns the created events and the existing ones, skipped.
+    """
+    events = {event_key(event): event for event in events}
+    with transaction.atomic():
+        existing = {event_key(event): event for event in Event.objects.filter(
+            event_type=event_type, day__range=(start_date, end_date),
+            patient_id__in={patient_id for patient_id, _, _ in events}).order_by()}
+        # bulk_create sends no signal, the generated types are not synced with the Google calendars
+        created = Event.objects.bulk_create([event for key, event in events.items() if key not in existing])
+    invalidate_event_calendar(*{event.day for event in created})
+
+    return created, [existing[key] for key in events if key in existing]
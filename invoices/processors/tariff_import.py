@@ -0,0 +1,176 @@
+import csv
+import io
+import time
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from invoices.models import CareCode, ValidityDate, invalidate_tariff_index
+from invoices.totals import invoice_item_ids_for_care_codes, refresh_invoice_totals
+
+TariffRow = namedtuple('TariffRow', ['line', 'code', 'description', 'coefficient', 'gross_amount'])
+
+CARE_CODE_NAME_MAX_LENGTH = CareCode._meta.get_field('name').max_length
+CARE_CODE_DESCRIPTION_MAX_LENGTH = CareCode._meta.get_field('description').max_length
+
+
+class TariffImportError(ValueError):
+    pass
+
+
+def parse_cns_csv(lines):
+    """
+    Parses the CNS nomenclature exports of initialdata: 'Section ...' headers and name;code;coef;amount rows,
+    decimals written with a comma or a dot. Yields the rows one by one.
+    """
+    for line_number, row in enumerate(csv.reader(lines, delimiter=';'), start=1):
+        if not row or not ''.join(row).strip() or row[0].startswith('Section'):
+            continue
+        if len(row) < 4:
+            raise TariffImportError('Line %s: expected name;code;coef;amount, got %s' % (line_number, ';'.join(row)))
+        try:
+            coefficient = Decimal(row[2].strip().replace(',', '.') or '0')
+            gross_amount = Decimal(row[3].strip().replace(',', '.'))
+        except InvalidOperation:
+            raise TariffImportError('Line %s: invalid amount %s' % (line_number, ';'.join(row)))
+        yield TariffRow(line_number, row[1].strip(), row[0].strip(), coefficient, gross_amount)
+
+
+def open_cns_csv(uploaded_file, encoding='utf-8-sig'):
+    return io.TextIOWrapper(uploaded_file.file, encoding=encoding, newline='')
+
+
+class TariffImportReport:
+    def __init__(self, start_date, dry_run):
+        self.start_date = start_date
+        self.dry_run = dry_run
+        self.rows_count = 0
+        self.created_codes = []
+        self.updated_codes = []
+        self.created_validities = []
+        self.closed_validities = []
+        self.updated_validities = []
+        self.unchanged = []
+        self.duplicates = []
+        self.duration = 0
+
+    def lines(self):
+        lines = ['%s rows read, tariffs starting %s%s' % (self.rows_count, self.start_date,
+                                                            ' (dry run, nothing saved)' if self.dry_run else '')]
+        for title, items in (('Created care codes', self.created_codes),
+                             ('Renamed care codes', self.updated_codes),
+                             ('Closed validity dates', self.closed_validities),
+                             ('Created validity dates', self.created_validities),
+                             ('Updated validity dates', self.updated_validities),
+                             ('Duplicated codes, last row kept', self.duplicates)):
+            if items:
+                lines.append('%s (%s): %s' % (title, len(items), ', '.join(items)))
+        lines.append('Unchanged: %s' % len(self.unchanged))
+        lines.append('Done in %.2fs' % self.duration)
+
+        return lines
+
+    def __str__(self):
+        return '\n'.join(self.lines())
+
+
+def import_cns_tariffs(rows, start_date, dry_run=False, rename=False):
+    """
+    Brings CareCode and ValidityDate in line with the tariffs of rows starting at start_date, with a few bulk
+    queries in one transaction:
+
+    - unknown codes are created with the names and descriptions of the file, the known ones only take them with
+      rename, their names are often edited by hand;
+    - a tariff with another amount closes the validity date running at start_date the day before and starts a
+      new one, running until the next validity date if one was already planned;
+    - a validity date starting at start_date gets the amount of the file.
+
+    Nothing is written with dry_run, the report tells what would change.
+    """
+    started_at = time.monotonic()
+    report = TariffImportReport(start_date, dry_run)
+    tariffs = {}
+    for row in rows:
+        report.rows_count += 1
+        if row.code in tariffs:
+            report.duplicates.append(row.code)
+        tariffs[row.code] = row
+
+    with transaction.atomic():
+        care_codes = dict((care_code.code, care_code)
+                          for care_code in CareCode.objects.select_for_update().filter(code__in=tariffs.keys()))
+        new_care_codes = []
+        renamed_care_codes = []
+        for code, row in tariffs.items():
+            name = row.description[:CARE_CODE_NAME_MAX_LENGTH]
+            description = row.description[:CARE_CODE_DESCRIPTION_MAX_LENGTH]
+            care_code = care_codes.get(code)
+            if care_code is None:
+                new_care_codes.append(CareCode(code=code, name=name, description=description))
+                report.created_codes.append(code)
+            elif rename and (care_code.name, care_code.description) != (name, description):
+                care_code.name = name
+                care_code.description = description
+                renamed_care_codes.append(care_code)
+                report.updated_codes.append(code)
+
+        validity_dates = dict((care_code.id, []) for care_code in care_codes.values())
+        for validity_date in ValidityDate.objects.select_for_update().filter(care_code__in=care_codes.values()) \
+                .order_by('start_date'):
+            validity_dates[validity_date.care_code_id].append(validity_date)
+
+        new_validity_dates = []
+        closed_validity_dates = []
+        updated_validity_dates = []
+        for code, row in tariffs.items():
+            care_code = care_codes.get(code)
+            periods = validity_dates[care_code.id] if care_code is not None else []
+            current = [v for v in periods
+                       if v.start_date <= start_date and (v.end_date is None or start_date <= v.end_date)]
+            following = [v for v in periods if v.start_date > start_date]
+            end_date = following[0].start_date - timedelta(days=1) if following else None
+            current = current[-1] if current else None
+            if current is not None and current.start_date == start_date:
+                if current.gross_amount != row.gross_amount:
+                    current.gross_amount = row.gross_amount
+                    updated_validity_dates.append(current)
+                    report.updated_validities.append('%s %s' % (code, row.gross_amount))
+                else:
+                    report.unchanged.append(code)
+                continue
+            if current is not None:
+                if current.gross_amount == row.gross_amount:
+                    report.unchanged.append(code)
+                    continue
+                if current.end_date is not None and (end_date is None or current.end_date < end_date):
+                    end_date = current.end_date
+                current.end_date = start_date - timedelta(days=1)
+                closed_validity_dates.append(current)
+                report.closed_validities.append('%s %s' % (code, current))
+            new_validity_dates.append((code, ValidityDate(start_date=start_date, end_date=end_date,
+                                                          gross_amount=row.gross_amount)))
+            report.created_validities.append('%s %s' % (code, row.gross_amount))
+
+        if not dry_run:
+            CareCode.objects.bulk_create(new_care_codes)
+            CareCode.objects.bulk_update(renamed_care_codes, ['name', 'description'])
+            # new care codes get their id from bulk_create on PostgreSQL
+            care_codes.update((care_code.code, care_code) for care_code in new_care_codes)
+            for code, validity_date in new_validity_dates:
+                validity_date.care_code = care_codes[code]
+            ValidityDate.objects.bulk_update(closed_validity_dates, ['end_date'])
+            ValidityDate.objects.bulk_update(updated_validity_dates, ['gross_amount'])
+            ValidityDate.objects.bulk_create([validity_date for code, validity_date in new_validity_dates])
+            # bulk operations do not send the signals the tariff index and the invoice totals listen to
+            invalidate_tariff_index(ValidityDate)
+            changed_care_code_ids = set(validity_date.care_code_id for validity_date in
+                                        closed_validity_dates + updated_validity_dates)
+            changed_care_code_ids.update(validity_date.care_code_id for code, validity_date in new_validity_dates)
+            if changed_care_code_ids:
+                refresh_invoice_totals(invoice_item_ids_for_care_codes(changed_care_code_ids, start_date))
+
+    report.duration = time.monotonic() - started_at
+
+    return report
@@ -41,6 +41,7 @@ INSTALLED_APPS = (
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'gdstorage',
     'rest_framework',
     'rest_framework.authtoken',
@@ -220,10 +221,58 @@ if 'GOOGLE_APPLICATION_CREDENTIALS2' in os.environ and not os.path.exists(GOOGLE
     with open(GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE2, 'w') as outfile:
         json.dump(json.loads(credentials), outfile)
 
+# 'google', or 'local' for a filesystem Drive storage and in-memory calendars (offline load tests, benchmarks)
+GOOGLE_SERVICES_BACKEND = os.environ.get('GOOGLE_SERVICES_BACKEND', 'google')
+LOCAL_DRIVE_ROOT = os.path.join(MEDIA_ROOT, 'local-drive')
+LOCAL_DRIVE_URL = MEDIA_URL + 'local-drive/'
+# seconds each request, or batch request, to the local calendar takes
+LOCAL_CALENDAR_LATENCY = float(os.environ.get('LOCAL_CALENDAR_LATENCY', 0))
+
+# medical prescription previews, rendered on upload and served by the app rather than Google Drive
+THUMBNAIL_ROOT = os.path.join(BASE_DIR, '../thumbnails')
+THUMBNAIL_URL = '/thumbnails/'
+THUMBNAIL_SIZE = 800
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
 INTERNAL_IPS = {'127.0.0.1', }
 
 IMPORTER_CSV_FOLDER = os.path.join(BASE_DIR, '../initialdata/')
 
+# 'redis' shares the cache between the web, worker and clock processes, the cached timesheet totals and calendar
+# months being invalidated by whichever process saves a change. 'local' keeps a cache per process: the tests use it,
+# the versions left in Redis by a previous run would match the rows of the new test database.
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'local' if 'test' in os.sys.argv else 'redis')
+CACHES = {
+    'default': {
+        'BACKEND': 'invoices.cache_backends.RedisCache',
+        'KEY_PREFIX': 'cache',
+    } if CACHE_BACKEND == 'redis' else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# seconds before a process reloads the care code tariffs changed by another process
+TARIFF_INDEX_TIMEOUT = int(os.environ.get('TARIFF_INDEX_TIMEOUT', 300))
+
+# seconds before a process reloads the at-home care code changed by another process
+AT_HOME_CARE_CODE_TIMEOUT = int(os.environ.get('AT_HOME_CARE_CODE_TIMEOUT', 300))
+
+# processes the batch job renders CNS invoice PDFs with, 1 renders in the current process. The admin exports
+# always render in the request.
+PDF_RENDER_PROCESSES = int(os.environ.get('PDF_RENDER_PROCESSES', 1))
+
+# PDFs printed from the invoice page, kept by content hash: 'local' (PDF_CACHE_ROOT), 'redis', or '' to disable
+PDF_CACHE_BACKEND = os.environ.get('PDF_CACHE_BACKEND', 'local')
+PDF_CACHE_ROOT = os.path.join(BASE_DIR, '../pdf-cache')
+PDF_CACHE_MAX_SIZE = int(os.environ.get('PDF_CACHE_MAX_SIZE', 256 * 1024 * 1024))
+
+# prescription scans embedded in the CNS invoices: downloaded by PRESCRIPTION_DOWNLOAD_THREADS threads, downscaled
+# to PRESCRIPTION_IMAGE_DPI and kept in PRESCRIPTION_IMAGE_CACHE_ROOT by Drive file id and modification time
+PRESCRIPTION_DOWNLOAD_THREADS = int(os.environ.get('PRESCRIPTION_DOWNLOAD_THREADS', 8))
+PRESCRIPTION_IMAGE_DPI = 150
+PRESCRIPTION_IMAGE_CACHE_ROOT = os.path.join(BASE_DIR, '../prescription-cache')
+PRESCRIPTION_IMAGE_CACHE_MAX_SIZE = int(os.environ.get('PRESCRIPTION_IMAGE_CACHE_MAX_SIZE', 512 * 1024 * 1024))
+
 CORS_ORIGIN_WHITELIST = [
     'http://localhost:4200',
 ]
@@ -0,0 +1,24 @@
+(function() {
+    function poll(element) {
+        var request = new XMLHttpRequest();
+        request.open('GET', element.getAttribute('data-url'));
+        request.onload = function() {
+            if (request.status !== 200) {
+                return;
+            }
+            var data = JSON.parse(request.responseText);
+            element.textContent = data.status;
+            if (!data.finished) {
+                setTimeout(function() { poll(element); }, 3000);
+            }
+        };
+        request.send();
+    }
+
+    document.addEventListener('DOMContentLoaded', function() {
+        var elements = document.querySelectorAll('.batch-pdf-status');
+        for (var i = 0; i < elements.length; i++) {
+            poll(elements[i]);
+        }
+    });
+})();
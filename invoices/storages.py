@@ -1,21 +1,58 @@
+import json
 import mimetypes
 import logging
 import mimetypes
 import ntpath
 import os
+import threading
 
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from gdstorage.storage import GoogleDriveStorage, GoogleDrivePermissionType, GoogleDrivePermissionRole \
-    , GoogleDriveFilePermission
+    , GoogleDriveFilePermission, _ANYONE_CAN_READ_PERMISSION_
 from apiclient import errors
 from googleapiclient.http import MediaIoBaseUpload
+from oauth2client.service_account import ServiceAccountCredentials
 from rq import Queue
 
+from invoices import google_clients
 from worker import conn
 
 logger = logging.getLogger(__name__)
 
 
-class CustomizedGoogleDriveStorage(GoogleDriveStorage):
+class LazyGoogleDriveStorage(GoogleDriveStorage):
+    """
+    GoogleDriveStorage which reads its key file and builds the drive service on first use rather than when the
+    models are imported. Credentials and service are shared by the process.
+    """
+    _SCOPES = ["https://www.googleapis.com/auth/drive"]
+
+    def __init__(self, json_keyfile_path=None, permissions=None):
+        self._json_keyfile_path = json_keyfile_path or settings.GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE
+        self._permissions = (_ANYONE_CAN_READ_PERMISSION_,) if permissions is None else permissions
+
+    def get_credentials(self):
+        if self._json_keyfile_path:
+            return ServiceAccountCredentials.from_json_keyfile_name(self._json_keyfile_path, scopes=self._SCOPES)
+        return ServiceAccountCredentials.from_json_keyfile_dict(
+            json.loads(os.environ['GOOGLE_DRIVE_STORAGE_JSON_KEY_FILE_CONTENTS']), scopes=self._SCOPES)
+
+    @property
+    def _drive_service(self):
+        credentials = google_clients.get_credentials(('drive', self._json_keyfile_path), self.get_credentials)
+        return google_clients.get_service('drive', 'v3', credentials)
+
+    def file_version(self, name):
+        """The Drive id and modification time of the file, None when it does not exist."""
+        file_data = self._check_file_exists(name)
+        if file_data is None:
+            return None
+
+        return file_data['id'], file_data.get('modifiedTime')
+
+
+class CustomizedGoogleDriveStorage(LazyGoogleDriveStorage):
     INVOICEITEM_BATCH_FOLDER = 'Invoice Item Batch'
     MEDICAL_PRESCRIPTION_FOLDER = 'Medical Prescription'
 
@@ -175,3 +212,87 @@ class CustomizedGoogleDriveStorage(GoogleDriveStorage):
         )
 
         return permission
+
+
+class LocalDriveStorage(FileSystemStorage):
+    """
+    Filesystem stand-in for CustomizedGoogleDriveStorage. File descriptions and folder permissions are kept in
+    json files at the root of the storage.
+    """
+    INVOICEITEM_BATCH_FOLDER = CustomizedGoogleDriveStorage.INVOICEITEM_BATCH_FOLDER
+    MEDICAL_PRESCRIPTION_FOLDER = CustomizedGoogleDriveStorage.MEDICAL_PRESCRIPTION_FOLDER
+    DESCRIPTIONS_FILE = '.descriptions.json'
+    PERMISSIONS_FILE = '.permissions.json'
+
+    def __init__(self, location=None, base_url=None):
+        super(LocalDriveStorage, self).__init__(location=location or settings.LOCAL_DRIVE_ROOT,
+                                                base_url=base_url or settings.LOCAL_DRIVE_URL)
+        self._lock = threading.Lock()
+
+    def save_file(self, path, content):
+        logger.info('saving file %s' % path)
+        return self._save(path, content)
+
+    def get_thumbnail_link(self, file_name):
+        if file_name and self.exists(file_name):
+            return self.url(file_name)
+        return ''
+
+    def update_file_description(self, path, description):
+        if self.exists(path):
+            with self._lock:
+                descriptions = self._read_json(self.DESCRIPTIONS_FILE)
+                descriptions[path] = description
+                self._write_json(self.DESCRIPTIONS_FILE, descriptions)
+
+    def get_file_description(self, path):
+        return self._read_json(self.DESCRIPTIONS_FILE).get(path)
+
+    def file_version(self, name):
+        if not self.exists(name):
+            return None
+
+        return name, self.get_modified_time(name).isoformat()
+
+    def update_folder_permissions(self, path, email, has_access):
+        with self._lock:
+            permissions = self._read_json(self.PERMISSIONS_FILE)
+            emails = set(permissions.get(path, []))
+            if has_access:
+                emails.add(email)
+            else:
+                emails.discard(email)
+            permissions[path] = sorted(emails)
+            self._write_json(self.PERMISSIONS_FILE, permissions)
+
+    update_folder_permissions_v3 = update_folder_permissions
+
+    def get_folder_permissions(self, path):
+        return self._read_json(self.PERMISSIONS_FILE).get(path, [])
+
+    def _read_json(self, name):
+        if not self.exists(name):
+            return {}
+        with open(self.path(name)) as f:
+            return json.load(f)
+
+    def _write_json(self, name, data):
+        os.makedirs(self.location, exist_ok=True)
+        with open(self.path(name), 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+
+class ThumbnailStorage(FileSystemStorage):
+    """Local storage of the generated previews, following THUMBNAIL_ROOT and THUMBNAIL_URL."""
+
+    @property
+    def base_location(self):
+        return settings.THUMBNAIL_ROOT
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+    @property
+    def base_url(self):
+        return settings.THUMBNAIL_URL
@@ -0,0 +1,69 @@
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+
+
+class TariffIndex:
+    """
+    Process wide index of the CareCode validity dates, sorted by start date per care code.
+
+    It is loaded with a single query on first use and dropped by the ValidityDate / CareCode signals.
+    Other processes (workers, other dynos) do not receive those signals, so the index is also reloaded
+    after TARIFF_INDEX_TIMEOUT seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._intervals = None
+        self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._intervals = None
+
+    def load(self):
+        self._get_intervals()
+
+    def _get_intervals(self):
+        timeout = settings.TARIFF_INDEX_TIMEOUT
+        intervals = self._intervals
+        if intervals is None or time.monotonic() - self._loaded_at > timeout:
+            with self._lock:
+                if self._intervals is None or time.monotonic() - self._loaded_at > timeout:
+                    self._intervals = self._load()
+                    self._loaded_at = time.monotonic()
+                intervals = self._intervals
+
+        return intervals
+
+    @staticmethod
+    def _load():
+        from invoices.models import ValidityDate
+
+        rows = defaultdict(list)
+        for care_code_id, start_date, end_date, gross_amount in ValidityDate.objects \
+                .order_by('care_code_id', 'start_date', 'id') \
+                .values_list('care_code_id', 'start_date', 'end_date', 'gross_amount'):
+            rows[care_code_id].append((start_date, end_date, gross_amount))
+
+        return {care_code_id: ([r[0] for r in care_code_rows], care_code_rows)
+                for care_code_id, care_code_rows in rows.items()}
+
+    def gross_amount(self, care_code_id, date):
+        if isinstance(date, datetime):
+            date = date.date()
+        starts, rows = self._get_intervals().get(care_code_id, ((), ()))
+        # rows before position are the validity dates already started at that date
+        for position in range(bisect_right(starts, date) - 1, -1, -1):
+            start_date, end_date, gross_amount = rows[position]
+            if end_date is None or date <= end_date:
+                return gross_amount
+
+        return 0
+
+
+tariff_index = TariffIndex()
@@ -1,5 +1,9 @@
+from datetime import date, datetime
+from decimal import Decimal
+
 from django.test import TestCase
-from invoices.models import CareCode
+from invoices.models import CareCode, ValidityDate
+from invoices.tariffs import tariff_index
 
 
 class CareCodeTestCase(TestCase):
@@ -13,3 +17,49 @@ class CareCodeTestCase(TestCase):
 
     def test_autocomplete(self):
         self.assertEqual(CareCode.autocomplete_search_fields(), ('name', 'code'))
+
+
+class CareCodeAmountTestCase(TestCase):
+    def setUp(self):
+        self.carecode = CareCode.objects.create(code='code',
+                                                name='some name',
+                                                description='description',
+                                                reimbursed=True)
+        ValidityDate.objects.create(start_date=date(2019, 1, 1),
+                                    end_date=date(2019, 12, 31),
+                                    gross_amount=10,
+                                    care_code=self.carecode)
+        ValidityDate.objects.create(start_date=date(2020, 1, 1),
+                                    gross_amount=20,
+                                    care_code=self.carecode)
+
+    def test_gross_amount(self):
+        self.assertEqual(self.carecode.gross_amount(datetime(2018, 12, 31, 10, 0)), 0)
+        self.assertEqual(self.carecode.gross_amount(datetime(2019, 1, 1, 10, 0)), 10)
+        self.assertEqual(self.carecode.gross_amount(datetime(2019, 12, 31, 10, 0)), 10)
+        self.assertEqual(self.carecode.gross_amount(datetime(2020, 6, 1, 10, 0)), 20)
+        self.assertEqual(self.carecode.current_gross_amount, 20)
+
+    def test_net_amount(self):
+        day = datetime(2019, 6, 1, 10, 0)
+        self.assertEqual(self.carecode.net_amount(day, False, False), Decimal('10.00'))
+        self.assertEqual(self.carecode.net_amount(day, False, True), Decimal('8.80'))
+        self.assertEqual(self.carecode.net_amount(day, True, False), 0)
+
+    def test_amounts_are_looked_up_once(self):
+        tariff_index.invalidate()
+        with self.assertNumQueries(1):
+            for month in range(1, 13):
+                self.carecode.gross_amount(datetime(2019, month, 1))
+                self.carecode.net_amount(datetime(2020, month, 1), False, False)
+
+    def test_validity_date_changes_invalidate_amounts(self):
+        self.assertEqual(self.carecode.gross_amount(datetime(2021, 1, 1)), 20)
+        validity_date = ValidityDate.objects.create(start_date=date(2021, 1, 1),
+                                                    gross_amount=30,
+                                                    care_code=self.carecode)
+        ValidityDate.objects.filter(start_date=date(2020, 1, 1)).update(end_date=date(2020, 12, 31))
+        self.assertEqual(self.carecode.gross_amount(datetime(2021, 1, 1)), 30)
+
+        validity_date.delete()
+        self.assertEqual(self.carecode.gross_amount(datetime(2021, 1, 1)), 0)
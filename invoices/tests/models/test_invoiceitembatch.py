@@ -1,12 +1,20 @@
+import shutil
+import tempfile
 from datetime import datetime
+from unittest import mock
 
 from django.utils import timezone
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.test import override_settings
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
 
+from invoices.managers import InvoiceItemBatchManager
 from invoices.models import CareCode, Patient, Prestation, InvoiceItem, InvoiceItemBatch
 from invoices.employee import Employee, JobPosition
+from invoices.storages import LocalDriveStorage
 
 
 class InvoiceItemBatchTestCase(TestCase):
@@ -69,6 +77,44 @@ class InvoiceItemBatchTestCase(TestCase):
         data['start_date'] = data['start_date'].replace(month=6, day=11)
         self.assertEqual(InvoiceItemBatch.validate_dates(data), {'end_date': 'End date must be bigger than Start date'})
 
+    def test_update_associated_invoiceitems(self):
+        date = datetime.now()
+        batch = InvoiceItemBatch.objects.create(start_date=date.replace(month=12, day=1),
+                                                end_date=date.replace(month=12, day=31))
+
+        association = InvoiceItemBatchManager.update_associated_invoiceitems(batch)
+        self.assertEqual(sorted(association.associated_ids), sorted(item.id for item in self.december_invoices))
+        self.assertEqual(association.disassociated_ids, [])
+        self.assertEqual(batch.invoice_items.count(), 3)
+
+        # boundary dates stay in the batch, a rerun only runs the two selects
+        with CaptureQueriesContext(connection) as queries:
+            association = InvoiceItemBatchManager.update_associated_invoiceitems(batch)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 2)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual((association.associated_count, association.disassociated_count), (0, 0))
+
+        batch.end_date = date.replace(month=12, day=25)
+        association = InvoiceItemBatchManager.update_associated_invoiceitems(batch)
+        self.assertEqual(association.disassociated_ids, [self.december_invoices[2].id])
+        self.assertEqual(batch.invoice_items.count(), 2)
+
+    def test_delete(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = LocalDriveStorage(location=location)
+        date = datetime.now()
+        with mock.patch.object(InvoiceItemBatch._meta.get_field('file'), 'storage', storage):
+            batch = InvoiceItemBatch.objects.create(start_date=date.replace(month=12, day=1),
+                                                    end_date=date.replace(month=12, day=31))
+            InvoiceItemBatchManager.update_associated_invoiceitems(batch)
+            batch.file.name = storage.save('batch.pdf', ContentFile(b'%PDF'))
+
+            batch.delete()
+        self.assertFalse(InvoiceItemBatch.objects.filter(pk=batch.pk).exists())
+        self.assertFalse(storage.exists('batch.pdf'))
+        self.assertEqual(InvoiceItem.objects.count(), 7)
+
     # def test_associated_items(self):
     #     date = datetime.now()
     #     date.replace(hour=0, minute=0)
@@ -1,10 +1,20 @@
 import os
-
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from invoices.models import Physician, MedicalPrescription, Patient, update_medical_prescription_filename
+from invoices.models import Physician, MedicalPrescription, Patient, update_medical_prescription_filename, gd_storage
 from invoices.storages import CustomizedGoogleDriveStorage
+from invoices.thumbnails import thumbnail_storage
 
 
 class MedicalPrescriptionTestCase(TestCase):
@@ -67,3 +77,60 @@ class UpdateMedicalPrescriptionFilenameTestCase(TestCase):
 
         generated_name = update_medical_prescription_filename(prescription, filename)
         self.assertEqual(generated_name, expected_name)
+
+
+class MedicalPrescriptionThumbnailTestCase(TestCase):
+    def setUp(self):
+        thumbnail_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, thumbnail_root)
+        settings_override = override_settings(THUMBNAIL_ROOT=thumbnail_root, THUMBNAIL_SIZE=100)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        for name, side_effect in (('_save', lambda name, content: name), ('exists', lambda name: False),
+                                  ('update_file_description', None),
+                                  ('delete', None), ('get_thumbnail_link', AssertionError('Drive call'))):
+            patcher = mock.patch.object(gd_storage, name, side_effect=side_effect)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.patient = Patient.objects.create(code_sn='1950010112345', first_name='first name', name='name',
+                                              address='address', zipcode='zipcode', city='city',
+                                              phone_number='000')
+        self.physician = Physician.objects.create(first_name='first name', name='name')
+
+    @staticmethod
+    def scan(color='white'):
+        output = BytesIO()
+        Image.new('RGB', (1000, 500), color).save(output, 'PNG')
+        return SimpleUploadedFile('scan.png', output.getvalue(), content_type='image/png')
+
+    def test_thumbnail_generated_on_upload(self):
+        prescription = MedicalPrescription.objects.create(prescriptor=self.physician, patient=self.patient,
+                                                          date=timezone.now().date(), file=self.scan())
+
+        self.assertTrue(prescription.thumbnail.name.startswith('medical-prescription/'))
+        with Image.open(thumbnail_storage.path(prescription.thumbnail.name)) as thumbnail:
+            self.assertEqual(thumbnail.size, (100, 50))
+        self.assertIn(prescription.thumbnail.url, prescription.image_preview())
+
+        origin_thumbnail = prescription.thumbnail.name
+        prescription.file = self.scan('black')
+        prescription.save()
+        self.assertNotEqual(prescription.thumbnail.name, origin_thumbnail)
+        self.assertFalse(thumbnail_storage.exists(origin_thumbnail))
+
+    def test_serve_thumbnail(self):
+        prescription = MedicalPrescription.objects.create(prescriptor=self.physician, patient=self.patient,
+                                                          date=timezone.now().date(), file=self.scan())
+        User.objects.create_superuser('admin', 'admin@test.com', 'password')
+        self.client.login(username='admin', password='password')
+
+        response = self.client.get(prescription.thumbnail.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=%s' % settings.THUMBNAIL_MAX_AGE, response['Cache-Control'])
+
+        # the thumbnails folder is lost with the dyno, the preview is rendered again from the scan
+        thumbnail_storage.delete(prescription.thumbnail.name)
+        with mock.patch.object(gd_storage, 'open', return_value=ContentFile(self.scan().read())):
+            response = self.client.get(prescription.thumbnail.url)
+        self.assertEqual(response.status_code, 200)
@@ -5,6 +5,7 @@ from django.contrib.auth.models import User
 from constance import config
 from invoices.models import CareCode, Patient, Prestation, InvoiceItem, Hospitalization
 from invoices.employee import Employee, JobPosition
+from invoices.validators.prestations import validate_prestations
 
 
 class PrestationTestCase(TestCase):
@@ -72,6 +73,35 @@ class PrestationTestCase(TestCase):
         data['date'] = data['date'].replace(month=5, day=1)
         self.assertEqual(Prestation.validate_carecode(None, data), {})
 
+    def test_validate_prestations(self):
+        # seeded by the data migrations
+        CareCode.objects.get_or_create(code=config.AT_HOME_CARE_CODE,
+                                       defaults={'name': 'at home', 'description': 'at home'})
+        other_patient = Patient.objects.create(first_name='other first name', name='other name',
+                                               date_of_death=self.date.date())
+        other_invoice_item = InvoiceItem.objects.create(invoice_number='937', invoice_date=self.date,
+                                                        patient=other_patient)
+        rows = [
+            (None, {'invoice_item': self.invoice_item, 'carecode': self.care_code_first, 'date': self.date,
+                    'employee': self.employee}),
+            (self.existing_prestation.id, {'id': self.existing_prestation.id, 'invoice_item_id': self.invoice_item.id,
+                                           'carecode_id': self.care_code_third.id, 'date': self.date,
+                                           'employee_id': self.employee.id}),
+            (None, {'invoice_item_id': self.invoice_item.id, 'carecode': self.care_code_second,
+                    'date': self.hospitalization.start_date, 'at_home': True, 'employee_id': None}),
+            (None, {'invoice_item': other_invoice_item, 'carecode': self.care_code_first, 'date': self.date,
+                    'employee': self.employee}),
+        ]
+
+        with self.assertNumQueries(9):
+            results = validate_prestations(rows)
+
+        self.assertEqual(results, [Prestation.validate(instance_id, dict(data)) for instance_id, data in rows])
+        self.assertEqual(set(results[0]), {'carecode'})
+        self.assertEqual(results[1], {})
+        self.assertEqual(set(results[2]), {'date', 'employee'})
+        self.assertEqual(set(results[3]), {'date'})
+
     def test_string_representation(self):
         carecode = CareCode(code='code',
                             name='some name',
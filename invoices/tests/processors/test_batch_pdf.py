@@ -0,0 +1,89 @@
+import shutil
+import tempfile
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from invoices.employee import Employee, JobPosition
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem, InvoiceItemBatch, ValidityDate
+from invoices.processors.batch_pdf import generate_batch_pdf
+from invoices.storages import LocalDriveStorage
+
+
+class BatchPdfTestCase(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = LocalDriveStorage(location=location)
+        storage = mock.patch.object(InvoiceItemBatch._meta.get_field('file'), 'storage', self.storage)
+        storage.start()
+        self.addCleanup(storage.stop)
+        self.date = timezone.now().replace(year=2020, month=12, day=10, hour=10, minute=0)
+        jobposition = JobPosition.objects.create(name='name 0')
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        employee = Employee.objects.create(user=user,
+                                           start_contract=self.date,
+                                           occupation=jobposition,
+                                           provider_code='300000-00')
+        patient = Patient.objects.create(code_sn='1950010112345',
+                                         first_name='first name',
+                                         name='name',
+                                         address='address',
+                                         zipcode='zipcode',
+                                         city='city',
+                                         phone_number='000')
+        care_code = CareCode.objects.create(code='code0',
+                                            name='some name',
+                                            description='description',
+                                            reimbursed=True)
+        ValidityDate.objects.create(start_date=date(2020, 1, 1),
+                                    gross_amount=10.5,
+                                    care_code=care_code)
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1',
+                                                       invoice_date=self.date.date(),
+                                                       patient=patient)
+        Prestation.objects.create(invoice_item=self.invoice_item,
+                                  employee=employee,
+                                  carecode=care_code,
+                                  date=self.date)
+        self.batch = InvoiceItemBatch.objects.create(start_date=date(2020, 12, 1),
+                                                     end_date=date(2020, 12, 31))
+
+    def test_creation_schedules_generation(self):
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.pdf_state, InvoiceItemBatch.PDF_PENDING)
+
+    def test_generate_batch_pdf(self):
+        name = self.batch.file.name
+        generate_batch_pdf(self.batch.id)
+
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.pdf_state, InvoiceItemBatch.PDF_DONE)
+        self.assertEqual(self.batch.pdf_progress, 1)
+        self.assertEqual(self.batch.pdf_total, 1)
+        self.assertEqual(self.batch.invoice_items.get(), self.invoice_item)
+        self.assertEqual(self.batch.file.name, name)
+        with self.storage.open(name) as content:
+            self.assertTrue(content.read().startswith(b'%PDF'))
+
+        # a new rendering replaces the file
+        generate_batch_pdf(self.batch.id)
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.file.name, name)
+        self.assertEqual(self.storage.listdir('')[1], [name])
+
+        self.batch.delete()
+        self.assertFalse(self.storage.exists(name))
+
+    @mock.patch('invoices.processors.batch_pdf.InvoiceItemBatchPdf.get_inmemory_pdf',
+                side_effect=ValueError('broken invoice'))
+    def test_generate_batch_pdf_failure(self, get_inmemory_pdf):
+        with self.assertRaises(ValueError):
+            generate_batch_pdf(self.batch.id)
+
+        self.batch.refresh_from_db()
+        self.assertEqual(self.batch.pdf_state, InvoiceItemBatch.PDF_FAILED)
+        self.assertEqual(self.batch.pdf_status, 'Failed: broken invoice')
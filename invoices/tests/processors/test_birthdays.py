@@ -1,8 +1,15 @@
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command, CommandError
 from django.test import TestCase
 from django.utils import timezone
 
+from invoices.events import Event, EventType
 from invoices.models import Patient
-from invoices.processors.birthdays import list_patients_with_birth_date_in_range_still_alive, process_and_generate
+from invoices.processors.birthdays import list_patients_with_birth_date_in_range_still_alive, process_and_generate, \
+    birthday_events
+from invoices.processors.generated_events import generate_events
 
 
 class BirthdayTestCase(TestCase):
@@ -105,6 +112,42 @@ class BirthdayTestCase(TestCase):
         patients = list_patients_with_birth_date_in_range_still_alive(start, end)
         self.assertEqual(len(patients), 2)
 
+    def test_birth_date_follows_code_sn(self):
+        patient = Patient.objects.create(code_sn='1977030661534',
+                                         first_name='first name',
+                                         name='name 0',
+                                         address='address 0',
+                                         zipcode='zipcode 0',
+                                         city='city 0',
+                                         phone_number='000')
+        self.assertEqual((date(1977, 3, 6), 306), (patient.birth_date, patient.birth_month_day))
+
+        patient.code_sn = '1977123161534'
+        patient.save(update_fields=['code_sn'])
+        patient.refresh_from_db()
+        self.assertEqual((date(1977, 12, 31), 1231), (patient.birth_date, patient.birth_month_day))
+
+        Patient.objects.filter(pk=patient.pk).update(code_sn='1977023061534')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_birth_dates', '--verify', stdout=StringIO())
+        call_command('rebuild_birth_dates', stdout=StringIO())
+        patient.refresh_from_db()
+        self.assertEqual((None, None), (patient.birth_date, patient.birth_month_day))
+
+    def test_list_patients_born_on_29th_of_february(self):
+        Patient.objects.create(code_sn='1980022961534',
+                               first_name='first name',
+                               name='name 0',
+                               address='address 0',
+                               zipcode='zipcode 0',
+                               city='city 0',
+                               phone_number='000')
+
+        self.assertEqual(0, len(list_patients_with_birth_date_in_range_still_alive(date(2021, 2, 20),
+                                                                                     date(2021, 3, 10))))
+        self.assertEqual(1, len(list_patients_with_birth_date_in_range_still_alive(date(2023, 12, 20),
+                                                                                     date(2024, 3, 10))))
+
     def test_process_and_generate(self):
         built_code_sn = '1977' + str(timezone.now().month).zfill(2) + str(timezone.now().day).zfill(2) + '61534'
         Patient.objects.create(code_sn=built_code_sn,
@@ -117,5 +160,29 @@ class BirthdayTestCase(TestCase):
 
         result = process_and_generate(30)
         self.assertEqual(len(result), 1)
-
-
+        self.assertEqual(1, Event.objects.count())
+        self.assertEqual(process_and_generate(30)[0].id, result[0].id)
+        self.assertEqual(1, Event.objects.count())
+
+    def test_generate_events_across_years(self):
+        for i, code_sn in enumerate(['1977122561534', '1980122561534', '1977010461534', '1977012061534']):
+            Patient.objects.create(code_sn=code_sn,
+                                   first_name='first name %d' % i,
+                                   name='name 0',
+                                   address='address 0',
+                                   zipcode='zipcode 0',
+                                   city='city 0',
+                                   phone_number='000')
+        event_type = EventType.objects.create(name='Birthdays', to_be_generated=True)
+        start, end = date(2020, 12, 20), date(2021, 1, 19)
+
+        # the patients, the existing events and a single insert, within a savepoint
+        with self.assertNumQueries(5):
+            created, skipped = generate_events(event_type, birthday_events(event_type, start, end), start, end)
+        self.assertEqual([date(2020, 12, 25), date(2020, 12, 25), date(2021, 1, 4)],
+                         sorted(event.day for event in created))
+        self.assertEqual([], skipped)
+        self.assertIn('will turn 44', Event.objects.get(day=date(2021, 1, 4)).notes)
+
+        created, skipped = generate_events(event_type, birthday_events(event_type, start, end), start, end)
+        self.assertEqual(([], 3), (created, len(skipped)))
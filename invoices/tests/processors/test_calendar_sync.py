@@ -0,0 +1,218 @@
+from datetime import date, time, timedelta
+from unittest import mock
+
+from constance.test import override_config
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from invoices.calendar_outbox import CalendarOutboxEntry, schedule_calendar_sync
+from invoices.employee import Employee, JobPosition
+from invoices.events import Event, EventType
+from invoices.gcalendar import PrestationGoogleCalendar
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem
+from invoices.processors.calendar_sync import drain_calendar_outbox
+
+
+class FakeBatch:
+    def __init__(self, callback, responses):
+        self.callback = callback
+        self.responses = responses
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, request in self.requests:
+            self.callback(request_id, None, self.responses(request))
+
+
+class CalendarSyncTestCase(TestCase):
+    def setUp(self):
+        self.date = timezone.now() + timedelta(days=1)
+        jobposition = JobPosition.objects.create(name='name 0')
+        self.users = [User.objects.create_user('testuser%s' % i, email='testuser%s@test.com' % i,
+                                               password='testing') for i in range(3)]
+        self.employees = [Employee.objects.create(user=user,
+                                                  start_contract=self.date,
+                                                  occupation=jobposition,
+                                                  provider_code='300000-0%s' % i)
+                          for i, user in enumerate(self.users)]
+        self.patient = Patient.objects.create(code_sn='1950010112345',
+                                              first_name='first name',
+                                              name='name',
+                                              address='address',
+                                              zipcode='zipcode',
+                                              city='city',
+                                              phone_number='000')
+        self.care_code = CareCode.objects.create(code='code0',
+                                                 name='some name',
+                                                 description='description',
+                                                 reimbursed=True)
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1',
+                                                       invoice_date=self.date.date(),
+                                                       patient=self.patient)
+        # after the employees, whose permissions would be granted on Google
+        sync = override_config(USE_GDRIVE=True)
+        sync.enable()
+        self.addCleanup(sync.disable)
+
+    def create_prestation(self):
+        return Prestation.objects.create(invoice_item=self.invoice_item,
+                                         employee=self.employees[0],
+                                         carecode=self.care_code,
+                                         date=self.date)
+
+    def create_event(self):
+        return Event.objects.create(day=date(2020, 12, 10),
+                                    time_start_event=time(10, 0),
+                                    time_end_event=time(10, 30),
+                                    state=1,
+                                    event_type=EventType.objects.create(name='soin'),
+                                    employees=self.employees[0],
+                                    patient=self.patient,
+                                    notes='')
+
+    def test_prestation_changes_are_coalesced(self):
+        prestation = self.create_prestation()
+        prestation.save()
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual((entry.object_type, entry.object_id, entry.action),
+                         (CalendarOutboxEntry.PRESTATION, prestation.id, CalendarOutboxEntry.UPDATE))
+
+        prestation_id = prestation.id
+        prestation.delete()
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual((entry.object_id, entry.action), (prestation_id, CalendarOutboxEntry.DELETE))
+
+    def test_event_employee_change_keeps_previous_calendar(self):
+        event = self.create_event()
+        event.employees = self.employees[1]
+        event.save()
+        event.notes = 'notes'
+        event.save()
+
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual(entry.calendar_id, 'testuser1@test.com')
+        self.assertEqual(entry.previous_calendar_id, 'testuser0@test.com')
+
+    def test_event_employee_changes_keep_the_first_previous_calendar(self):
+        event = self.create_event()
+        for employee in self.employees[1:]:
+            event.employees = employee
+            event.save()
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual((entry.calendar_id, entry.previous_calendar_id), ('testuser2@test.com', 'testuser0@test.com'))
+
+        event.employees = self.employees[0]
+        event.save()
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual((entry.calendar_id, entry.previous_calendar_id), ('testuser0@test.com', ''))
+
+    @mock.patch('invoices.processors.calendar_sync.enqueue_calendar_sync')
+    @mock.patch('invoices.calendar_outbox.transaction.on_commit')
+    def test_sync_is_scheduled_once_per_transaction(self, on_commit, enqueue_calendar_sync):
+        with transaction.atomic():
+            schedule_calendar_sync()
+            schedule_calendar_sync()
+        self.assertEqual(on_commit.call_count, 1)
+
+        on_commit.call_args[0][0]()
+        enqueue_calendar_sync.assert_called_once_with()
+        schedule_calendar_sync()
+        self.assertEqual(on_commit.call_count, 2)
+
+        # the registration rolled back with its savepoint
+        on_commit.call_args[0][0]()
+        on_commit.reset_mock()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    schedule_calendar_sync()
+                    raise ValueError
+            except ValueError:
+                pass
+            schedule_calendar_sync()
+        self.assertEqual(on_commit.call_count, 2)
+
+    @mock.patch('invoices.models.prestation_gcalendar.delete_events', return_value={})
+    @mock.patch('invoices.models.prestation_gcalendar.update_events')
+    def test_drain_sends_prestations_in_one_batch(self, update_events, delete_events):
+        prestations = [self.create_prestation() for i in range(3)]
+        deleted_id = prestations[2].id
+        prestations[2].delete()
+        update_events.return_value = {prestations[1].id: ValueError('quota')}
+
+        self.assertEqual(drain_calendar_outbox(), (2, 1))
+
+        self.assertEqual(update_events.call_count, 1)
+        self.assertEqual(sorted(p.id for p in update_events.call_args[0][0]), [prestations[0].id, prestations[1].id])
+        delete_events.assert_called_once_with([deleted_id])
+        entry = CalendarOutboxEntry.objects.get()
+        self.assertEqual((entry.object_id, entry.attempts, entry.last_error), (prestations[1].id, 1, 'quota'))
+
+    @mock.patch('invoices.models.prestation_gcalendar.update_events', return_value={})
+    def test_drain_keeps_entries_changed_meanwhile(self, update_events):
+        prestation = self.create_prestation()
+
+        def save_again(prestations):
+            prestation.save()
+            return {}
+
+        update_events.side_effect = save_again
+        self.assertEqual(drain_calendar_outbox(), (1, 0))
+        self.assertTrue(CalendarOutboxEntry.objects.filter(object_id=prestation.id).exists())
+
+    @mock.patch('invoices.models.prestation_gcalendar.update_events')
+    def test_drain_skips_claimed_entries(self, update_events):
+        prestation = self.create_prestation()
+
+        def drain_again(prestations):
+            self.assertEqual(drain_calendar_outbox(), (0, 0))
+            return {prestation.id: ValueError('quota')}
+
+        update_events.side_effect = drain_again
+        self.assertEqual(drain_calendar_outbox(), (0, 1))
+        self.assertEqual(update_events.call_count, 1)
+        self.assertIsNone(CalendarOutboxEntry.objects.get().claimed_until)
+
+    @mock.patch.object(PrestationGoogleCalendar, '_service', new_callable=mock.PropertyMock)
+    def test_update_events_inserts_missing_events(self, service_property):
+        calendar = PrestationGoogleCalendar()
+        calendar._calendar = {'id': 'calendar'}
+        service_property.return_value = service = mock.MagicMock()
+        not_found = HttpError(mock.Mock(status=404, reason='Not Found'), b'')
+        service.events.return_value.update.side_effect = lambda **kwargs: ('update', kwargs['eventId'])
+        service.events.return_value.insert.side_effect = lambda **kwargs: ('insert', kwargs['body']['id'])
+        prestations = [self.create_prestation() for i in range(60)]
+        missing_event_id = calendar._get_event_id(prestations[0].id)
+        batches = []
+
+        def new_batch(callback):
+            batches.append(FakeBatch(callback,
+                                     lambda request: not_found if request == ('update', missing_event_id) else None))
+            return batches[-1]
+
+        service.new_batch_http_request.side_effect = new_batch
+
+        self.assertEqual(calendar.update_events(prestations), {})
+        self.assertEqual([len(batch.requests) for batch in batches], [50, 10, 1])
+        self.assertEqual(batches[-1].requests[0][1], ('insert', missing_event_id))
+
+
+class CalendarSyncSchedulingTestCase(TransactionTestCase):
+    @mock.patch('invoices.processors.calendar_sync.enqueue_calendar_sync')
+    def test_sync_is_scheduled_after_a_rollback(self, enqueue_calendar_sync):
+        try:
+            with transaction.atomic():
+                schedule_calendar_sync()
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic():
+            schedule_calendar_sync()
+
+        enqueue_calendar_sync.assert_called_once_with()
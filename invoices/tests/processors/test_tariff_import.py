@@ -0,0 +1,94 @@
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from invoices.models import CareCode, ValidityDate
+from invoices.processors.tariff_import import parse_cns_csv, import_cns_tariffs, TariffImportError
+
+CSV = """Section 1 - Prélèvements et analyses
+Prélèvement pour analyse microbiologique;T101;2,55;15,61
+Prélèvement de selles pour analyses;T103;2.55;16.28
+
+Section 2 - Injections, perfusions, prises de sang
+Injection par dispositif implanté;T201;3.07;19.61
+"""
+# codes the data migrations do not seed
+CODES = ('T101', 'T103', 'T201')
+
+
+class TariffImportTestCase(TestCase):
+    def setUp(self):
+        self.care_code = CareCode.objects.create(code='T101', name='old name', description='old description')
+        self.validity_date = ValidityDate.objects.create(care_code=self.care_code, start_date=date(2019, 1, 1),
+                                                         gross_amount=Decimal('15.00'))
+
+    def test_parse(self):
+        rows = list(parse_cns_csv(StringIO(CSV)))
+
+        self.assertEqual([row.code for row in rows], ['T101', 'T103', 'T201'])
+        self.assertEqual(rows[0].gross_amount, Decimal('15.61'))
+        self.assertEqual(rows[0].description, 'Prélèvement pour analyse microbiologique')
+        with self.assertRaises(TariffImportError):
+            list(parse_cns_csv(StringIO('Prélèvement;T101;2,55;abc\n')))
+
+    def test_dry_run(self):
+        report = import_cns_tariffs(parse_cns_csv(StringIO(CSV)), date(2020, 1, 1), dry_run=True, rename=True)
+
+        self.assertEqual(report.created_codes, ['T103', 'T201'])
+        self.assertEqual(report.updated_codes, ['T101'])
+        self.assertEqual(len(report.closed_validities), 1)
+        self.assertEqual(len(report.created_validities), 3)
+        self.assertEqual(CareCode.objects.filter(code__in=CODES).count(), 1)
+        self.assertEqual(ValidityDate.objects.get(care_code__code__in=CODES).end_date, None)
+
+    def test_import(self):
+        with self.assertNumQueries(8):
+            import_cns_tariffs(parse_cns_csv(StringIO(CSV)), date(2020, 1, 1))
+
+        self.care_code.refresh_from_db()
+        self.assertEqual((self.care_code.name, self.care_code.description), ('old name', 'old description'))
+        self.assertEqual(CareCode.objects.get(code='T201').name, 'Injection par dispositif implanté')
+        self.validity_date.refresh_from_db()
+        self.assertEqual(self.validity_date.end_date, date(2019, 12, 31))
+        self.assertEqual(self.care_code.gross_amount(date(2019, 12, 31)), Decimal('15.00'))
+        self.assertEqual(self.care_code.gross_amount(date(2020, 1, 1)), Decimal('15.61'))
+        self.assertEqual(CareCode.objects.get(code='T201').gross_amount(date(2020, 6, 1)), Decimal('19.61'))
+
+        report = import_cns_tariffs(parse_cns_csv(StringIO(CSV)), date(2020, 1, 1))
+        self.assertEqual(len(report.unchanged), 3)
+        self.assertEqual(ValidityDate.objects.filter(care_code__code__in=CODES).count(), 4)
+
+    def test_import_renaming(self):
+        report = import_cns_tariffs(parse_cns_csv(StringIO(CSV)), date(2020, 1, 1), rename=True)
+
+        self.assertEqual(report.updated_codes, ['T101'])
+        self.care_code.refresh_from_db()
+        self.assertEqual(self.care_code.name, 'Prélèvement pour analyse microbiologique')
+
+    def test_import_before_planned_tariff(self):
+        ValidityDate.objects.create(care_code=self.care_code, start_date=date(2021, 1, 1),
+                                    gross_amount=Decimal('17.00'))
+        self.validity_date.end_date = date(2020, 12, 31)
+        self.validity_date.save()
+
+        import_cns_tariffs(parse_cns_csv(StringIO(CSV)), date(2020, 1, 1))
+
+        self.assertEqual(list(self.care_code.validity_dates.order_by('start_date')
+                              .values_list('start_date', 'end_date', 'gross_amount')),
+                         [(date(2019, 1, 1), date(2019, 12, 31), Decimal('15.00')),
+                          (date(2020, 1, 1), date(2020, 12, 31), Decimal('15.61')),
+                          (date(2021, 1, 1), None, Decimal('17.00'))])
+
+    def test_command_imports_initialdata(self):
+        out = StringIO()
+        call_command('import_cns_tariffs', '2019cns_codes.csv', start_date='2019-01-01', stdout=out)
+        call_command('import_cns_tariffs', '2019_may_cns_codes.csv', start_date='2019-05-01', stdout=out)
+        call_command('import_cns_tariffs', '2020_january_cns_codes.csv', start_date='2020-01-01', stdout=out)
+
+        care_code = CareCode.objects.get(code='N205')
+        self.assertEqual(care_code.gross_amount(date(2019, 3, 1)), Decimal('32.27'))
+        self.assertEqual(care_code.gross_amount(date(2019, 6, 1)), Decimal('32.83'))
+        self.assertEqual(care_code.gross_amount(date(2020, 6, 1)), Decimal('33.65'))
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from constance import config
+from constance.test import override_config
+from invoices.at_home import pair_at_home_prestations, at_home_care_code
+from invoices.calendar_outbox import CalendarOutboxEntry
+from invoices.employee import Employee, JobPosition
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem
+from invoices.tariffs import tariff_index
+
+
+class PairAtHomePrestationsTestCase(TestCase):
+    def setUp(self):
+        self.date = timezone.now().replace(month=6, day=10, hour=10, minute=0, second=0, microsecond=0)
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.employee = Employee.objects.create(user=user,
+                                                start_contract=self.date,
+                                                occupation=JobPosition.objects.create(name='name 0'))
+        patient = Patient.objects.create(first_name='first name', name='name')
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1', invoice_date=self.date, patient=patient)
+        self.care_code = CareCode.objects.create(code='code0', name='some name', description='description')
+        # the codes seeded by the data migrations have tariffs
+        at_home = override_config(AT_HOME_CARE_CODE='at_home')
+        at_home.enable()
+        self.addCleanup(at_home.disable)
+        self.at_home_care_code = CareCode.objects.create(code=config.AT_HOME_CARE_CODE, name='at home',
+                                                         description='at home')
+
+    def create_prestations(self, days):
+        return Prestation.objects.bulk_create([Prestation(invoice_item=self.invoice_item,
+                                                          employee=self.employee,
+                                                          carecode=self.care_code,
+                                                          date=self.date.replace(day=day),
+                                                          at_home=True) for day in days])
+
+    def test_save_creates_pair(self):
+        prestation = Prestation.objects.create(invoice_item=self.invoice_item, employee=self.employee,
+                                               carecode=self.care_code, date=self.date, at_home=True)
+
+        pair = prestation.paired_at_home
+        self.assertEqual((pair.carecode, pair.date, pair.at_home), (self.at_home_care_code, self.date, False))
+
+        prestation.save()
+        self.assertEqual(Prestation.objects.filter(carecode=self.at_home_care_code).count(), 1)
+
+    def test_pair_many(self):
+        prestations = self.create_prestations(range(1, 11))
+        at_home_care_code.get()
+        tariff_index.load()
+
+        # existing pairs, insert, invoice totals (prestations, invoice items), USE_GDRIVE
+        with self.assertNumQueries(5):
+            pairs = pair_at_home_prestations(prestations)
+
+        self.assertEqual(len(pairs), 10)
+        self.assertEqual(set(pair.at_home_paired_id for pair in pairs), set(p.id for p in prestations))
+        with self.assertNumQueries(1):
+            self.assertEqual(pair_at_home_prestations(prestations), [])
+
+    def test_existing_pairs_are_kept(self):
+        prestations = self.create_prestations([1, 2])
+        Prestation.objects.create(invoice_item=self.invoice_item, employee=self.employee,
+                                  carecode=self.at_home_care_code, date=prestations[0].date)
+
+        pairs = pair_at_home_prestations(prestations)
+
+        self.assertEqual([pair.at_home_paired for pair in pairs], [prestations[1]])
+
+    def test_calendar_entries_of_pairs(self):
+        prestations = self.create_prestations([1, 2])
+        with override_config(USE_GDRIVE=True):
+            pairs = pair_at_home_prestations(prestations)
+
+        self.assertEqual(set(CalendarOutboxEntry.objects.values_list('object_id', flat=True)),
+                         set(pair.id for pair in pairs))
+
+    def test_care_code_is_reloaded_when_changed(self):
+        self.assertEqual(at_home_care_code.get(), self.at_home_care_code)
+
+        other_care_code = CareCode.objects.create(code='code1', name='at home', description='at home')
+        with override_config(AT_HOME_CARE_CODE='code1'):
+            self.assertEqual(at_home_care_code.get(), other_care_code)
@@ -0,0 +1,66 @@
+from datetime import date, time
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from invoices.employee import Employee, JobPosition
+from invoices.events import Event, EventType
+from invoices.models import Patient
+from invoices.utils import EventCalendar
+
+
+class EventCalendarTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing',
+                                        first_name='Jane')
+        self.employee = Employee.objects.create(user=user,
+                                                start_contract=date(2020, 1, 1),
+                                                occupation=JobPosition.objects.create(name='name 0'),
+                                                provider_code='300000-00')
+        self.patient = Patient.objects.create(code_sn='1950010112345',
+                                              first_name='first name',
+                                              name='name',
+                                              address='address',
+                                              zipcode='zipcode',
+                                              city='city',
+                                              phone_number='000')
+        self.event_types = [EventType.objects.create(name='soin'), EventType.objects.create(name='visite')]
+
+    def create_event(self, day, event_type=0, hour=10):
+        return Event.objects.create(day=day, time_start_event=time(hour, 0), state=2,
+                                    event_type=self.event_types[event_type],
+                                    employees=self.employee, patient=self.patient)
+
+    def test_month_events_query(self):
+        for day in range(1, 11):
+            self.create_event(date(2020, 12, day), event_type=day % 2)
+            self.create_event(date(2020, 12, day), event_type=day % 2, hour=8)
+        self.create_event(date(2019, 12, 3))
+
+        with self.assertNumQueries(1):
+            html = EventCalendar().formatmonth(2020, 12)
+
+        self.assertEqual(20, html.count('class="eventtooltip"'))
+        self.assertLess(html.index('08:00:00'), html.index('10:00:00'))
+        self.assertIn('Jane - name', html)
+
+    def test_cached_month_follows_changes(self):
+        event = self.create_event(date(2020, 12, 10))
+        html = EventCalendar().formatmonth(2020, 12)
+        with self.assertNumQueries(0):
+            self.assertEqual(html, EventCalendar().formatmonth(2020, 12))
+
+        self.patient.name = 'new name'
+        self.patient.save()
+        self.assertIn('Jane - new name', EventCalendar().formatmonth(2020, 12))
+
+        event.day = date(2021, 1, 4)
+        event.save()
+        self.assertNotIn('eventtooltip', EventCalendar().formatmonth(2020, 12))
+        self.assertIn('eventtooltip', EventCalendar().formatmonth(2021, 1))
+
+        visits = EventCalendar(Event.objects.filter(event_type=self.event_types[1]))
+        self.assertNotIn('eventtooltip', visits.formatmonth(2021, 1))
+
+        event.delete()
+        self.assertNotIn('eventtooltip', EventCalendar().formatmonth(2021, 1))
@@ -1,3 +1,6 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
 from django.utils import timezone
 from django.forms import inlineformset_factory, ValidationError
 from django.test import TestCase
@@ -5,7 +8,8 @@ from copy import deepcopy
 
 from invoices.forms import ValidityDateFormSet, check_for_periods_intersection, HospitalizationFormSet, \
     PrestationInlineFormSet
-from invoices.models import CareCode, ValidityDate, InvoiceItem
+from invoices.employee import Employee, JobPosition
+from invoices.models import CareCode, ValidityDate, InvoiceItem, Patient, Prestation
 
 
 class CheckForPeriodsIntersectionTestCase(TestCase):
@@ -266,3 +270,69 @@ class PrestationInlineFormSetMaxLimitTestCase(TestCase):
         cleaned_data.append(row_data)
         with self.assertRaises(ValidationError):
             PrestationInlineFormSet.validate_max_limit(cleaned_data)
+
+
+class PrestationInlineFormSetValidationTestCase(TestCase):
+    def setUp(self):
+        self.date = timezone.now().replace(month=6, day=10, hour=10, minute=0, second=0, microsecond=0)
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.employee = Employee.objects.create(user=user,
+                                                start_contract=self.date,
+                                                occupation=JobPosition.objects.create(name='name 0'))
+        patient = Patient.objects.create(first_name='first name', name='name')
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1', invoice_date=self.date, patient=patient)
+        self.care_code = CareCode.objects.create(code='code0', name='some name', description='description')
+        self.exclusive_care_code = CareCode.objects.create(code='code1', name='some name', description='description')
+        self.exclusive_care_code.exclusive_care_codes.add(self.care_code)
+        Prestation.objects.create(invoice_item=self.invoice_item, employee=self.employee, carecode=self.care_code,
+                                  date=self.date)
+        self.formset_class = inlineformset_factory(InvoiceItem, Prestation, formset=PrestationInlineFormSet,
+                                                   fields=('carecode', 'date', 'quantity', 'at_home', 'employee'),
+                                                   extra=0)
+
+    def get_formset(self, rows):
+        data = {
+            'prestations-TOTAL_FORMS': len(rows),
+            'prestations-INITIAL_FORMS': 0,
+        }
+        for index, (carecode, date) in enumerate(rows):
+            data.update({
+                'prestations-%s-carecode' % index: carecode.id if carecode else '',
+                'prestations-%s-date' % index: timezone.localtime(date).strftime('%Y-%m-%d %H:%M:%S') if date else '',
+                'prestations-%s-quantity' % index: 1,
+                'prestations-%s-employee' % index: self.employee.id,
+            })
+
+        return self.formset_class(data, instance=self.invoice_item, prefix='prestations')
+
+    @mock.patch.object(Prestation, 'validate')
+    def test_rows_are_validated_together(self, validate):
+        other_date = self.date.replace(day=11)
+        formset = self.get_formset([(self.care_code, other_date), (self.exclusive_care_code, self.date),
+                                    (self.exclusive_care_code, other_date)])
+
+        self.assertFalse(formset.is_valid())
+        validate.assert_not_called()
+        self.assertEqual(formset.errors[0], {})
+        self.assertEqual(formset.errors[1]['carecode'],
+                         ['CareCode code1 cannot be applied because CareCode(s) code0 has been applied already'])
+        self.assertEqual(formset.errors[2], {})
+
+    def test_valid_rows(self):
+        formset = self.get_formset([(self.exclusive_care_code, self.date.replace(day=day)) for day in range(11, 16)])
+
+        self.assertTrue(formset.is_valid())
+        formset.save()
+        self.assertEqual(self.invoice_item.prestations.count(), 6)
+
+    def test_rows_with_missing_fields(self):
+        formset = self.get_formset([(None, self.date.replace(day=11)), (self.care_code, None),
+                                    (self.exclusive_care_code, self.date)])
+
+        self.assertFalse(formset.is_valid())
+        self.assertIn('carecode', formset.errors[0])
+        self.assertIn('date', formset.errors[1])
+        # run by clean once all the rows are valid, the rows with field errors are left out
+        formset.validate_prestations()
+        self.assertEqual(formset.errors[2]['carecode'],
+                         ['CareCode code1 cannot be applied because CareCode(s) code0 has been applied already'])
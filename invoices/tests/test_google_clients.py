@@ -0,0 +1,53 @@
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from invoices import google_clients
+from invoices.gcalendar import PrestationGoogleCalendar
+from invoices.gcalendar2 import PrestationGoogleCalendarSurLu
+from invoices.storages import CustomizedGoogleDriveStorage, LazyGoogleDriveStorage
+
+
+class GoogleClientsTestCase(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(google_clients, _credentials={}, _discovery_documents={},
+                                      _local=threading.local())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('invoices.google_clients.httplib2.Http')
+    def test_construction_does_not_touch_google(self, http):
+        PrestationGoogleCalendar(json_keyfile_path='/nonexistent.json')
+        PrestationGoogleCalendarSurLu(json_keyfile_path='/nonexistent.json')
+        CustomizedGoogleDriveStorage()
+        LazyGoogleDriveStorage()
+
+        http.assert_not_called()
+
+    @mock.patch('invoices.google_clients.discovery.build_from_document')
+    @mock.patch('invoices.google_clients.httplib2.Http')
+    def test_services_share_discovery_and_credentials(self, http, build_from_document):
+        http.return_value.request.return_value = (mock.Mock(status=200), b'{"name": "calendar"}')
+        build_from_document.side_effect = lambda document, credentials: mock.Mock()
+        factory = mock.Mock(return_value='credentials')
+        services = []
+
+        def get_service():
+            credentials = google_clients.get_credentials('key', factory)
+            services.append(google_clients.get_service('calendar', 'v3', credentials))
+            services.append(google_clients.get_service('calendar', 'v3', credentials))
+
+        threads = [threading.Thread(target=get_service) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(factory.call_count, 1)
+        self.assertEqual(http.return_value.request.call_count, 1)
+        build_from_document.assert_called_with({'name': 'calendar'}, credentials='credentials')
+        # one service per thread
+        self.assertIs(services[0], services[1])
+        self.assertIs(services[2], services[3])
+        self.assertIsNot(services[0], services[2])
@@ -0,0 +1,293 @@
+import hashlib
+import shutil
+import tempfile
+from datetime import date
+from io import BytesIO, StringIO
+from unittest import mock
+
+from constance import config
+from constance.test import override_config
+from PIL import Image
+from PyPDF2 import PdfFileReader
+from reportlab.lib.units import cm
+from reportlab.platypus.doctemplate import SimpleDocTemplate
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from invoices.action import export_to_pdf
+from invoices.action_depinsurance import export_to_pdf2
+from invoices.action_private import pdf_private_invoice
+from invoices.action_private_participation import pdf_private_invoice_pp
+from invoices.employee import Employee, JobPosition
+from invoices.invoiceitem_pdf import get_doc_chunks, get_doc_elements
+from invoices.invoiceitem_pdf_bis import get_doc_elements as get_doc_elements_bis
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem, ValidityDate, Physician, MedicalPrescription, \
+    gd_storage
+from invoices.pdf_data import billing_config, prefetch_invoice_items, invoice_pages
+from invoices.pdf_layout import invoice_layout
+from invoices.pdf_parallel import render_cns_pdf
+from invoices.pdf_stream import merge_files, render_chunk
+from invoices.prescription_images import print_image, prescription_image_cache
+from invoices.tariffs import tariff_index
+
+
+class InvoicePdfTestCase(TestCase):
+    def setUp(self):
+        self.date = timezone.now().replace(year=2020, month=11, day=2, hour=10, minute=0)
+        jobposition = JobPosition.objects.create(name='name 0')
+        self.employees = []
+        for i in range(3):
+            user = User.objects.create_user('testuser%d' % i, email='testuser%d@test.com' % i, password='testing')
+            self.employees.append(Employee.objects.create(user=user,
+                                                          start_contract=self.date,
+                                                          occupation=jobposition,
+                                                          provider_code='30000%d-00' % i))
+        self.care_codes = []
+        for i in range(4):
+            care_code = CareCode.objects.create(code='code%d' % i,
+                                                name='some name %d' % i,
+                                                description='description',
+                                                reimbursed=i != 3)
+            ValidityDate.objects.create(start_date=date(2020, 1, 1),
+                                        gross_amount=10 + i,
+                                        care_code=care_code)
+            self.care_codes.append(care_code)
+
+    def create_invoices(self, count, prestations_count=3):
+        for i in range(count):
+            patient = Patient.objects.create(code_sn='19500101%05d' % i,
+                                             first_name='first name %d' % i,
+                                             name='name %d' % i,
+                                             address='address',
+                                             zipcode='zipcode',
+                                             city='city',
+                                             phone_number='000')
+            invoice_item = InvoiceItem.objects.create(invoice_number='%d' % (InvoiceItem.objects.count() + 1),
+                                                      invoice_date=self.date.date(),
+                                                      patient=patient)
+            for j in range(prestations_count):
+                Prestation.objects.create(invoice_item=invoice_item,
+                                          employee=self.employees[j % len(self.employees)],
+                                          carecode=self.care_codes[j % len(self.care_codes)],
+                                          date=self.date.replace(day=j % 28 + 1))
+
+        return InvoiceItem.objects.all()
+
+    def build_pdf(self, elements):
+        buffer = BytesIO()
+        doc = SimpleDocTemplate(buffer, rightMargin=2 * cm, leftMargin=2 * cm, topMargin=1 * cm, bottomMargin=1 * cm)
+        doc.build(elements)
+        buffer.seek(0)
+        return PdfFileReader(buffer)
+
+    def read_response(self, response):
+        self.assertIsInstance(response, StreamingHttpResponse)
+        return PdfFileReader(BytesIO(b''.join(response.streaming_content)))
+
+    def assertSamePages(self, streamed, built):
+        self.assertEqual(streamed.getNumPages(), built.getNumPages())
+        for i in range(built.getNumPages()):
+            self.assertEqual(streamed.getPage(i).extractText(), built.getPage(i).extractText())
+
+
+class InvoicePdfQueriesTestCase(InvoicePdfTestCase):
+    def count_queries(self, build):
+        tariff_index.invalidate()
+        with CaptureQueriesContext(connection) as context:
+            build()
+        return len(context.captured_queries)
+
+    def test_cns_invoice_queries_do_not_grow_with_invoices(self):
+        queryset = self.create_invoices(2)
+        tariff_index.invalidate()
+        with self.assertNumQueries(4):
+            get_doc_elements(queryset)
+        small = self.count_queries(lambda: get_doc_elements(queryset, True))
+
+        queryset = self.create_invoices(6, prestations_count=25)
+        self.assertEqual(self.count_queries(lambda: get_doc_elements(queryset, True)), small)
+        # the prescriptions whose scans are prefetched are read in one more query
+        self.assertEqual(self.count_queries(lambda: get_doc_elements_bis(queryset, 'ref')), small - 1)
+
+    def test_private_invoice_queries_do_not_grow_with_invoices(self):
+        queryset = self.create_invoices(2)
+        small = self.count_queries(lambda: pdf_private_invoice(None, None, queryset))
+        small_pp = self.count_queries(lambda: pdf_private_invoice_pp(None, None, queryset))
+
+        queryset = self.create_invoices(6, prestations_count=25)
+        self.assertEqual(self.count_queries(lambda: pdf_private_invoice(None, None, queryset)), small)
+        self.assertEqual(self.count_queries(lambda: pdf_private_invoice_pp(None, None, queryset)), small_pp)
+
+    def test_invoice_pages(self):
+        self.create_invoices(1, prestations_count=25)
+        invoice_item = prefetch_invoice_items(InvoiceItem.objects.all()).get()
+        pages = invoice_pages(invoice_item)
+        self.assertEqual([(number, len(prestations)) for number, prestations in pages],
+                         [('11112020', 20), ('12112020', 5)])
+        self.assertEqual([p.date for p in pages[0][1]], sorted(p.date for p in pages[0][1]))
+
+
+class StreamingExportTestCase(InvoicePdfTestCase):
+    def test_export_to_pdf(self):
+        queryset = self.create_invoices(3, prestations_count=25)
+        response = export_to_pdf(None, None, queryset)
+
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoice1-2-3.pdf"')
+        self.assertSamePages(self.read_response(response), self.build_pdf(get_doc_elements(queryset)))
+
+    def test_export_to_pdf2(self):
+        queryset = self.create_invoices(2)
+        response = export_to_pdf2(None, None, queryset)
+        payment_ref = hashlib.sha1(response['Content-Disposition'].encode("UTF-8")).hexdigest()[:10]
+
+        self.assertSamePages(self.read_response(response),
+                             self.build_pdf(get_doc_elements_bis(queryset, payment_ref)))
+
+    def test_pdf_private_invoice_batches(self):
+        queryset = self.create_invoices(3)
+        with mock.patch('invoices.action_private.STREAM_BATCH_SIZE', 2):
+            reader = self.read_response(pdf_private_invoice(None, None, queryset))
+
+        self.assertEqual(reader.getNumPages(), 4)
+        self.assertIn('name 2', reader.getPage(2).extractText())
+
+
+    def test_merged_files_are_closed_once_copied(self):
+        queryset = self.create_invoices(3)
+        files = []
+
+        def rendered():
+            for elements in get_doc_chunks(queryset, False):
+                self.assertTrue(all(chunk.closed for chunk in files))
+                files.append(render_chunk(elements))
+                yield files[-1]
+
+        reader = PdfFileReader(merge_files(rendered(), BytesIO()), strict=True)
+        self.assertTrue(all(chunk.closed for chunk in files))
+        self.assertSamePages(reader, self.build_pdf(get_doc_elements(queryset)))
+
+class ParallelRenderingTestCase(InvoicePdfTestCase):
+    def test_render_cns_pdf(self):
+        queryset = self.create_invoices(5, prestations_count=25)
+        progress = []
+        with mock.patch('invoices.pdf_parallel.STREAM_BATCH_SIZE', 2):
+            output = render_cns_pdf(queryset, BytesIO(), processes=2,
+                                    progress_callback=lambda done, total: progress.append((done, total)))
+
+        self.assertSamePages(PdfFileReader(output), self.build_pdf(get_doc_elements(queryset)))
+        self.assertEqual(progress[-1], (10, 10))
+
+    @override_settings(PDF_RENDER_PROCESSES=2)
+    def test_export_to_pdf_does_not_fork(self):
+        queryset = self.create_invoices(2)
+        with mock.patch('invoices.pdf_parallel.render_cns_pdf', wraps=render_cns_pdf) as render:
+            reader = self.read_response(export_to_pdf(None, None, queryset))
+
+        self.assertFalse(render.called)
+        self.assertSamePages(reader, self.build_pdf(get_doc_elements(queryset)))
+
+    def test_benchmark_compares_the_pages(self):
+        self.create_invoices(3, prestations_count=25)
+        stdout = StringIO()
+        call_command('benchmark_invoice_pdf', '--processes', '2', stdout=stdout)
+        self.assertIn('Same 8 pages', stdout.getvalue())
+
+        def render_one_invoice_less(queryset, output, *args, **kwargs):
+            return render_cns_pdf(queryset.exclude(pk=queryset.first().pk), output)
+
+        with mock.patch('invoices.management.commands.benchmark_invoice_pdf.render_cns_pdf', render_one_invoice_less):
+            with self.assertRaisesMessage(CommandError, 'The parallel PDF has 6 pages instead of 8'):
+                call_command('benchmark_invoice_pdf', '--processes', '2', stdout=StringIO())
+
+
+class InvoiceLayoutTestCase(InvoicePdfTestCase):
+    def test_layout_is_shared_until_the_billing_settings_change(self):
+        layout = invoice_layout(billing_config())
+        self.assertIs(invoice_layout(billing_config()), layout)
+
+        with override_config(MAIN_BANK_ACCOUNT='LU00 0000'):
+            changed = invoice_layout(billing_config())
+            self.assertIsNot(changed, layout)
+            self.assertEqual(changed.final_page_supplier()._cellvalues[2][1], 'LU00 0000')
+        self.assertIsNot(invoice_layout(billing_config()), changed)
+
+    def test_layout_builds_new_flowables(self):
+        layout = invoice_layout(billing_config())
+        self.assertIsNot(layout.final_page_supplier(), layout.final_page_supplier())
+        self.assertIsNot(layout.final_page_summary(), layout.final_page_summary())
+        self.assertIs(layout.final_page_summary().style, layout.final_page_summary().style)
+
+    def test_billing_config_without_the_backend_mget(self):
+        with override_config(MAIN_BANK_ACCOUNT='LU00 0000'):
+            values = billing_config()
+            with mock.patch.object(type(config._backend), 'mget', None):
+                self.assertEqual(billing_config(), values)
+        self.assertEqual(values['MAIN_BANK_ACCOUNT'], 'LU00 0000')
+
+    def test_shared_layout_renders_the_same_pages(self):
+        queryset = self.create_invoices(2, prestations_count=25)
+        first = self.build_pdf(get_doc_elements(queryset))
+
+        self.assertSamePages(self.build_pdf(get_doc_elements(queryset)), first)
+
+
+def scan(size=(3000, 4000)):
+    output = BytesIO()
+    Image.new('RGB', size, 'white').save(output, 'PNG')
+    return output.getvalue()
+
+
+class PrescriptionImagesTestCase(InvoicePdfTestCase):
+    def setUp(self):
+        super(PrescriptionImagesTestCase, self).setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(PRESCRIPTION_IMAGE_CACHE_ROOT=root, THUMBNAIL_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.version = ('drive-id', '2020-11-02T10:00:00.000Z')
+        for name, side_effect in (('_save', lambda name, content: name), ('exists', lambda name: False),
+                                  ('update_file_description', None), ('delete', None),
+                                  ('file_version', lambda name: self.version),
+                                  ('open', lambda name, mode='rb': ContentFile(scan()))):
+            patcher = mock.patch.object(gd_storage, name, side_effect=side_effect)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def create_invoices(self, count, prestations_count=3):
+        queryset = super(PrescriptionImagesTestCase, self).create_invoices(count, prestations_count)
+        physician = Physician.objects.create(first_name='first name', name='name')
+        for invoice_item in queryset:
+            invoice_item.medical_prescription = MedicalPrescription.objects.create(
+                prescriptor=physician, patient=invoice_item.patient, date=self.date.date(),
+                file=SimpleUploadedFile('scan.png', scan(), content_type='image/png'))
+            invoice_item.save()
+
+        return queryset
+
+    def test_print_image(self):
+        with Image.open(BytesIO(print_image(scan(), dpi=72))) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (470, 627)))
+        self.assertEqual(print_image(b'not an image'), b'not an image')
+
+    def test_scans_are_downloaded_once(self):
+        queryset = self.create_invoices(3)
+        misses = prescription_image_cache.misses
+        self.assertEqual(self.build_pdf(get_doc_elements(queryset, True)).getNumPages(), 8)
+        self.assertEqual(self.open.call_count, 3)
+        self.assertEqual(prescription_image_cache.misses, misses + 3)
+
+        get_doc_elements(queryset, True)
+        self.assertEqual(self.open.call_count, 3)
+
+        self.version = ('drive-id', '2020-11-03T10:00:00.000Z')
+        render_cns_pdf(queryset, BytesIO(), True, processes=2)
+        self.assertEqual(self.open.call_count, 6)
@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from invoices.calendar_outbox import CalendarOutboxEntry
+from invoices.employee import Employee, JobPosition
+from invoices.gcalendar_local import InMemoryCalendarService, InMemoryPrestationCalendar
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem
+from invoices.storages import LocalDriveStorage
+
+
+@override_settings(GOOGLE_SERVICES_BACKEND='google')
+class InMemoryCalendarTestCase(TestCase):
+    def setUp(self):
+        date = timezone.now() + timedelta(days=1)
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        employee = Employee.objects.create(user=user,
+                                           start_contract=date,
+                                           occupation=JobPosition.objects.create(name='name 0'),
+                                           provider_code='300000-00')
+        patient = Patient.objects.create(code_sn='1950010112345',
+                                         first_name='first name',
+                                         name='name',
+                                         address='address',
+                                         zipcode='zipcode',
+                                         city='city',
+                                         phone_number='000')
+        care_code = CareCode.objects.create(code='code0', name='some name', description='description',
+                                            reimbursed=True)
+        invoice_item = InvoiceItem.objects.create(invoice_number='1', invoice_date=date.date(), patient=patient)
+        self.prestations = [Prestation.objects.create(invoice_item=invoice_item,
+                                                      employee=employee,
+                                                      carecode=care_code,
+                                                      date=date) for i in range(3)]
+
+    def test_google_sync_is_off_without_use_gdrive(self):
+        self.assertFalse(CalendarOutboxEntry.objects.exists())
+
+    def test_update_and_delete_events(self):
+        service = InMemoryCalendarService(latency=0)
+        calendar = InMemoryPrestationCalendar(service=service)
+
+        self.assertEqual(calendar.update_events(self.prestations), {})
+        self.assertEqual(calendar.update_events(self.prestations[:1]), {})
+        self.assertEqual(calendar.delete_events([p.id for p in self.prestations[1:]] + [0]), {})
+
+        event = calendar.get_event(calendar._get_event_id(self.prestations[0].id))
+        self.assertEqual(event['summary'], '%s %s' % (self.prestations[0].id, self.prestations[0]))
+        self.assertIsNone(calendar.get_event(calendar._get_event_id(self.prestations[1].id)))
+        # calendar list and creation, then update, insert, update and delete batches, then the two gets
+        self.assertEqual(service.requests_count, 8)
+
+
+class LocalDriveStorageTestCase(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def test_local_drive_storage(self):
+        storage = LocalDriveStorage(location=self.location, base_url='/media/local-drive/')
+        path = storage.MEDICAL_PRESCRIPTION_FOLDER + '/2020/scan.jpg'
+
+        self.assertEqual(storage.save_file(path, ContentFile(b'image')), path)
+        storage.update_file_description(path, 'description')
+        storage.update_folder_permissions_v3(storage.MEDICAL_PRESCRIPTION_FOLDER, 'a@test.com', True)
+        storage.update_folder_permissions_v3(storage.MEDICAL_PRESCRIPTION_FOLDER, 'b@test.com', True)
+        storage.update_folder_permissions_v3(storage.MEDICAL_PRESCRIPTION_FOLDER, 'a@test.com', False)
+
+        self.assertEqual(storage.get_thumbnail_link(path), '/media/local-drive/Medical%20Prescription/2020/scan.jpg')
+        self.assertEqual(storage.get_thumbnail_link('missing.jpg'), '')
+        self.assertEqual(storage.get_file_description(path), 'description')
+        self.assertEqual(storage.get_folder_permissions(storage.MEDICAL_PRESCRIPTION_FOLDER), ['b@test.com'])
+
+    @override_settings(LOCAL_CALENDAR_LATENCY=0.01)
+    def test_latency_setting(self):
+        self.assertEqual(InMemoryCalendarService().latency, 0.01)
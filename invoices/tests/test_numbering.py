@@ -0,0 +1,74 @@
+import threading
+from datetime import date
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from invoices.models import Patient, InvoiceItem, InvoiceNumberCounter, get_default_invoice_number
+
+
+class InvoiceNumberingTestCase(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(first_name='first name', name='name')
+        InvoiceItem.objects.create(invoice_number='41', invoice_date=date(2020, 1, 1), patient=self.patient)
+
+    def test_counter_starts_after_existing_numbers(self):
+        InvoiceNumberCounter.objects.all().delete()
+        InvoiceItem.objects.create(invoice_number='A-100', invoice_date=date(2020, 1, 1), patient=self.patient)
+
+        self.assertEqual(get_default_invoice_number(), 42)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_default_invoice_number(), 42)
+
+    def test_taken_default_is_replaced(self):
+        default = get_default_invoice_number()
+        first = InvoiceItem.objects.create(invoice_number=default, invoice_date=date(2020, 1, 1),
+                                           patient=self.patient)
+        second = InvoiceItem.objects.create(invoice_number=default, invoice_date=date(2020, 1, 1),
+                                            patient=self.patient)
+
+        self.assertEqual(first.invoice_number, 42)
+        self.assertEqual(second.invoice_number, '43')
+        self.assertEqual(get_default_invoice_number(), 44)
+
+    def test_typed_numbers_move_the_counter(self):
+        InvoiceItem.objects.create(invoice_number='100', invoice_date=date(2020, 1, 1), patient=self.patient)
+        self.assertEqual(get_default_invoice_number(), 101)
+
+        invoice_item = InvoiceItem.objects.create(invoice_number='50', invoice_date=date(2020, 1, 1),
+                                                  patient=self.patient)
+        self.assertEqual(invoice_item.invoice_number, '50')
+
+        invoice_item.invoice_number = '200'
+        invoice_item.save()
+        self.assertEqual(get_default_invoice_number(), 201)
+
+    def test_unchanged_number_leaves_the_counter_alone(self):
+        invoice_item = InvoiceItem.objects.get(invoice_number='41')
+        invoice_item.invoice_paid = True
+        # the savepoint, the update and its release, without any counter update
+        with self.assertNumQueries(3):
+            invoice_item.save(update_fields=['invoice_paid'])
+
+
+class ConcurrentInvoiceNumberingTestCase(TransactionTestCase):
+    def test_concurrent_creations_do_not_overlap(self):
+        patient = Patient.objects.create(first_name='first name', name='name')
+
+        def create():
+            try:
+                for i in range(5):
+                    InvoiceItem.objects.create(invoice_number=get_default_invoice_number(),
+                                               invoice_date=date(2020, 1, 1), patient=patient)
+            finally:
+                connection.close()
+
+        get_default_invoice_number()
+        threads = [threading.Thread(target=create) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(int(number) for number in InvoiceItem.objects.values_list('invoice_number', flat=True)),
+                         list(range(1, 21)))
@@ -0,0 +1,52 @@
+from datetime import date, time
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from invoices.employee import Employee, JobPosition
+from invoices.events import Event, EventType, validate_date_range
+from invoices.holidays import HolidayRequest, validate_requests_from_other_employees
+
+
+class OverlapsTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('testuser%s' % i, email='testuser%s@test.com' % i,
+                                               password='testing') for i in range(2)]
+        self.employee = Employee.objects.create(user=self.users[0],
+                                                start_contract=date(2020, 1, 1),
+                                                occupation=JobPosition.objects.create(name='name 0'),
+                                                provider_code='300000-00')
+        self.event = Event.objects.create(day=date(2020, 12, 10), time_start_event=time(10, 0),
+                                          time_end_event=time(11, 0), state=2,
+                                          event_type=EventType.objects.create(name='visite'),
+                                          employees=self.employee)
+
+    def test_events_intersection(self):
+        error_msg = {'time_start_event': 'Intersection with other Event'}
+
+        def validate(start, end, day=date(2020, 12, 10), instance_id=None):
+            return validate_date_range(instance_id, {'day': day, 'time_start_event': start, 'time_end_event': end,
+                                                     'employees_id': self.employee.id})
+
+        self.assertEqual(validate(time(9, 0), time(12, 0)), error_msg)
+        self.assertEqual(validate(time(10, 30), time(10, 45)), error_msg)
+        self.assertEqual(validate(time(11, 0), None), error_msg)
+        self.assertEqual(validate(time(8, 0), time(9, 59)), {})
+        self.assertEqual(validate(time(9, 0), time(12, 0), day=date(2020, 12, 11)), {})
+        self.assertEqual(validate(time(9, 0), time(12, 0), instance_id=self.event.id), {})
+        self.assertEqual(validate(None, None), {})
+
+    def test_holiday_requests_of_other_employees(self):
+        HolidayRequest.objects.create(employee=self.users[1], request_creator=self.users[1], request_accepted=True,
+                                      start_date=date(2020, 7, 1), end_date=date(2020, 7, 20), half_day=False,
+                                      reason=1)
+
+        def validate(start_date, end_date):
+            return validate_requests_from_other_employees(None, {'start_date': start_date, 'end_date': end_date,
+                                                                 'employee_id': self.users[0].id})
+
+        self.assertIn('start_date', validate(date(2020, 6, 25), date(2020, 7, 1)))
+        self.assertIn('start_date', validate(date(2020, 7, 20), date(2020, 7, 25)))
+        # within the other request
+        self.assertIn('start_date', validate(date(2020, 7, 5), date(2020, 7, 10)))
+        self.assertEqual(validate(date(2020, 7, 21), date(2020, 7, 25)), {})
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from constance.test import override_config
+from django.contrib.auth.models import User
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from invoices import pdf_cache
+from invoices.action import export_to_pdf
+from invoices.employee import Employee, JobPosition
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem, ValidityDate
+from invoices.pdf_cache import LocalPdfCache, cached_pdf_response, get_pdf_cache
+
+
+class LocalPdfCacheTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_least_recently_read_are_evicted(self):
+        cache = LocalPdfCache(self.root, max_size=20)
+        cache.set('a', b'0123456789')
+        cache.set('b', b'0123456789')
+        os.utime(os.path.join(self.root, 'a.pdf'), (1, 1))
+        os.utime(os.path.join(self.root, 'b.pdf'), (2, 2))
+        self.assertEqual(cache.get('a'), b'0123456789')
+
+        cache.set('c', b'0123456789')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), b'0123456789')
+        self.assertEqual(cache.stats(), {'entries': 2, 'size': 20, 'hits': 2, 'misses': 1})
+
+
+class CachedPdfResponseTestCase(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(PDF_CACHE_BACKEND='local', PDF_CACHE_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        get_pdf_cache().clear()
+
+        self.date = timezone.now().replace(year=2020, month=6, day=10, hour=10, minute=0, second=0, microsecond=0)
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        employee = Employee.objects.create(user=user,
+                                           start_contract=self.date,
+                                           occupation=JobPosition.objects.create(name='name 0'))
+        patient = Patient.objects.create(first_name='first name', name='name')
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1', invoice_date=date(2020, 6, 30),
+                                                       patient=patient)
+        care_code = CareCode.objects.create(code='code0', name='some name', description='description')
+        self.validity_date = ValidityDate.objects.create(care_code=care_code, start_date=date(2020, 1, 1),
+                                                         gross_amount=Decimal('10.50'))
+        self.prestation = Prestation.objects.create(invoice_item=self.invoice_item, employee=employee,
+                                                    carecode=care_code, date=self.date)
+        self.rendered = []
+
+    def render(self):
+        self.rendered.append(len(self.rendered) + 1)
+        return StreamingHttpResponse([b'%PDF ', str(len(self.rendered)).encode()])
+
+    def get(self, kind=pdf_cache.CNS):
+        return cached_pdf_response(kind, InvoiceItem.objects.filter(pk=self.invoice_item.pk), self.render)
+
+    def test_unchanged_invoices_are_served_from_the_cache(self):
+        hits = get_pdf_cache().stats()['hits']
+        response = self.get()
+        self.assertEqual((response.content, response['X-PDF-Cache']), (b'%PDF 1', 'miss'))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoice-name-1-30-06-2020.pdf"')
+
+        response = self.get()
+        self.assertEqual((response.content, response['X-PDF-Cache']), (b'%PDF 1', 'hit'))
+        self.assertEqual(self.get(pdf_cache.PERSONAL_PARTICIPATION).content, b'%PDF 2')
+        self.assertEqual(get_pdf_cache().stats()['hits'], hits + 1)
+
+    def test_changes_render_again(self):
+        self.get()
+
+        self.prestation.quantity = 2
+        self.prestation.save()
+        self.assertEqual(self.get().content, b'%PDF 2')
+
+        self.validity_date.gross_amount = Decimal('11.00')
+        self.validity_date.save()
+        self.assertEqual(self.get().content, b'%PDF 3')
+
+        with override_config(MAIN_BANK_ACCOUNT='LU00 0000'):
+            self.assertEqual(self.get().content, b'%PDF 4')
+
+    def test_cns_invoice(self):
+        queryset = InvoiceItem.objects.filter(pk=self.invoice_item.pk)
+        content = cached_pdf_response(pdf_cache.CNS, queryset, lambda: export_to_pdf(None, None, queryset)).content
+
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertEqual(cached_pdf_response(pdf_cache.CNS, queryset, self.render).content, content)
+
+    def test_selections_are_not_cached(self):
+        InvoiceItem.objects.create(invoice_number='2', invoice_date=date(2020, 6, 30),
+                                   patient=self.invoice_item.patient)
+        render = lambda: HttpResponse(b'%PDF')
+
+        response = cached_pdf_response(pdf_cache.CNS, InvoiceItem.objects.all(), render)
+        self.assertFalse(response.has_header('X-PDF-Cache'))
+        self.assertEqual(get_pdf_cache().stats()['entries'], 0)
@@ -0,0 +1,132 @@
+from datetime import date
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from invoices.employee import Employee, JobPosition
+from invoices.managers import InvoiceItemBatchManager
+from invoices.models import CareCode, Patient, Prestation, InvoiceItem, InvoiceItemBatch, ValidityDate
+
+
+class InvoiceTotalsTestCase(TestCase):
+    def setUp(self):
+        self.date = timezone.now().replace(year=2020, month=6, day=10, hour=10, minute=0, second=0, microsecond=0)
+        user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        self.employee = Employee.objects.create(user=user,
+                                                start_contract=self.date,
+                                                occupation=JobPosition.objects.create(name='name 0'))
+        self.patient = Patient.objects.create(first_name='first name', name='name', is_private=True)
+        self.batch = InvoiceItemBatch.objects.create(start_date=date(2020, 6, 1), end_date=date(2020, 6, 30))
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='1', invoice_date=date(2020, 6, 30),
+                                                       patient=self.patient, batch=self.batch)
+        self.care_code = CareCode.objects.create(code='code0', name='some name', description='description')
+        self.validity_date = ValidityDate.objects.create(care_code=self.care_code, start_date=date(2020, 1, 1),
+                                                         gross_amount=Decimal('10.50'))
+
+    def create_prestation(self, quantity=1):
+        return Prestation.objects.create(invoice_item=self.invoice_item, employee=self.employee,
+                                         carecode=self.care_code, date=self.date, quantity=quantity)
+
+    def assertTotals(self, instance, totals):
+        instance.refresh_from_db()
+        self.assertEqual((instance.total_gross, instance.total_net, instance.total_participation),
+                         tuple(Decimal(total) for total in totals))
+
+    def test_prestation_changes(self):
+        prestation = self.create_prestation(quantity=2)
+        self.assertTotals(self.invoice_item, ('21.00', '0.00', '21.00'))
+        self.assertTotals(self.batch, ('21.00', '0.00', '21.00'))
+
+        self.create_prestation()
+        self.assertTotals(self.invoice_item, ('31.50', '0.00', '31.50'))
+
+        prestation.delete()
+        self.assertTotals(self.invoice_item, ('10.50', '0.00', '10.50'))
+        self.assertTotals(self.batch, ('10.50', '0.00', '10.50'))
+
+    def test_prestation_moved_to_another_invoice(self):
+        prestation = self.create_prestation()
+        other = InvoiceItem.objects.create(invoice_number='2', invoice_date=date(2020, 6, 30), patient=self.patient)
+
+        prestation.invoice_item = other
+        prestation.save()
+        self.assertTotals(self.invoice_item, ('0.00', '0.00', '0.00'))
+        self.assertTotals(other, ('10.50', '0.00', '10.50'))
+
+    def test_tariff_and_patient_changes(self):
+        self.create_prestation()
+
+        self.validity_date.gross_amount = Decimal('12.00')
+        self.validity_date.save()
+        self.assertTotals(self.invoice_item, ('12.00', '0.00', '12.00'))
+
+        self.patient.is_private = False
+        self.patient.save()
+        self.assertTotals(self.invoice_item, ('12.00', '12.00', '0.00'))
+
+        self.validity_date.delete()
+        self.assertTotals(self.invoice_item, ('0.00', '0.00', '0.00'))
+
+    def test_save_without_the_dependencies(self):
+        self.patient.first_name = 'other name'
+        with mock.patch('invoices.models.refresh_invoice_totals') as refresh:
+            with self.assertNumQueries(1):
+                self.patient.save(update_fields=['first_name'])
+            self.patient.is_private = False
+            self.patient.save(update_fields=['is_private'])
+        refresh.assert_called_once_with(mock.ANY)
+
+    def test_save_compares_to_the_loaded_dependencies(self):
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.first_name = 'other name'
+        with self.assertNumQueries(1):
+            patient.save()
+
+        Patient.objects.filter(pk=patient.pk).update(is_private=False)
+        patient.refresh_from_db()
+        patient.is_private = True
+        with mock.patch('invoices.models.refresh_invoice_totals') as refresh:
+            patient.save()
+        refresh.assert_called_once_with(mock.ANY)
+
+    def test_invoice_item_deletion(self):
+        for i in range(3):
+            self.create_prestation()
+        with mock.patch('invoices.models.refresh_invoice_totals') as refresh:
+            self.invoice_item.delete()
+        self.assertFalse(refresh.called)
+        self.assertTotals(self.batch, ('0.00', '0.00', '0.00'))
+
+        # the prestations deleted on their own are still refreshed
+        self.invoice_item = InvoiceItem.objects.create(invoice_number='2', invoice_date=date(2020, 6, 30),
+                                                       patient=self.patient, batch=self.batch)
+        prestation = self.create_prestation()
+        prestation.delete()
+        self.assertTotals(self.batch, ('0.00', '0.00', '0.00'))
+
+    def test_batch_changes(self):
+        self.create_prestation()
+        self.invoice_item.batch = None
+        self.invoice_item.save()
+        self.assertTotals(self.batch, ('0.00', '0.00', '0.00'))
+
+        InvoiceItemBatch.objects.filter(pk=self.batch.pk).update(start_date=date(2020, 1, 1))
+        self.batch.refresh_from_db()
+        InvoiceItem.objects.filter(pk=self.invoice_item.pk).update(is_private=False)
+        InvoiceItemBatchManager.update_associated_invoiceitems(self.batch)
+        self.assertTotals(self.batch, ('10.50', '0.00', '10.50'))
+
+    def test_rebuild_command(self):
+        self.create_prestation()
+        InvoiceItem.objects.update(total_gross=0)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_invoice_totals', '--verify', stdout=StringIO())
+        call_command('rebuild_invoice_totals', stdout=StringIO())
+        self.assertTotals(self.invoice_item, ('10.50', '0.00', '10.50'))
+        call_command('rebuild_invoice_totals', '--verify', stdout=StringIO())
@@ -1,10 +1,19 @@
+from datetime import date, datetime, time, timedelta
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-from invoices.holidays import HolidayRequest
+from helpers.holidays import how_many_hours_taken_in_period
+from invoices.holidays import HolidayRequest, with_contract_hours
 from invoices.timesheet import Timesheet, TimesheetTask, TimesheetDetail, \
-    validate_date_range_vs_holiday_requests, SimplifiedTimesheet
+    validate_date_range_vs_holiday_requests, SimplifiedTimesheet, SimplifiedTimesheetDetail, PublicHolidayCalendar, \
+    PublicHolidayCalendarDetail
+from invoices.timesheet_cache import timesheet_totals_key
+from invoices.timesheet_totals import TimesheetMonth
+from invoices.working_calendar import luxembourg_holidays
 from invoices.employee import Employee, EmployeeContractDetail, JobPosition
 
 
@@ -155,3 +164,126 @@ class TimesheetDetailTestCase(TestCase):
                                                                   user=self.user)
         simplified_timesheet.save()
         self.assertEqual(0, simplified_timesheet.absence_hours_taken()[0])
+
+
+class SimplifiedTimesheetTotalsTestCase(TestCase):
+    def setUp(self):
+        calendar = PublicHolidayCalendar.objects.create(calendar_year=2020)
+        for day in (date(2020, 6, 1), date(2020, 6, 23), date(2020, 7, 1)):
+            PublicHolidayCalendarDetail.objects.create(calendar_date=day, calendar_link=calendar)
+        self.jobposition = JobPosition.objects.create(name='name 0')
+        self.timesheets = [self.create_timesheet(i) for i in range(2)]
+
+    def create_timesheet(self, i):
+        user = User.objects.create_user('testuser%d' % i, email='testuser%d@test.com' % i, password='testing')
+        employee = Employee.objects.create(user=user, start_contract=date(2018, 1, 1), occupation=self.jobposition)
+        EmployeeContractDetail.objects.create(start_date=date(2018, 1, 1), number_of_hours=30, employee_link=employee)
+        EmployeeContractDetail.objects.create(start_date=date(2020, 7, 1), number_of_hours=40, employee_link=employee)
+        HolidayRequest.objects.create(employee=user, start_date=date(2020, 6, 15), end_date=date(2020, 6, 18),
+                                      half_day=False, reason=1, request_accepted=True)
+        timesheet = SimplifiedTimesheet.objects.create(employee=employee, time_sheet_year=2020, time_sheet_month=6,
+                                                       user=user)
+        # public holiday, Sunday and week day
+        for day, start, end in ((1, 8, 12), (7, 8, 10), (10, 8, 16)):
+            SimplifiedTimesheetDetail.objects.create(start_date=datetime(2020, 6, day, start).astimezone(),
+                                                     end_date=time(end), simplified_timesheet=timesheet)
+
+        return timesheet
+
+    def test_totals(self):
+        timesheet = SimplifiedTimesheet.objects.get(pk=self.timesheets[0].pk)
+        absence_hours = how_many_hours_taken_in_period(
+            {'start_date': timesheet.get_start_date, 'end_date': timesheet.get_end_date, 'user_id': timesheet.user.id},
+            PublicHolidayCalendarDetail.objects.filter(calendar_date__lte=timesheet.get_end_date,
+                                                       calendar_date__gte=timesheet.get_start_date))
+
+        self.assertEqual(timesheet.total_hours, '14 h:0 mn')
+        self.assertEqual(timesheet.total_hours_sundays, timedelta(hours=2))
+        self.assertEqual(timesheet.total_hours_public_holidays, timedelta(hours=4))
+        self.assertEqual(timesheet.total_working_days, 20)
+        self.assertEqual(timesheet.total_working_days, timesheet.date_range(timesheet.get_start_date,
+                                                                            timesheet.get_end_date))
+        self.assertEqual(timesheet.total_hours_holidays_taken, absence_hours)
+        self.assertEqual(timesheet.absence_hours_taken(), absence_hours)
+        balance = 14 * 3600 + (absence_hours[0] - 20 * 6) * 3600
+        self.assertEqual(timesheet.hours_should_work, "%d h:%d mn" % (balance // 3600, (balance % 3600) // 60))
+
+    def test_month_queries_do_not_grow_with_employees(self):
+        with self.assertNumQueries(6):
+            totals = TimesheetMonth(2020, 6).all_totals()
+        self.assertEqual([totals[t.id]['total'] for t in self.timesheets], [timedelta(hours=14)] * 2)
+
+        self.timesheets.extend(self.create_timesheet(i) for i in range(2, 5))
+        with self.assertNumQueries(6):
+            TimesheetMonth(2020, 6).all_totals()
+
+        output = StringIO()
+        call_command('timesheet_totals', '--year', '2020', '--month', '6', stdout=output)
+        self.assertEqual(len(output.getvalue().splitlines()), 5)
+        self.assertIn('testuser0: 14 h:0 mn worked, 2 h:0 mn on Sundays, 4 h:0 mn on public holidays',
+                      output.getvalue())
+
+    def test_cached_totals_follow_changes(self):
+        timesheet, other = self.timesheets
+        self.assertEqual(timesheet.total_hours, '14 h:0 mn')
+        with self.assertNumQueries(0):
+            self.assertEqual(timesheet.total_hours, '14 h:0 mn')
+        other_key = timesheet_totals_key(other)
+
+        detail = SimplifiedTimesheetDetail.objects.create(start_date=datetime(2020, 6, 11, 8).astimezone(),
+                                                          end_date=time(9), simplified_timesheet=timesheet)
+        self.assertEqual(timesheet.total_hours, '15 h:0 mn')
+        detail.delete()
+        self.assertEqual(timesheet.total_hours, '14 h:0 mn')
+        self.assertEqual(timesheet_totals_key(other), other_key)
+
+        PublicHolidayCalendarDetail.objects.create(calendar_date=date(2020, 6, 10),
+                                                   calendar_link=PublicHolidayCalendar.objects.get())
+        self.assertEqual(timesheet.total_hours_public_holidays, timedelta(hours=12))
+        self.assertEqual(other.total_working_days, 19)
+
+        holidays_taken = timesheet.total_hours_holidays_taken
+        HolidayRequest.objects.filter(employee=timesheet.user).get().delete()
+        self.assertNotEqual(timesheet.total_hours_holidays_taken, holidays_taken)
+        self.assertEqual(other.total_hours_holidays_taken, holidays_taken)
+
+        hours_should_work = timesheet.hours_should_work
+        contract_detail = timesheet.employee.employeecontractdetail_set.get(start_date=date(2018, 1, 1))
+        contract_detail.number_of_hours = 20
+        contract_detail.save()
+        self.assertNotEqual(timesheet.hours_should_work, hours_should_work)
+
+
+class HolidayRequestHoursTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', email='testuser@test.com', password='testing')
+        employee = Employee.objects.create(user=self.user, start_contract=date(2018, 1, 1),
+                                           occupation=JobPosition.objects.create(name='name 0'))
+        EmployeeContractDetail.objects.create(start_date=date(2018, 1, 1), number_of_hours=30, employee_link=employee)
+
+    def create_request(self, start_date, end_date, reason=1):
+        return HolidayRequest.objects.create(employee=self.user, start_date=start_date, end_date=end_date,
+                                             half_day=False, reason=reason, request_accepted=True)
+
+    def test_hours_taken(self):
+        # Friday to Wednesday, with the national day on Tuesday
+        holiday_request = self.create_request(date(2020, 6, 19), date(2020, 6, 24))
+        self.assertEqual(holiday_request.hours_taken,
+                         [18, "explication: ( 4 jours congés - 1 jours fériés )  x 6 nombre h. /j"])
+        self.assertEqual(self.create_request(date(2020, 7, 1), date(2020, 7, 2), reason=2).hours_taken,
+                         "Non applicable")
+        self.assertIs(luxembourg_holidays(2020), luxembourg_holidays(2020))
+
+        self.create_request(date(2020, 8, 3), date(2020, 8, 7))
+        with self.assertNumQueries(1):
+            hours = [r.hours_taken for r in with_contract_hours(HolidayRequest.objects.order_by('start_date'))]
+        self.assertEqual(hours[0], holiday_request.hours_taken)
+        self.assertEqual(hours[2][0], 30)
+
+    def test_leave_report(self):
+        self.create_request(date(2020, 6, 19), date(2020, 6, 24))
+        self.create_request(date(2020, 12, 28), date(2021, 1, 5))
+
+        output = StringIO()
+        call_command('leave_report', '--year', '2020', stdout=output)
+        self.assertEqual(output.getvalue(), 'testuser: 2 requests, 8 days - 1 public holidays, 42.0 h\n')
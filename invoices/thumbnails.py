@@ -0,0 +1,79 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from invoices.storages import ThumbnailStorage
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FOLDER = 'medical-prescription'
+
+thumbnail_storage = ThumbnailStorage()
+
+
+def get_thumbnail_storage():
+    return thumbnail_storage
+
+
+def make_thumbnail(data, size=None):
+    size = size or settings.THUMBNAIL_SIZE
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    image.thumbnail((size, size), Image.LANCZOS)
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=80, optimize=True)
+
+    return output.getvalue()
+
+
+def thumbnail_name(data):
+    # named after the scan content so that the served previews can be cached forever
+    return '%s/%s.jpg' % (THUMBNAIL_FOLDER, hashlib.sha1(data).hexdigest()[:20])
+
+
+def store_thumbnail(data):
+    """Stores the preview of the scan data, returns its name or '' when the scan is not an image Pillow reads."""
+    name = thumbnail_name(data)
+    if not thumbnail_storage.exists(name):
+        try:
+            thumbnail = make_thumbnail(data)
+        except (IOError, ValueError, Image.DecompressionBombError):
+            logger.exception('Cannot render the preview of %s' % name)
+            return ''
+        thumbnail_storage.save(name, ContentFile(thumbnail))
+
+    return name
+
+
+def read_file(field_file):
+    field_file.open('rb')
+    try:
+        field_file.seek(0)
+        return field_file.read()
+    finally:
+        field_file.seek(0)
+
+
+def generate_thumbnail(prescription):
+    """
+    Renders the preview of a prescription scan already stored, downloading it from its storage, and saves the
+    preview name on the prescription.
+    """
+    name = store_thumbnail(read_file(prescription.file)) if prescription.file.name else ''
+    type(prescription).objects.filter(pk=prescription.pk).update(thumbnail=name)
+    prescription.thumbnail = name
+
+    return name
+
+
+def delete_thumbnail(name, exclude_pk=None):
+    from invoices.models import MedicalPrescription
+
+    # identical scans share their preview
+    if name and not MedicalPrescription.objects.filter(thumbnail=name).exclude(pk=exclude_pk).exists():
+        thumbnail_storage.delete(name)
@@ -3,18 +3,20 @@ import calendar
 from datetime import date, datetime, timedelta
 from typing import Any, Union
 
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator
 from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django_currentuser.db.models import CurrentUserField
 
-from helpers.holidays import how_many_hours_taken_in_period
 from invoices.employee import Employee
+from invoices.overlaps import overlapping_dates
+from invoices.timesheet_cache import cached_timesheet_totals, invalidate_timesheet_totals, month_scope, \
+    previous_value, TIMESHEET
+from invoices.timesheet_totals import TimesheetMonth, timesheet_totals
+from invoices.working_calendar import month_working_days
 
 
 class Timesheet(models.Model):
@@ -151,39 +153,11 @@ class SimplifiedTimesheet(models.Model):
 
     def __calculate_total_hours(self):
         if self.id:
-            calculated_hours = cache.get('total_hours_dictionary%s' % self.id)
-            if calculated_hours is not None:
-                return calculated_hours
-        calculated_hours = {"total": 0,
-                            "total_sundays": 0,
-                            "total_public_holidays": 0,
-                            "total_hours_holidays_taken": [0, ""]}
-        total = timezone.timedelta(0)
-        total_sundays = timezone.timedelta(0)
-        total_public_holidays = timezone.timedelta(0)
-        for v in self.simplifiedtimesheetdetail_set.all():
-            delta = datetime.combine(timezone.now(), v.end_date) - \
-                    datetime.combine(timezone.now(), v.start_date.astimezone().time().replace(tzinfo=None))
-            total = total + delta
-            if v.start_date.astimezone().weekday() == 6:
-                total_sundays = total_sundays + delta
-            if PublicHolidayCalendarDetail.objects.filter(
-                    calendar_date__exact=v.start_date.astimezone()).first() is not None:
-                total_public_holidays = total_public_holidays + delta
-        calculated_hours["total_hours_holidays_taken"] = self.absence_hours_taken()
-        calculated_hours["total"] = total
-        calculated_hours["total_sundays"] = total_sundays
-        calculated_hours["total_public_holidays"] = total_public_holidays
-        if self.id:
-            cache.set('total_hours_dictionary%s' % self.id, calculated_hours)
-        return calculated_hours
+            return cached_timesheet_totals(self, lambda: timesheet_totals(self))
+        return timesheet_totals(self)
 
     def absence_hours_taken(self):
-        data = {'start_date': self.get_start_date, 'end_date': self.get_end_date, 'user_id': self.user.id}
-        return how_many_hours_taken_in_period(data,
-                                              PublicHolidayCalendarDetail.objects.filter(
-                                                  calendar_date__lte=data['end_date'],
-                                                  calendar_date__gte=data['start_date']))
+        return TimesheetMonth(self.time_sheet_year, self.time_sheet_month, [self]).absence_hours_taken(self)
 
     @property
     def total_hours_holidays_taken(self):
@@ -191,34 +165,21 @@ class SimplifiedTimesheet(models.Model):
 
     @property
     def hours_should_work(self):
-        if self.id:
-            calculated_hours = cache.get('total_hours_dictionary%s' % self.id)
-            if calculated_hours is None:
-                calculated_hours = self.__calculate_total_hours()
-        total_legal_working_hours = self.date_range(self.get_start_date, self.get_end_date) * \
-                                    (self.employee.employeecontractdetail_set.filter(
-                                        start_date__lte=self.get_start_date).first().number_of_hours / 5)
-        balance: Union[float, Any] = calculated_hours["total"].total_seconds() + \
-                                     (calculated_hours["total_hours_holidays_taken"][0] - total_legal_working_hours) * 3600
+        balance: Union[float, Any] = self.__calculate_total_hours()["balance"]
+        if balance is None:
+            return None
         return "%d h:%d mn" % (balance // 3600, (balance % 3600) // 60)
 
     @staticmethod
     def date_range(start_date, end_date):
         if not start_date and not end_date:
             return
-        days = 0
-        for i in range(0, calendar.monthrange(start_date.year, start_date.month)[1]):
-            next_date = start_date + timedelta(i)
-            if next_date.weekday() not in (5, 6):
-                days = days + 1
-        for i in PublicHolidayCalendarDetail.objects.filter(calendar_date__lte=end_date, calendar_date__gte=start_date):
-            if i.calendar_date.weekday() not in (5, 6):
-                days = days - 1
-        return days
+        return month_working_days(start_date, PublicHolidayCalendarDetail.objects.filter(
+            calendar_date__lte=end_date, calendar_date__gte=start_date).values_list('calendar_date', flat=True))
 
     @property
     def total_working_days(self):
-        return self.date_range(self.get_start_date, self.get_end_date)
+        return self.__calculate_total_hours()["working_days"]
 
     @property
     def total_hours(self):
@@ -389,14 +350,9 @@ class PublicHolidayCalendarDetail(models.Model):
 def validate_date_range_vs_holiday_requests(data, employee_id):
     msgs = {}
     from invoices.holidays import HolidayRequest
-    end_date_time = data['start_date']
-    end_date_time.replace(hour=data['end_date'].hour, minute=data['end_date'].minute)
-    conflicts = HolidayRequest.objects.filter(
-        Q(start_date__range=(data['start_date'], end_date_time)) |
-        Q(end_date__range=(data['start_date'], end_date_time)) |
-        Q(start_date__lte=data['start_date'], end_date__gte=data['start_date']) |
-        Q(start_date__lte=end_date_time, end_date__gte=end_date_time)
-    ).filter(employee_id=employee_id, request_accepted=True)
+    # the details are entered on their start day
+    conflicts = overlapping_dates(HolidayRequest.objects.filter(employee_id=employee_id, request_accepted=True),
+                                  'start_date', 'end_date', data['start_date'], data['start_date'])
     if 1 == conflicts.count():
         msgs = {'start_date': u"Intersection avec des demandes d'absence de : %s à %s" % (conflicts[0].start_date,
                                                                                           conflicts[0].end_date)}
@@ -407,6 +363,29 @@ def validate_date_range_vs_holiday_requests(data, employee_id):
     return msgs
 
 
-@receiver(post_save, sender=SimplifiedTimesheet, dispatch_uid="notify_timesheet_refresh_cache")
-def notify_timesheet_refresh_cache(sender, instance, created, **kwargs):
-    cache.clear()
+@receiver([post_save, post_delete], sender=SimplifiedTimesheet, dispatch_uid="notify_timesheet_refresh_cache")
+def notify_timesheet_refresh_cache(sender, instance, **kwargs):
+    invalidate_timesheet_totals((TIMESHEET, instance.id))
+
+
+@receiver(pre_save, sender=SimplifiedTimesheetDetail, dispatch_uid="timesheet_detail_remember_timesheet")
+def timesheet_detail_remember_timesheet(sender, instance, **kwargs):
+    instance._previous_timesheet_id = previous_value(instance, 'simplified_timesheet_id')
+
+
+@receiver([post_save, post_delete], sender=SimplifiedTimesheetDetail,
+          dispatch_uid="timesheet_detail_refresh_cache")
+def timesheet_detail_refresh_cache(sender, instance, **kwargs):
+    invalidate_timesheet_totals((TIMESHEET, instance.simplified_timesheet_id),
+                                (TIMESHEET, getattr(instance, '_previous_timesheet_id', None)))
+
+
+@receiver(pre_save, sender=PublicHolidayCalendarDetail, dispatch_uid="public_holiday_remember_date")
+def public_holiday_remember_date(sender, instance, **kwargs):
+    instance._previous_calendar_date = previous_value(instance, 'calendar_date')
+
+
+@receiver([post_save, post_delete], sender=PublicHolidayCalendarDetail, dispatch_uid="public_holiday_refresh_cache")
+def public_holiday_refresh_cache(sender, instance, **kwargs):
+    invalidate_timesheet_totals(month_scope(instance.calendar_date),
+                                month_scope(getattr(instance, '_previous_calendar_date', None)))
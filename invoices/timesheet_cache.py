@@ -0,0 +1,57 @@
+from django.core.cache import cache
+
+from invoices.cache_versions import versions, bump_version
+
+# the cached totals of a simplified timesheet are keyed by the versions of everything they are computed from: the
+# timesheet and its detail rows, the holiday requests of its user, the contract details of its employee and the
+# public holidays of its month. A change bumps the version of its scope only, the totals of the other timesheets
+# stay cached and the stale ones are never read again.
+TIMESHEET = 'timesheet'
+USER = 'user'
+EMPLOYEE = 'employee'
+MONTH = 'month'
+
+
+def _version_key(scope, value):
+    return 'timesheet-totals-version:%s:%s' % (scope, value)
+
+
+def timesheet_scopes(timesheet):
+    return [(TIMESHEET, timesheet.id), (USER, timesheet.user_id), (EMPLOYEE, timesheet.employee_id),
+            (MONTH, '%s-%s' % (timesheet.time_sheet_year, timesheet.time_sheet_month))]
+
+
+def timesheet_totals_key(timesheet):
+    scope_versions = versions([_version_key(scope, value) for scope, value in timesheet_scopes(timesheet)])
+    return 'timesheet-totals:%s:%s' % (timesheet.id, ':'.join(str(version) for version in scope_versions))
+
+
+def cached_timesheet_totals(timesheet, compute):
+    """The totals of the saved timesheet from the cache, compute() builds them when one of their versions changed."""
+    key = timesheet_totals_key(timesheet)
+    totals = cache.get(key)
+    if totals is None:
+        totals = compute()
+        cache.set(key, totals)
+
+    return totals
+
+
+def invalidate_timesheet_totals(*scopes):
+    """Bumps the versions of the (scope, value) pairs, values None are skipped."""
+    for scope, value in set(scopes):
+        if value is None:
+            continue
+        bump_version(_version_key(scope, value))
+
+
+def month_scope(day):
+    return MONTH, ('%s-%s' % (day.year, day.month) if day is not None else None)
+
+
+def previous_value(instance, field):
+    """The value of field stored for instance, read in pre_save, None for new instances."""
+    if instance.pk is None:
+        return None
+
+    return type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
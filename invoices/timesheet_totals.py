@@ -0,0 +1,106 @@
+import calendar
+from datetime import datetime, timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from helpers.holidays import hours_taken_in_requests
+from invoices.working_calendar import month_working_days
+
+
+class TimesheetMonth:
+    """
+    Computes the totals of the simplified timesheets of one month from the public holidays, contract details,
+    accepted holiday requests and detail rows of all the timesheets, each read in a single query.
+    """
+
+    def __init__(self, year, month, timesheets=None):
+        from invoices.employee import Employee, EmployeeContractDetail
+        from invoices.holidays import HolidayRequest
+        from invoices.timesheet import PublicHolidayCalendarDetail, SimplifiedTimesheet, SimplifiedTimesheetDetail
+
+        self.start_date = datetime(year, month, 1)
+        self.end_date = datetime(year, month, calendar.monthrange(year, month)[1])
+        if timesheets is None:
+            timesheets = SimplifiedTimesheet.objects.filter(time_sheet_year=year, time_sheet_month=month) \
+                .select_related('employee__user')
+        self.timesheets = list(timesheets)
+        timesheet_ids = [t.id for t in self.timesheets if t.id]
+        user_ids = set(t.user_id for t in self.timesheets)
+
+        self.public_holidays = set(PublicHolidayCalendarDetail.objects.filter(
+            calendar_date__lte=self.end_date, calendar_date__gte=self.start_date).values_list('calendar_date',
+                                                                                             flat=True))
+        self.details = dict((timesheet_id, []) for timesheet_id in timesheet_ids)
+        for start_date, end_date, timesheet_id in SimplifiedTimesheetDetail.objects.filter(
+                simplified_timesheet_id__in=timesheet_ids).order_by('id') \
+                .values_list('start_date', 'end_date', 'simplified_timesheet_id'):
+            self.details[timesheet_id].append((start_date, end_date))
+        self.holiday_requests = dict((user_id, []) for user_id in user_ids)
+        for start_date, end_date, user_id in HolidayRequest.objects.filter(
+                Q(start_date__range=(self.start_date, self.end_date)) |
+                Q(end_date__range=(self.start_date, self.end_date)) |
+                Q(start_date__lte=self.start_date, end_date__gte=self.start_date) |
+                Q(start_date__lte=self.end_date, end_date__gte=self.end_date)
+        ).filter(employee_id__in=user_ids, request_accepted=True, reason__range=(1, 2)).order_by('id') \
+                .values_list('start_date', 'end_date', 'employee_id'):
+            self.holiday_requests[user_id].append((start_date, end_date))
+        self.employee_ids = dict(Employee.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+        # the first contract detail started by the month, as employeecontractdetail_set.first() returns it
+        self.contract_hours = {}
+        for employee_id, number_of_hours in EmployeeContractDetail.objects.filter(
+                Q(employee_link_id__in=set(t.employee_id for t in self.timesheets)) |
+                Q(employee_link_id__in=self.employee_ids.values()), start_date__lte=self.start_date) \
+                .order_by('-id').values_list('employee_link_id', 'number_of_hours'):
+            self.contract_hours[employee_id] = number_of_hours
+
+    def daily_hours(self, employee_id):
+        return self.contract_hours[employee_id] / 5
+
+    def absence_hours_taken(self, timesheet):
+        requests = self.holiday_requests.get(timesheet.user_id)
+        if not requests:
+            return [0, ""]
+
+        return hours_taken_in_requests(requests, self.public_holidays,
+                                       self.daily_hours(self.employee_ids[timesheet.user_id]))
+
+    def totals(self, timesheet):
+        """
+        The worked, Sunday and public holiday hours as timedeltas, the absence hours with their explanation, the
+        working days of the month and the balance in seconds against the contract hours.
+        """
+        now = timezone.now()
+        default_timezone = timezone.get_default_timezone()
+        total = timedelta(0)
+        total_sundays = timedelta(0)
+        total_public_holidays = timedelta(0)
+        for start_date, end_date in self.details.get(timesheet.id, ()):
+            local_start_date = start_date.astimezone()
+            delta = datetime.combine(now, end_date) - \
+                datetime.combine(now, local_start_date.time().replace(tzinfo=None))
+            total = total + delta
+            if local_start_date.weekday() == 6:
+                total_sundays = total_sundays + delta
+            if timezone.make_naive(local_start_date, default_timezone).date() in self.public_holidays:
+                total_public_holidays = total_public_holidays + delta
+        absence_hours = self.absence_hours_taken(timesheet)
+        days = month_working_days(self.start_date, self.public_holidays)
+        contract_hours = self.contract_hours.get(timesheet.employee_id)
+        balance = None
+        if contract_hours is not None:
+            balance = total.total_seconds() + (absence_hours[0] - days * (contract_hours / 5)) * 3600
+
+        return {"total": total,
+                "total_sundays": total_sundays,
+                "total_public_holidays": total_public_holidays,
+                "total_hours_holidays_taken": absence_hours,
+                "working_days": days,
+                "balance": balance}
+
+    def all_totals(self):
+        return dict((timesheet.id, self.totals(timesheet)) for timesheet in self.timesheets)
+
+
+def timesheet_totals(timesheet):
+    return TimesheetMonth(timesheet.time_sheet_year, timesheet.time_sheet_month, [timesheet]).totals(timesheet)
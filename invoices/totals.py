@@ -0,0 +1,131 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Sum
+
+TOTAL_FIELDS = ('total_gross', 'total_net', 'total_participation')
+ZERO_TOTALS = (Decimal('0.00'), Decimal('0.00'), Decimal('0.00'))
+TWO_PLACES = Decimal('0.01')
+
+
+def update_fields_without_totals(instance, update_fields):
+    """
+    The fields save() writes: the stored totals are left out of updates, an instance loaded before they were
+    refreshed would put the old totals back otherwise.
+    """
+    if update_fields is not None or instance._state.adding:
+        return update_fields
+
+    return [field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in TOTAL_FIELDS]
+
+
+def prestation_amounts(prestation, private_patient, participation_statutaire):
+    """
+    Gross, net and personal participation of a prestation, as the private invoice PDFs print them.
+    """
+    carecode = prestation.carecode
+    gross_amount = Decimal(carecode.gross_amount(prestation.date))
+    net_amount = Decimal(carecode.net_amount(prestation.date, private_patient, participation_statutaire))
+    quantity = prestation.quantity
+
+    return gross_amount * quantity, net_amount * quantity, (gross_amount - net_amount) * quantity
+
+
+def compute_invoice_totals(invoice_item_ids):
+    """
+    Totals of the invoice items computed from their prestations, loaded with a single query.
+    """
+    from invoices.models import Prestation
+
+    totals = defaultdict(lambda: ZERO_TOTALS)
+    patients = {}
+    for prestation in Prestation.objects.filter(invoice_item__in=invoice_item_ids).order_by() \
+            .select_related('carecode', 'invoice_item__patient'):
+        patient = prestation.invoice_item.patient
+        if patient.id not in patients:
+            # the age of today, as the PDFs print it: the totals are rebuilt every night by clock.py to follow the
+            # patients turning 19
+            patients[patient.id] = (patient.is_private,
+                                    patient.participation_statutaire and (patient.age or 0) > 18)
+        amounts = prestation_amounts(prestation, *patients[patient.id])
+        totals[prestation.invoice_item_id] = tuple(total + amount for total, amount in
+                                                   zip(totals[prestation.invoice_item_id], amounts))
+
+    return dict((invoice_item_id, tuple(Decimal(total).quantize(TWO_PLACES) for total in totals[invoice_item_id]))
+                for invoice_item_id in invoice_item_ids)
+
+
+def _stored_totals(instance):
+    return tuple(getattr(instance, field) for field in TOTAL_FIELDS)
+
+
+def refresh_invoice_totals(invoice_item_ids, verify=False):
+    """
+    Recomputes the totals of the invoice items and of their batches. Only the rows whose totals differ are
+    written; with verify nothing is written. Returns the (invoice item id, stored, computed) of these rows.
+    """
+    from invoices.models import InvoiceItem
+
+    invoice_item_ids = set(pk for pk in invoice_item_ids if pk is not None)
+    if not invoice_item_ids:
+        return []
+
+    totals = compute_invoice_totals(invoice_item_ids)
+    changed = []
+    mismatches = []
+    invoice_items = InvoiceItem.objects.filter(pk__in=invoice_item_ids).order_by().only('id', 'batch_id', *TOTAL_FIELDS)
+    for invoice_item in invoice_items:
+        stored = _stored_totals(invoice_item)
+        if stored != totals[invoice_item.id]:
+            mismatches.append((invoice_item.id, stored, totals[invoice_item.id]))
+            for field, total in zip(TOTAL_FIELDS, totals[invoice_item.id]):
+                setattr(invoice_item, field, total)
+            changed.append(invoice_item)
+
+    if changed and not verify:
+        InvoiceItem.objects.bulk_update(changed, TOTAL_FIELDS)
+        refresh_batch_totals(set(invoice_item.batch_id for invoice_item in changed))
+
+    return mismatches
+
+
+def refresh_batch_totals(batch_ids, verify=False):
+    """
+    Batch totals are the sums of the totals of their invoice items, aggregated by the database.
+    """
+    from invoices.models import InvoiceItem, InvoiceItemBatch
+
+    batch_ids = set(pk for pk in batch_ids if pk is not None)
+    if not batch_ids:
+        return []
+
+    sums = dict((row['batch_id'], tuple(row[field] or Decimal('0.00') for field in TOTAL_FIELDS))
+                for row in InvoiceItem.objects.filter(batch__in=batch_ids).order_by().values('batch_id')
+                .annotate(**dict((field, Sum(field)) for field in TOTAL_FIELDS)))
+    mismatches = []
+    # values: InvoiceItemBatch.__init__ reads the file, deferred fields would be loaded one by one
+    for batch_id, *stored in InvoiceItemBatch.objects.filter(pk__in=batch_ids).order_by() \
+            .values_list('id', *TOTAL_FIELDS):
+        computed = sums.get(batch_id, ZERO_TOTALS)
+        if tuple(stored) != computed:
+            mismatches.append((batch_id, tuple(stored), computed))
+            if not verify:
+                # update() keeps the batch save hooks (file renaming, PDF generation) out of the way
+                InvoiceItemBatch.objects.filter(pk=batch_id).update(**dict(zip(TOTAL_FIELDS, computed)))
+
+    return mismatches
+
+
+def invoice_item_ids_for_care_codes(care_code_ids, start_date=None, end_date=None):
+    from invoices.models import Prestation
+
+    # a day of margin: the tariffs are looked up with the UTC date of the prestations
+    prestations = Prestation.objects.filter(carecode__in=care_code_ids)
+    if start_date is not None:
+        prestations = prestations.filter(date__date__gte=start_date - timedelta(days=1))
+    if end_date is not None:
+        prestations = prestations.filter(date__date__lte=end_date + timedelta(days=1))
+
+    return set(prestations.order_by().values_list('invoice_item_id', flat=True).distinct())
@@ -7,7 +7,8 @@ from django.conf import settings
 from django.urls import path
 
 from api.views import EventProcessorView
-from invoices.views import delete_prestation, MedicalPrescriptionAutocomplete
+from invoices.views import delete_prestation, MedicalPrescriptionAutocomplete, serve_thumbnail, \
+    medical_prescription_thumbnail
 
 admin.autodiscover()
 
@@ -37,6 +38,8 @@ urlpatterns = [
         delete_prestation,
         name='delete-prestation',
     ),
+    path('admin/medical-prescription/<int:prescription_id>/thumbnail/', medical_prescription_thumbnail,
+         name='medical-prescription-thumbnail'),
     path('admin/', admin.site.urls),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     url(r'^api-token-auth/', authtoken_views.obtain_auth_token),
@@ -51,6 +54,7 @@ urlpatterns += [
     url(r'^media/(?P<path>.*)$', serve, {
         'document_root': settings.MEDIA_ROOT,
     }),
+    url(r'^%s(?P<path>.*)$' % settings.THUMBNAIL_URL.lstrip('/'), serve_thumbnail, name='thumbnail'),
 ]
 # if settings.DEBUG:
 #     import debug_toolbar
@@ -7,8 +7,14 @@ __author__ = 'mehdi'
 #
 # from contextlib import contextmanager
 
+import calendar
 from calendar import HTMLCalendar
-from invoices.events import Event
+from collections import defaultdict
+from datetime import date
+
+from django.core.cache import cache
+
+from invoices.events import Event, event_calendar_key
 
 
 # LOCALE_LOCK = threading.Lock()
@@ -33,9 +39,8 @@ class EventCalendar(HTMLCalendar):
         """
         Return a day as a table cell.
         """
-        events_from_day = events.filter(day__day=day)
         events_html = '<ul>'
-        for event in events_from_day:
+        for event in events.get(day, ()):
             events_html += event.get_absolute_url() + '<br>'
         events_html += "</ul>"
         if day == 0:
@@ -52,10 +57,30 @@ class EventCalendar(HTMLCalendar):
 
     def formatmonth(self, theyear, themonth, withyear=True):
         """
-        Return a formatted month as a table.
+        Return a formatted month as a table, kept in the cache shared by the processes until one of its events
+        changes.
         """
+        key = event_calendar_key(theyear, themonth, withyear, self.events)
+        html = cache.get(key)
+        if html is None:
+            html = self._formatmonth(theyear, themonth, withyear)
+            cache.set(key, html)
+
+        return html
+
+    def month_events(self, theyear, themonth):
+        """The events of the month by day of the month, loaded with a single query."""
+        events = self.events if self.events is not None else Event.objects.all()
+        events_by_day = defaultdict(list)
+        for event in events.filter(day__range=(date(theyear, themonth, 1),
+                                               date(theyear, themonth, calendar.monthrange(theyear, themonth)[1]))) \
+                .select_related('patient', 'employees__user', 'event_type').order_by('time_start_event', 'id'):
+            events_by_day[event.day.day].append(event)
+
+        return events_by_day
 
-        events = Event.objects.filter(day__month=themonth).order_by('-day').order_by('time_start_event')
+    def _formatmonth(self, theyear, themonth, withyear):
+        events = self.month_events(theyear, themonth)
 
         v = []
         a = v.append
@@ -0,0 +1,132 @@
+import datetime
+from collections import defaultdict
+
+from constance import config
+from django.conf import settings
+from django.utils import timezone
+
+
+def _as_date(value):
+    # what DateField lookups do with the datetime of a Prestation
+    if isinstance(value, datetime.datetime):
+        if settings.USE_TZ and timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.get_default_timezone())
+        return value.date()
+
+    return value
+
+
+def _get_object(data, name, objects):
+    if name in data:
+        return data[name]
+
+    return objects.get(data.get('%s_id' % name))
+
+
+def validate_prestations(rows):
+    """
+    Prestation.validate for many rows at once: rows are (instance_id, data) pairs with the data Prestation.validate
+    expects. The invoice items, patients, hospitalizations, exclusive care codes, existing prestations and employees
+    are loaded once for all the rows, which are then checked in memory. Returns the messages of each row, in order.
+    """
+    from invoices.employee import Employee
+    from invoices.models import CareCode, Hospitalization, InvoiceItem, Patient, Prestation
+
+    rows = list(rows)
+    invoice_items = InvoiceItem.objects.in_bulk(set(data['invoice_item_id'] for instance_id, data in rows
+                                                    if 'invoice_item' not in data and 'invoice_item_id' in data))
+    for instance_id, data in rows:
+        if data.get('invoice_item') is not None:
+            invoice_items.setdefault(data['invoice_item'].id, data['invoice_item'])
+
+    patients = Patient.objects.in_bulk(set(invoice_item.patient_id for invoice_item in invoice_items.values()
+                                           if not InvoiceItem.patient.is_cached(invoice_item)))
+    for invoice_item in invoice_items.values():
+        if InvoiceItem.patient.is_cached(invoice_item):
+            patients.setdefault(invoice_item.patient_id, invoice_item.patient)
+    for instance_id, data in rows:
+        if data.get('patient') is not None:
+            patients.setdefault(data['patient'].id, data['patient'])
+
+    hospitalizations = defaultdict(list)
+    for hospitalization in Hospitalization.objects.filter(patient__in=[pk for pk in patients if pk is not None]):
+        hospitalizations[hospitalization.patient_id].append(hospitalization)
+
+    carecodes = CareCode.objects.in_bulk(set(data['carecode_id'] for instance_id, data in rows
+                                             if 'carecode' not in data and 'carecode_id' in data))
+    for instance_id, data in rows:
+        if data.get('carecode') is not None:
+            carecodes.setdefault(data['carecode'].id, data['carecode'])
+
+    exclusive_care_codes = defaultdict(set)
+    for from_id, to_id in CareCode.exclusive_care_codes.through.objects.filter(
+            from_carecode__in=list(carecodes)).values_list('from_carecode_id', 'to_carecode_id'):
+        exclusive_care_codes[from_id].add(to_id)
+
+    existing_prestations = defaultdict(list)
+    saved_invoice_item_ids = [pk for pk in invoice_items if pk is not None]
+    for prestation in Prestation.objects.filter(invoice_item__in=saved_invoice_item_ids).select_related('carecode'):
+        existing_prestations[prestation.invoice_item_id].append(prestation)
+
+    employee_ids = set(Employee.objects.filter(
+        pk__in=set(data['employee_id'] for instance_id, data in rows
+                   if 'employee' not in data and data.get('employee_id') is not None)).values_list('pk', flat=True))
+
+    at_home_care_code, at_home_care_code_exists = None, False
+    if any(data.get('at_home') for instance_id, data in rows):
+        at_home_care_code = config.AT_HOME_CARE_CODE
+        at_home_care_code_exists = CareCode.objects.filter(code=at_home_care_code).exists()
+
+    results = []
+    for instance_id, data in rows:
+        result = {}
+        invoice_item = _get_object(data, 'invoice_item', invoice_items)
+        if invoice_item is None:
+            results.append({'invoice_item_id': 'Please fill InvoiceItem field'})
+            continue
+        patient = data['patient'] if 'patient' in data else patients.get(invoice_item.patient_id)
+        prestations = existing_prestations[invoice_item.id]
+
+        date = _as_date(data['date'])
+        if date is not None and any(h.start_date <= date <= h.end_date for h in hospitalizations[patient.id]):
+            result['date'] = 'Patient has hospitalization records for the chosen date'
+
+        if data.get('at_home') and not at_home_care_code_exists:
+            result['at_home'] = "CareCode %s does not exist. Please create a CareCode with the Code %s" % (
+                at_home_care_code, at_home_care_code)
+
+        carecode = _get_object(data, 'carecode', carecodes)
+        if carecode is None:
+            result['carecode_id'] = 'Please fill CareCode field'
+        else:
+            conflicting_ids = exclusive_care_codes[carecode.id] | {carecode.id}
+            conflicting_codes = [prestation.carecode.code for prestation in prestations
+                                 if prestation.carecode_id in conflicting_ids and prestation.date == data['date']
+                                 and prestation.pk != instance_id]
+            if conflicting_codes:
+                result['carecode'] = "CareCode %s cannot be applied because CareCode(s) %s has been applied " \
+                                     "already" % (carecode.code, ", ".join(conflicting_codes))
+
+        if patient.date_of_death is not None and data['date'] is not None \
+                and data['date'].date() >= patient.date_of_death:
+            result['date'] = "Prestation date cannot be later than or equal to Patient's death date"
+
+        expected_count = len(prestations)
+        adds_new = False
+        if data.get('at_home') and not any(prestation.carecode.code == at_home_care_code
+                                           for prestation in prestations):
+            expected_count += 1
+            adds_new = True
+        if data.get('id') is None:
+            expected_count += 1
+            adds_new = True
+        if adds_new and expected_count > InvoiceItem.PRESTATION_LIMIT_MAX:
+            result['date'] = "Max number of Prestations for one InvoiceItem is %s" % (
+                str(InvoiceItem.PRESTATION_LIMIT_MAX))
+
+        if 'employee' not in data and data.get('employee_id') not in employee_ids:
+            result['employee'] = 'Please fill Employee field'
+
+        results.append(result)
+
+    return results
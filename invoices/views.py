@@ -1,8 +1,14 @@
 from dal import autocomplete
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Q
 from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_POST, require_GET
+from django.views.static import serve
 from invoices.models import CareCode, Prestation, Patient, MedicalPrescription
+from invoices.thumbnails import thumbnail_storage, generate_thumbnail
 
 
 def get_queryset_filter(query_str, fields):
@@ -90,3 +96,25 @@ def delete_prestation(request):
 
     return JsonResponse({'status': 'Success'})
 
+
+@require_GET
+@staff_member_required
+@cache_control(private=True, max_age=settings.THUMBNAIL_MAX_AGE)
+def serve_thumbnail(request, path):
+    if not thumbnail_storage.exists(path):
+        # the local disk does not outlive the dyno, render it again from the scan
+        prescription = MedicalPrescription.objects.filter(thumbnail=path).first()
+        if prescription is None or generate_thumbnail(prescription) != path:
+            raise Http404
+
+    return serve(request, path, document_root=thumbnail_storage.location)
+
+
+@require_GET
+@staff_member_required
+def medical_prescription_thumbnail(request, prescription_id):
+    prescription = get_object_or_404(MedicalPrescription, pk=prescription_id)
+    if not prescription.thumbnail and not generate_thumbnail(prescription):
+        raise Http404
+
+    return redirect(prescription.thumbnail.url)
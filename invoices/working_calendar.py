@@ -0,0 +1,80 @@
+import threading
+
+import holidays
+import numpy as np
+
+_lock = threading.Lock()
+_luxembourg_holidays = {}
+
+
+def as_days(dates):
+    """The dates, or datetimes, as a numpy array of days."""
+    return np.array(list(dates), dtype='datetime64[D]')
+
+
+def luxembourg_holidays(year):
+    """The sorted Luxembourg public holidays of the year, computed once per process."""
+    days = _luxembourg_holidays.get(year)
+    if days is None:
+        with _lock:
+            days = _luxembourg_holidays.get(year)
+            if days is None:
+                days = _luxembourg_holidays[year] = as_days(sorted(holidays.Luxembourg(years=year)))
+
+    return days
+
+
+def luxembourg_holidays_between(start_date, end_date):
+    return np.concatenate([luxembourg_holidays(year) for year in range(start_date.year, end_date.year + 1)])
+
+
+def week_days(starts, ends):
+    """Monday to Friday days from each start to each end, both included, 0 when the end is before the start."""
+    return np.maximum(np.busday_count(starts, ends + np.timedelta64(1, 'D')), 0)
+
+
+def days_in(days, starts, ends):
+    """How many of the sorted days fall between each start and end, both included."""
+    return np.maximum(np.searchsorted(days, ends, 'right') - np.searchsorted(days, starts, 'left'), 0)
+
+
+def leave_days(start_dates, end_dates):
+    """
+    The week days and the Luxembourg public holidays, week-ends included, of each (start date, end date) leave,
+    computed for all the leaves at once.
+    """
+    starts = as_days(start_dates)
+    ends = as_days(end_dates)
+    if not len(starts):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    lu_holidays = luxembourg_holidays_between(min(min(start_dates), min(end_dates)),
+                                              max(max(start_dates), max(end_dates)))
+
+    return week_days(starts, ends), days_in(lu_holidays, starts, ends)
+
+
+def leave_hours(start_date, end_date, daily_hours):
+    """The [hours, explanation] of a leave, its working days being paid daily_hours."""
+    days, public_holidays = (int(count[0]) for count in leave_days([start_date], [end_date]))
+
+    return [(days - public_holidays) * daily_hours,
+            "explication: ( %d jours congés - %d jours fériés )  x %d nombre h. /j" % (days,
+                                                                                       public_holidays,
+                                                                                       daily_hours)]
+
+
+def month_working_days(start_date, public_holidays):
+    """Week days of the month of start_date which are not one of the public_holidays dates."""
+    first_day = np.datetime64(start_date, 'M').astype('datetime64[D]')
+    next_month = (np.datetime64(start_date, 'M') + 1).astype('datetime64[D]')
+
+    return int(np.busday_count(first_day, next_month) - np.is_busday(as_days(public_holidays)).sum())
+
+
+def week_days_before_end(start_dates, end_dates):
+    """Monday to Friday days from each start included to each end excluded."""
+    return np.maximum(np.busday_count(as_days(start_dates), as_days(end_dates)), 0)
+
+
+def public_holiday_week_days(public_holidays):
+    return int(np.is_busday(as_days(public_holidays)).sum())